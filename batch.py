@@ -0,0 +1,285 @@
+# -#- coding: utf-8 -#-
+#
+# Copyright 2017 Mario Frasca <mario@anche.no>.
+#
+# This file is part of DistanceMatrixToCoordsDialog
+#
+# DistanceMatrixToCoordsDialog is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# DistanceMatrixToCoordsDialog is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with DistanceMatrixToCoordsDialog. If not, see
+# <http://www.gnu.org/licenses/>.
+#
+# solving plots from the command line, without qgis
+#
+# every distances csv file is a plot.  its reference points come from a
+# GeoJSON or csv (id,x,y) file, in a metric projected coordinate system,
+# which is also the system of the output.  with --fixed, references are
+# taken as exact, like the distances dialog does; otherwise the plot is
+# solved on its own and then fit onto them, like the gps dialog does.
+#
+#     python batch.py --references refs.geojson -o out plot1.csv plot2.csv
+
+import os
+import sys
+
+
+def read_reference_points(filename, key='code'):
+    """points dictionary from a GeoJSON or csv file
+
+    GeoJSON features are Point features, identified by their key property,
+    or by their id.  csv lines are id,x,y; other lines, like a header, are
+    skipped.
+
+    """
+    points = {}
+    if filename.lower().endswith(('.geojson', '.json')):
+        import json
+        with open(filename) as f:
+            collection = json.load(f)
+        for feature in collection.get('features', []):
+            geometry = feature.get('geometry') or {}
+            if geometry.get('type') != 'Point':
+                continue
+            point_id = (feature.get('properties') or {}).get(
+                key, feature.get('id'))
+            if point_id is None:
+                continue
+            x, y = geometry['coordinates'][:2]
+            points[str(point_id)] = {'code': str(point_id),
+                                     'coordinates': (float(x), float(y))}
+    else:
+        with open(filename) as f:
+            for line in f:
+                fields = [i.strip() for i in line.split(',')]
+                try:
+                    point_id, x, y = fields[:3]
+                    points[point_id] = {'code': point_id,
+                                        'coordinates': (float(x), float(y))}
+                except ValueError:
+                    continue
+    return points
+
+
+def write_points(filename, points, key='code'):
+    """write all points having coordinates, as GeoJSON or csv
+
+    the format follows the extension.  every point tells whether it was
+    computed.
+
+    """
+    placed = sorted(k for k, p in points.items()
+                    if p.get('coordinates') is not None)
+    if filename.lower().endswith(('.geojson', '.json')):
+        import json
+        features = []
+        for k in placed:
+            x, y = tuple(points[k]['coordinates'])[:2]
+            features.append({
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [x, y]},
+                'properties': {key: k,
+                               'computed': bool(points[k].get('computed'))}})
+        with open(filename, 'w') as f:
+            json.dump({'type': 'FeatureCollection', 'features': features}, f)
+    else:
+        with open(filename, 'w') as f:
+            f.write('%s,x,y,computed\n' % key)
+            for k in placed:
+                x, y = tuple(points[k]['coordinates'])[:2]
+                f.write('%s,%r,%r,%d\n' % (
+                    k, float(x), float(y), bool(points[k].get('computed'))))
+
+
+def solve_plot(job):
+    """solve one plot, job being (distances, references, output, options)
+
+    options is a dictionary with 'fixed', 'key' and 'robust'.  return a
+    summary dictionary; errors are reported there, not raised, so one bad
+    plot does not stop the others.
+
+    """
+    import time
+    from utils import load_distance_graph
+    from utils import extrapolate_coordinates
+    from utils import solve_components
+    from utils import coordinates_array
+    distances_file, references_file, output_file, options = job
+    start = time.time()
+    summary = {'plot': distances_file, 'output': output_file,
+               'points': 0, 'references': 0, 'computed': 0, 'missing': 0,
+               'malformed': 0, 'outliers': 0, 'components': 1,
+               'failed_components': 0, 'rms': None, 'error': None}
+    try:
+        references = read_reference_points(references_file, options['key'])
+        summary['references'] = len(references)
+        malformed = []
+        outliers = []
+        if options['fixed']:
+            points = references
+            distances = load_distance_graph(distances_file, points,
+                                            malformed)
+            extrapolate_coordinates(points, distances,
+                                    robust=options['robust'],
+                                    outliers=outliers)
+        else:
+            points = {}
+            distances = load_distance_graph(distances_file, points,
+                                            malformed)
+            # each plot in the file on its own, within this worker
+            results = solve_components(points, distances, references,
+                                       robust=options['robust'],
+                                       outliers=outliers)
+            summary['components'] = len(results)
+            failed = [r for r in results if r.error is not None]
+            summary['failed_components'] = len(failed)
+            if failed and len(failed) == len(results):
+                raise ValueError(failed[0].error)
+            keys = [k for k, p in points.items()
+                    if p.get('coordinates') is not None]
+            common = [k for k in keys if k in references]
+            if common:
+                import numpy as np
+                delta = (coordinates_array(points, common) -
+                         coordinates_array(references, common))
+                summary['rms'] = float(np.sqrt((delta * delta).sum(axis=1)
+                                               .mean()))
+        summary['points'] = len(points)
+        summary['computed'] = len([p for p in points.values()
+                                   if p.get('computed')])
+        summary['missing'] = len([p for p in points.values()
+                                  if p.get('coordinates') is None])
+        summary['malformed'] = len(malformed)
+        summary['outliers'] = len(outliers)
+        write_points(output_file, points, options['key'])
+    except Exception, e:
+        summary['error'] = '%s: %s' % (type(e).__name__, e)
+    summary['seconds'] = time.time() - start
+    return summary
+
+
+def plot_jobs(distances_files, references=None, output_dir=None,
+              output_format='geojson', **options):
+    """one solve_plot job per distances file
+
+    without references, each plot uses the GeoJSON or csv file next to
+    it, with the same name plus -references.  outputs go to output_dir,
+    default next to the input, with the same name plus -solved and the
+    output_format extension.
+
+    raise ValueError if an output would overwrite an input, or another
+    output.
+
+    """
+    jobs = []
+    for distances_file in distances_files:
+        base = os.path.splitext(distances_file)[0]
+        references_file = references
+        if references_file is None:
+            for extension in ['.geojson', '.json', '.csv']:
+                references_file = base + '-references' + extension
+                if os.path.exists(references_file):
+                    break
+        output_file = base + '-solved.' + output_format
+        if output_dir is not None:
+            output_file = os.path.join(output_dir,
+                                       os.path.basename(output_file))
+        jobs.append((distances_file, references_file, output_file, options))
+
+    inputs = set()
+    for distances_file, references_file, output_file, options in jobs:
+        inputs.update([os.path.realpath(distances_file),
+                       os.path.realpath(references_file)])
+    outputs = set()
+    for distances_file, references_file, output_file, options in jobs:
+        output = os.path.realpath(output_file)
+        if output in inputs:
+            raise ValueError('%s would overwrite an input' % output_file)
+        if output in outputs:
+            raise ValueError('%s is the output of two plots' % output_file)
+        outputs.add(output)
+    return jobs
+
+
+def solve_plots(jobs, processes=None):
+    """solve_plot all jobs, on a pool of processes unless processes is 1
+
+    return the summaries, in the order of jobs.
+
+    """
+    if processes == 1 or len(jobs) < 2:
+        return [solve_plot(job) for job in jobs]
+    import multiprocessing
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(solve_plot, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def format_summary(summary):
+    if summary['error'] is not None:
+        return '%(plot)s: FAILED %(error)s' % summary
+    details = ''
+    if summary.get('components', 1) > 1:
+        details += ', %(components)d components' % summary
+        if summary['failed_components']:
+            details += ' (%(failed_components)d failed)' % summary
+    if summary['rms'] is not None:
+        details += ', rms %.3f' % summary['rms']
+    return ('%(plot)s: %(computed)d computed, %(missing)d missing, '
+            '%(references)d references, %(malformed)d malformed rows, '
+            '%(outliers)d outliers' % summary +
+            details +
+            ', %.1fs -> %s' % (summary['seconds'], summary['output']))
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='compute tree coordinates from distances csv files')
+    parser.add_argument('distances', nargs='+',
+                        help='distances csv files, one per plot')
+    parser.add_argument('-r', '--references',
+                        help='GeoJSON or csv reference points, for all '
+                        'plots; default <plot>-references.geojson/csv')
+    parser.add_argument('-o', '--output-dir',
+                        help='where to write results, default next to input')
+    parser.add_argument('-f', '--format', default='geojson',
+                        choices=['geojson', 'csv'])
+    parser.add_argument('-k', '--key', default='code',
+                        help='GeoJSON property holding point ids')
+    parser.add_argument('--fixed', action='store_true',
+                        help='take references as exact, do not fit to them')
+    parser.add_argument('--robust', type=float, default=None,
+                        help='reject distances disagreeing by more than '
+                        'this many metres')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='worker processes, default one per cpu')
+    args = parser.parse_args(argv)
+
+    try:
+        jobs = plot_jobs(args.distances, args.references, args.output_dir,
+                         args.format, fixed=args.fixed, key=args.key,
+                         robust=args.robust)
+    except ValueError, e:
+        parser.error(str(e))
+    summaries = solve_plots(jobs, args.processes)
+    for summary in summaries:
+        print format_summary(summary)
+    failed = len([s for s in summaries if s['error'] is not None])
+    print '%d plots, %d failed' % (len(summaries), failed)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+# -#- coding: utf-8 -#-
+#
+# Copyright 2017 Mario Frasca <mario@anche.no>.
+#
+# This file is part of DistanceMatrixToCoordsDialog
+#
+# DistanceMatrixToCoordsDialog is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# DistanceMatrixToCoordsDialog is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with DistanceMatrixToCoordsDialog. If not, see
+# <http://www.gnu.org/licenses/>.
+#
+# writing many features to a layer data provider, a chunk at a time
+#
+# nothing here imports qgis: the provider only needs addFeatures and
+# deleteFeatures, as QgsVectorDataProvider has them.
+
+
+class FeatureWriter(object):
+    def __init__(self, provider, chunk_size=1000, policy='rollback',
+                 progress=None, is_cancelled=None):
+        """stream features to provider, chunk_size at a time
+
+        every chunk is one addFeatures call, so one short transaction on
+        database backed layers.  after each chunk progress(written, total)
+        is called, if given, and before each chunk is_cancelled(), if
+        given, may stop the write.  the policy applies to the write as a
+        whole: if it fails, raises or is cancelled, 'rollback' deletes the
+        features added by the previous chunks, 'commit' keeps them.
+
+        """
+        if policy not in ('rollback', 'commit'):
+            raise ValueError('unknown policy %s' % policy)
+        self.provider = provider
+        self.chunk_size = chunk_size
+        self.policy = policy
+        self.progress = progress
+        self.is_cancelled = is_cancelled
+
+    def write(self, features, total=None):
+        """add features, any iterable, to the provider
+
+        total is just passed on to progress.
+
+        return status and the ids of the features left in the layer;
+        status is 'done', 'cancelled' or 'failed'.  exceptions from the
+        provider are raised again, after applying the policy.
+
+        """
+        ids = []
+        # also what an exception leaves behind
+        status = 'failed'
+        try:
+            status = self._write_chunks(iter(features), total, ids)
+        finally:
+            if status != 'done' and self.policy == 'rollback' and ids:
+                self.provider.deleteFeatures(ids)
+                del ids[:]
+        return status, ids
+
+    def _write_chunks(self, features, total, ids):
+        # add features a chunk at a time, their ids to ids; return status
+        from itertools import islice
+        while True:
+            chunk = list(islice(features, self.chunk_size))
+            if not chunk:
+                return 'done'
+            # a write with nothing left to add is complete, not cancelled
+            if self.is_cancelled is not None and self.is_cancelled():
+                return 'cancelled'
+            ok, added = self.provider.addFeatures(chunk)
+            ids.extend(f.id() for f in added)
+            if not ok:
+                return 'failed'
+            if self.progress is not None:
+                self.progress(len(ids), total)
@@ -28,24 +28,185 @@
 
 import os
 
-from PyQt4 import QtGui, uic
+from PyQt4 import QtCore, QtGui, uic
 from PyQt4.QtGui import QFileDialog, QDialogButtonBox
+from PyQt4.QtCore import QVariant
 
 from utils import Heap
-from utils import get_distances_from_csv
+from utils import load_distance_graph
 from utils import utm_zone_proj4
 from utils import extrapolate_coordinates
-from utils import compute_minimal_distance_transformation
-from utils import place_initial_three_points
-from utils import rigid_transform_points
+from utils import incremental_extrapolate
+from utils import Provenance
+from utils import error_ellipses
+from utils import solve_state
+from utils import save_solve_state
+from utils import load_solve_state
+from utils import solve_components
+from utils import coordinates_array
+from utils import plan_write_back
+from feature_writer import FeatureWriter
 
 from qgis.core import (
     QgsCoordinateTransform, QgsCoordinateReferenceSystem,
-    QgsFeature, QgsGeometry, QgsPoint)
+    QgsFeature, QgsGeometry, QgsPoint, QgsField, QgsMessageLog)
+
+
+class Worker(QtCore.QObject):
+    """runs job(progress, is_cancelled) once, meant for a QThread
+
+    progress(percent, text) is forwarded as the progress signal; the
+    result of the job comes with the finished signal, None if it was
+    cancelled, and a traceback with failed if it raised.
+
+    """
+    progress = QtCore.pyqtSignal(int, str)
+    finished = QtCore.pyqtSignal(object)
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, job):
+        super(Worker, self).__init__()
+        self.job = job
+        self.cancelled = False
+
+    def cancel(self):
+        # set from the gui thread, read by the job between its steps
+        self.cancelled = True
+
+    # a slot, so that thread.started runs it on the worker's thread
+    @QtCore.pyqtSlot()
+    def run(self):
+        try:
+            result = self.job(self.progress.emit, lambda: self.cancelled)
+        except Exception:
+            import traceback
+            self.failed.emit(traceback.format_exc())
+            return
+        self.finished.emit(None if self.cancelled else result)
 
 
 class GhiniBaseDialog(QtGui.QDialog):
 
+    # features are written write_chunk_size at a time, see FeatureWriter,
+    # and selected afterwards only if not more than select_limit
+    write_chunk_size = 1000
+    write_policy = 'rollback'
+    select_limit = 10000
+    # the job running on a worker thread, see run_in_background
+    background = None
+
+    def write_features(self, provider, features, total):
+        """write features through a FeatureWriter, showing its progress
+
+        the message bar holds a progress bar and a button cancelling the
+        write between chunks.
+
+        """
+        from qgis.gui import QgsMessageBar
+        cancelled = []
+        message = self.iface.messageBar().createMessage("Writing features")
+        progress_bar = QtGui.QProgressBar()
+        progress_bar.setMaximum(max(total, 1))
+        cancel_button = QtGui.QPushButton("Cancel")
+        cancel_button.clicked.connect(lambda: cancelled.append(True))
+        message.layout().addWidget(progress_bar)
+        message.layout().addWidget(cancel_button)
+        self.iface.messageBar().pushWidget(message, QgsMessageBar.INFO)
+
+        def progress(written, total):
+            progress_bar.setValue(written)
+            # let the cancel button be clicked
+            QtGui.QApplication.processEvents()
+
+        writer = FeatureWriter(provider, self.write_chunk_size,
+                               self.write_policy, progress,
+                               lambda: bool(cancelled))
+        try:
+            return writer.write(features, total)
+        finally:
+            self.iface.messageBar().popWidget(message)
+
+    def background_busy(self):
+        """tell whether a job is running, warning the user if so
+
+        """
+        if self.background is None:
+            return False
+        from qgis.gui import QgsMessageBar
+        self.iface.messageBar().pushMessage(
+            "Warning", "still computing, wait or cancel first",
+            level=QgsMessageBar.WARNING)
+        return True
+
+    def run_in_background(self, job, done):
+        """run job on a Worker thread, then done(result) on the gui thread
+
+        the message bar shows progress and a cancel button meanwhile; done
+        is not called if the job is cancelled or fails.  only one job runs
+        at a time, see background_busy.
+
+        """
+        from qgis.gui import QgsMessageBar
+        message = self.iface.messageBar().createMessage("Computing")
+        progress_bar = QtGui.QProgressBar()
+        progress_bar.setMaximum(100)
+        cancel_button = QtGui.QPushButton("Cancel")
+        message.layout().addWidget(progress_bar)
+        message.layout().addWidget(cancel_button)
+        self.iface.messageBar().pushWidget(message, QgsMessageBar.INFO)
+
+        thread = QtCore.QThread()
+        worker = Worker(job)
+        worker.moveToThread(thread)
+        # keep everything alive while the thread runs
+        self.background = {'thread': thread, 'worker': worker,
+                           'message': message, 'progress_bar': progress_bar,
+                           'done': done}
+        # the dialog lives on the gui thread, so do its slots; the queued
+        # connections make that explicit
+        cancel_button.clicked.connect(self.cancel_background)
+        worker.progress.connect(self.on_background_progress,
+                                QtCore.Qt.QueuedConnection)
+        worker.finished.connect(self.on_background_finished,
+                                QtCore.Qt.QueuedConnection)
+        worker.failed.connect(self.on_background_failed,
+                              QtCore.Qt.QueuedConnection)
+        thread.started.connect(worker.run)
+        thread.start()
+
+    @QtCore.pyqtSlot()
+    def cancel_background(self):
+        # not a queued call to worker.cancel: its thread is busy
+        if self.background is not None:
+            self.background['worker'].cancel()
+
+    @QtCore.pyqtSlot(int, str)
+    def on_background_progress(self, percent, text):
+        if self.background is not None:
+            self.background['progress_bar'].setValue(percent)
+            self.background['message'].setText(text)
+
+    def stop_background(self):
+        background, self.background = self.background, None
+        background['thread'].quit()
+        background['thread'].wait()
+        self.iface.messageBar().popWidget(background['message'])
+        return background
+
+    @QtCore.pyqtSlot(object)
+    def on_background_finished(self, result):
+        background = self.stop_background()
+        if result is not None:
+            background['done'](result)
+
+    @QtCore.pyqtSlot(str)
+    def on_background_failed(self, text):
+        from qgis.gui import QgsMessageBar
+        self.stop_background()
+        self.iface.messageBar().pushMessage(
+            "Error", text.strip().splitlines()[-1],
+            level=QgsMessageBar.CRITICAL)
+
     def computeOKEnabled(self):
         is_valid_selection = self.key_name_cb.currentIndex() > 0
         is_valid_file = os.path.isfile(self.distances_le.text())
@@ -67,6 +228,17 @@ class DistanceMatrixToCoordsDialog(
             os.path.dirname(__file__),
             'ghini_tree_position_dialog_base.ui'))[0]):
 
+    # computed points closer than this many metres to an existing feature
+    # are handled according to duplicate_policy, see plan_write_back
+    duplicate_tolerance = 0.1
+    duplicate_policy = 'skip'
+    # attributes receiving the error ellipse of computed points, see
+    # error_ellipses, created on the layer if missing
+    error_fields = ['sigma_x', 'sigma_y', 'orientation']
+    # distances disagreeing by more than this many metres with the others
+    # measured to the same point are left out; None uses all distances
+    robust_tolerance = None
+
     def __init__(self, parent=None, iface=None):
         """Constructor."""
         super(DistanceMatrixToCoordsDialog, self).__init__(parent)
@@ -111,6 +283,8 @@ class DistanceMatrixToCoordsDialog(
 
     def run(self, *args, **kwargs):
         """Run method that performs all the real work"""
+        if self.background_busy():
+            return
 
         # work only on vector layers (where 0 means points)
         self.comboBox.clear()
@@ -142,60 +316,173 @@ class DistanceMatrixToCoordsDialog(
 
             # populate 'points' dict with projected coordinates
             points = {}
+            # and remember where existing features are
+            feature_ids = []
+            existing_xy = []
+            feature_of = {}
             for feature in layer.getFeatures():
                 # we work with local utm projection
                 easting_northing = transf.transform(
                     feature.geometry().asPoint())
                 point_id = feature[self.key_name]
-                points[point_id] = {'code': point_id,
-                                    'coordinates': easting_northing}
-
-            # get distances from csv file, and compute connectivity to
-            # referenced points
-            with open(self.distances_le.text()) as f:
-                distances = get_distances_from_csv(f, points)
-
-            # compute missing coordinates
-            extrapolate_coordinates(points, distances)
-
-            # remember editable status
-            wasEditable = layer.isEditable()
-            # force editable if not already editable
-            if not wasEditable:
-                layer.startEditing()
-
-            fields = layer.fields()
-
-            featureList = []
-            # now add the computed points to the layer
-            for p in [p for p in points.values() if p['computed']]:
-                x, y = p['coordinates']
+                xy = (easting_northing.x(), easting_northing.y())
+                points[point_id] = {'code': point_id, 'coordinates': xy}
+                feature_of[point_id] = len(feature_ids)
+                feature_ids.append(feature.id())
+                existing_xy.append(xy)
+            filename = self.distances_le.text()
+            # a state saved for other points is no base for this solve
+            origin = [layer.source(), self.key_name]
+
+            def solve(progress, is_cancelled):
+                # runs on a worker thread: no layer access here
+                progress(0, "reading distances")
+                # get distances from csv file, and compute connectivity to
+                # referenced points
+                malformed = []
+                distances = load_distance_graph(filename, points, malformed)
+                if is_cancelled():
+                    return None
+
+                # compute missing coordinates, only solving again what
+                # changed since last run on the same file
+                progress(20, "computing coordinates")
+                state_file = filename + '.state'
+                state = load_solve_state(state_file, origin)
+                outliers = []
+                parked = {}
+                if state is None:
+                    provenance = Provenance()
+                    extrapolate_coordinates(points, distances,
+                                            provenance=provenance,
+                                            robust=self.robust_tolerance,
+                                            outliers=outliers, parked=parked,
+                                            is_cancelled=is_cancelled)
+                    state = solve_state(points, distances, provenance)
+                    resolved = set(provenance.order())
+                else:
+                    state, resolved = incremental_extrapolate(
+                        points, distances, state,
+                        robust=self.robust_tolerance, outliers=outliers,
+                        parked=parked, is_cancelled=is_cancelled)
+                    provenance = Provenance.from_state(state)
+                # an interrupted solve is no base for the next one
+                if is_cancelled():
+                    return None
+                try:
+                    save_solve_state(state_file, state, origin)
+                except (IOError, OSError) as e:
+                    # next run solves everything again, no harm done
+                    QgsMessageLog.logMessage(
+                        "could not save %s: %s" % (state_file, e),
+                        "ghini", QgsMessageLog.WARNING)
+                # how far can we trust each computed point
+                progress(80, "estimating errors")
+                error_ellipses(points, provenance)
+
+                # computed points already in the layer are moved if they
+                # were solved again, the others are new
+                computed = sorted(k for k, p in points.items()
+                                  if p.get('computed') and k not in feature_of)
+                # do not blindly add computed points on top of existing ones
+                insert, moves, close_pairs = plan_write_back(
+                    coordinates_array(points, computed), existing_xy,
+                    self.duplicate_tolerance, self.duplicate_policy)
+                moves.extend((feature_of[k], tuple(points[k]['coordinates']))
+                             for k in sorted(resolved) if k in feature_of)
+                progress(100, "writing features")
+                return {'malformed': malformed, 'outliers': outliers,
+                        'parked': parked, 'resolved': resolved,
+                        'computed': computed, 'insert': insert,
+                        'moves': moves, 'close_pairs': close_pairs}
+
+            def write_back(solution):
+                self.write_back(layer, back_transf, points, feature_ids,
+                                feature_of, solution)
+
+            self.run_in_background(solve, write_back)
+
+    def write_back(self, layer, back_transf, points, feature_ids, feature_of,
+                   solution):
+        """put the result of the solve step in run back into layer
+
+        """
+        computed = solution['computed']
+        resolved = solution['resolved']
+        # remember editable status
+        wasEditable = layer.isEditable()
+        # force editable if not already editable
+        if not wasEditable:
+            layer.startEditing()
+
+        provider = layer.dataProvider()
+        missing_fields = [QgsField(name, QVariant.Double)
+                          for name in self.error_fields
+                          if layer.fieldNameIndex(name) == -1]
+        if missing_fields:
+            provider.addAttributes(missing_fields)
+            layer.updateFields()
+        fields = layer.fields()
+
+        def new_features():
+            for i in solution['insert']:
+                x, y = points[computed[i]]['coordinates']
                 layerPoint = back_transf.transform(QgsPoint(x, y))
                 feature = QgsFeature(fields)
                 feature.setGeometry(QgsGeometry.fromPoint(layerPoint))
-                feature[self.key_name] = p['code']
-                featureList.append(feature)
-
-            # bulk-add features to data provider associated to layer
-            (err, ids) = layer.dataProvider().addFeatures(featureList)
-            # set selection to new features - simplifies removing them in
-            # case user does not like the results
-            layer.setSelectedFeatures([i.id() for i in ids])
-
-            # some feedback about the result
-            still_missing = [p for p in points.values()
-                             if not p.get('coordinates')]
-            # TODO show the user which points we did not compute
-            from qgis.gui import QgsMessageBar
-            self.iface.messageBar().pushMessage(
-                "Info",
-                "success? %s; features added: %s; impossible to add: %s." % (
-                    err, len(ids), len(still_missing)),
-                level=QgsMessageBar.INFO)
-
-            # commit changes only if layer was not editable
-            if not wasEditable:
-                layer.commitChanges()
+                feature[self.key_name] = computed[i]
+                for name in self.error_fields:
+                    feature[name] = points[computed[i]][name]
+                yield feature
+
+        # now add the computed points to the layer, a chunk at a time
+        status, ids = self.write_features(provider, new_features(),
+                                          len(solution['insert']))
+        if status == 'done' or self.write_policy == 'commit':
+            # and move those existing features we update or merge
+            provider.changeGeometryValues(dict(
+                (feature_ids[j], QgsGeometry.fromPoint(
+                    back_transf.transform(QgsPoint(x, y))))
+                for j, (x, y) in solution['moves']))
+            # features solved again get their new error ellipse
+            provider.changeAttributeValues(dict(
+                (feature_ids[feature_of[k]], dict(
+                    (fields.indexFromName(name), points[k][name])
+                    for name in self.error_fields))
+                for k in resolved if k in feature_of))
+        # set selection to new features - simplifies removing them in
+        # case user does not like the results
+        if len(ids) <= self.select_limit:
+            layer.setSelectedFeatures(ids)
+
+        # some feedback about the result
+        still_missing = [p for p in points.values()
+                         if not p.get('coordinates')]
+        reasons = {}
+        for point_id, why in sorted(solution['parked'].items()):
+            reasons.setdefault(why.reason, []).append(point_id)
+        from qgis.gui import QgsMessageBar
+        self.iface.messageBar().pushMessage(
+            "Info",
+            "write %s; features added: %s; impossible to add: %s%s; "
+            "malformed rows: %s; close to existing features: %s, "
+            "to each other: %s (%s); "
+            "distances rejected as outliers: %s." % (
+                status, len(ids), len(still_missing),
+                ''.join(' (%s: %s)' % (
+                    reason, ', '.join(str(k) for k in point_ids[:5]))
+                    for reason, point_ids in sorted(reasons.items())),
+                len(solution['malformed']),
+                len([p for p in solution['close_pairs']
+                     if p[0] == 'existing']),
+                len([p for p in solution['close_pairs']
+                     if p[0] == 'computed']),
+                self.duplicate_policy, len(solution['outliers'])),
+            level=QgsMessageBar.INFO)
+
+        # commit changes only if layer was not editable
+        if not wasEditable:
+            layer.commitChanges()
 
     def select_input_file(self):
         filename = QFileDialog.getOpenFileName(
@@ -251,6 +538,8 @@ class GpsAndDistancesToAdjustedGpsDialog(
         self.distances_le.setText(filename)
 
     def run(self, *args, **kwargs):
+        if self.background_busy():
+            return
         # prepare the dialog box with data from the project
 
         self.gps_points_cb.clear()
@@ -289,48 +578,89 @@ class GpsAndDistancesToAdjustedGpsDialog(
                 easting_northing = transf.transform(
                     feature.geometry().asPoint())
                 point_id = feature[self.key_name]
-                gps_points[point_id] = {'code': point_id,
-                                        'coordinates': easting_northing}
-
-            # computed_points is our goal
-            computed_points = {}
-            # get distances from csv file, and initialize connectivity to 0
-            with open(self.distances_le.text()) as f:
-                distances = get_distances_from_csv(f, computed_points)
-
-            place_initial_three_points(computed_points, distances, gps_points)
-            extrapolate_coordinates(computed_points, distances)
-            t = compute_minimal_distance_transformation(computed_points,
-                                                        gps_points)
-            pts = rigid_transform_points(computed_points, *t)
-
-            # the two layers have the same set of fields, including 'code'
-            fields = target_layer.fields()
-
-            features = []
-            for key, pt in pts.items():
+                gps_points[point_id] = {
+                    'code': point_id,
+                    'coordinates': (easting_northing.x(),
+                                    easting_northing.y())}
+            filename = self.distances_le.text()
+
+            def solve(progress, is_cancelled):
+                # runs on a worker thread: no layer access here
+                progress(0, "reading distances")
+                # computed_points is our goal
+                computed_points = {}
+                # get distances from csv file, and initialize connectivity
+                # to 0
+                malformed = []
+                distances = load_distance_graph(
+                    filename, computed_points, malformed)
+                if is_cancelled():
+                    return None
+
+                progress(20, "computing coordinates")
+                # every plot in the file gets its own seed and fit; no
+                # process pool inside qgis, we are on a thread already
+                results = solve_components(computed_points, distances,
+                                           gps_points,
+                                           is_cancelled=is_cancelled)
+                if is_cancelled():
+                    return None
+                keys = sorted(k for k, p in computed_points.items()
+                              if p.get('coordinates') is not None)
+                xy = [list(computed_points[k]['coordinates']) for k in keys]
+                progress(100, "writing features")
+                return {'malformed': malformed, 'keys': keys, 'xy': xy,
+                        'components': results}
+
+            def write_back(solution):
+                self.write_back(target_layer, back_transf, solution)
+
+            self.run_in_background(solve, write_back)
+
+    def write_back(self, target_layer, back_transf, solution):
+        """put the result of the solve step in run into target_layer
+
+        """
+        # the two layers have the same set of fields, including 'code'
+        fields = target_layer.fields()
+
+        def new_features():
+            for key, (x, y) in zip(solution['keys'], solution['xy']):
                 new_pt = QgsFeature(fields)
                 new_pt['code'] = key
-                computed_pos = back_transf.transform(*pt['coordinates'])
+                computed_pos = back_transf.transform(x, y)
                 new_pt.setGeometry(QgsGeometry.fromPoint(computed_pos))
-                features.append(new_pt)
-
-            wasEditable = target_layer.isEditable()
-            if not wasEditable:
-                target_layer.startEditing()
-
-            # bulk-add features to data provider associated to layer
-            (err, ids) = target_layer.dataProvider().addFeatures(features)
-
-            # set selection to new features - simplifies removing them in
-            # case user does not like the results
-            target_layer.setSelectedFeatures([i.id() for i in ids])
-
-            if not wasEditable:
-                target_layer.commitChanges()
-
-            from qgis.gui import QgsMessageBar
-            self.iface.messageBar().pushMessage(
-                "Info",
-                "success? %s; features added: %s." % (err, len(ids)),
-                level=QgsMessageBar.INFO)
+                yield new_pt
+
+        wasEditable = target_layer.isEditable()
+        if not wasEditable:
+            target_layer.startEditing()
+
+        # add features to data provider associated to layer, a chunk at a
+        # time
+        status, ids = self.write_features(
+            target_layer.dataProvider(), new_features(),
+            len(solution['keys']))
+
+        # set selection to new features - simplifies removing them in
+        # case user does not like the results
+        if len(ids) <= self.select_limit:
+            target_layer.setSelectedFeatures(ids)
+
+        if not wasEditable:
+            target_layer.commitChanges()
+
+        from qgis.gui import QgsMessageBar
+        components = solution['components']
+        # a component failing leaves its points out, say which and why
+        failed = ["%s and %d more: %s" % (r.ids[0], len(r.ids) - 1, r.error)
+                  for r in components if r.error is not None]
+        message = (
+            "write %s; features added: %s; malformed rows: %s; "
+            "components: %s" % (status, len(ids), len(solution['malformed']),
+                                len(components)))
+        if failed:
+            message += " (%d failed: %s)" % (len(failed), "; ".join(failed))
+        self.iface.messageBar().pushMessage(
+            "Warning" if failed else "Info", message + ".",
+            level=QgsMessageBar.WARNING if failed else QgsMessageBar.INFO)
@@ -0,0 +1,146 @@
+import unittest
+from numpy.testing import assert_almost_equal
+
+import batch
+
+
+def write_plot(directory, name, offset=(0.0, 0.0), side=4,
+               references=('00', '01', '10', '33')):
+    """a side x side grid plot, distances csv and a references csv
+
+    return the true coordinates
+
+    """
+    import os
+    from math import sqrt
+    truth = {}
+    for i in range(side):
+        for j in range(side):
+            truth['%s%d%d' % (name, i, j)] = (
+                offset[0] + i * 1.0, offset[1] + j * 1.1 + (i % 2) * 0.3)
+    with open(os.path.join(directory, name + '.csv'), 'w') as f:
+        for a in sorted(truth):
+            for b in sorted(truth):
+                d = sqrt(sum((u - v) ** 2
+                             for u, v in zip(truth[a], truth[b])))
+                if a < b and d <= 2.5:
+                    f.write('%s,%s,%r\n' % (a, b, d))
+    with open(os.path.join(directory, name + '-references.csv'), 'w') as f:
+        f.write('id,x,y\n')
+        for k in references:
+            x, y = truth[name + k]
+            f.write('%s%s,%r,%r\n' % (name, k, x, y))
+    return truth
+
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        import os
+        return os.path.join(self.directory, name)
+
+    def test_reference_formats(self):
+        import json
+        with open(self.path('r.geojson'), 'w') as f:
+            json.dump({'type': 'FeatureCollection', 'features': [
+                {'type': 'Feature', 'id': 7,
+                 'geometry': {'type': 'Point', 'coordinates': [1, 2]},
+                 'properties': {'code': 'a'}},
+                {'type': 'Feature', 'id': 8,
+                 'geometry': {'type': 'Point', 'coordinates': [3, 4]},
+                 'properties': {}},
+                {'type': 'Feature', 'id': 9, 'geometry': None,
+                 'properties': {'code': 'c'}}]}, f)
+        points = batch.read_reference_points(self.path('r.geojson'))
+        self.assertEquals(sorted(points), ['8', 'a'])
+        self.assertEquals(points['a']['coordinates'], (1.0, 2.0))
+        batch.write_points(self.path('r.csv'), points)
+        self.assertEquals(batch.read_reference_points(self.path('r.csv')),
+                          points)
+
+    def test_fixed_plots_in_parallel(self):
+        first = write_plot(self.directory, 'a')
+        second = write_plot(self.directory, 'b', offset=(100.0, 50.0))
+        jobs = batch.plot_jobs([self.path('a.csv'), self.path('b.csv')],
+                               fixed=True, key='code', robust=None)
+        summaries = batch.solve_plots(jobs, processes=2)
+        self.assertEquals([s['error'] for s in summaries], [None, None])
+        self.assertEquals([s['computed'] for s in summaries], [12, 12])
+        for truth, summary in zip([first, second], summaries):
+            self.assertTrue(summary['output'].endswith('.geojson'))
+            points = batch.read_reference_points(summary['output'])
+            self.assertEquals(sorted(points), sorted(truth))
+            for k in truth:
+                assert_almost_equal(points[k]['coordinates'], truth[k])
+
+    def test_fit_to_references(self):
+        # like gps positions, all trees have one
+        truth = write_plot(self.directory, 'a', offset=(500.0, 200.0),
+                           references=['%d%d' % (i, j) for i in range(4)
+                                       for j in range(4)])
+        jobs = batch.plot_jobs([self.path('a.csv')], output_format='csv',
+                               fixed=False, key='code', robust=None)
+        summary, = batch.solve_plots(jobs)
+        self.assertEquals(summary['error'], None)
+        self.assertAlmostEquals(summary['rms'], 0)
+        points = batch.read_reference_points(summary['output'])
+        for k in truth:
+            assert_almost_equal(points[k]['coordinates'], truth[k])
+
+    def test_main_reports_failures(self):
+        write_plot(self.directory, 'a')
+        import sys
+        from StringIO import StringIO
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            status = batch.main([self.path('a.csv'), self.path('none.csv'),
+                                 '--fixed', '-f', 'csv', '-j', '1'])
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertEquals(status, 1)
+        self.assertTrue('12 computed' in output)
+        self.assertTrue('none.csv: FAILED' in output)
+        self.assertTrue('2 plots, 1 failed' in output)
+        self.assertTrue(self.path('a-solved.csv') in output)
+
+    def test_inputs_left_alone(self):
+        import os
+        write_plot(self.directory, 'a')
+        with open(self.path('a.csv')) as f:
+            distances = f.read()
+        with open(self.path('a-references.csv')) as f:
+            references = f.read()
+        import sys
+        from StringIO import StringIO
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            status = batch.main([self.path('a.csv'), '--fixed', '-f', 'csv'])
+        finally:
+            sys.stdout = stdout
+        self.assertEquals(status, 0)
+        with open(self.path('a.csv')) as f:
+            self.assertEquals(f.read(), distances)
+        with open(self.path('a-references.csv')) as f:
+            self.assertEquals(f.read(), references)
+        self.assertTrue(os.path.exists(self.path('a-solved.csv')))
+
+    def test_refuse_overwriting(self):
+        write_plot(self.directory, 'a')
+        write_plot(self.directory, 'a-solved')
+        self.assertRaises(ValueError, batch.plot_jobs,
+                          [self.path('a.csv'), self.path('a-solved.csv')],
+                          output_format='csv')
+        import os
+        os.mkdir(self.path('other'))
+        write_plot(self.path('other'), 'a')
+        self.assertRaises(ValueError, batch.plot_jobs,
+                          [self.path('a.csv'), self.path('other/a.csv')],
+                          output_dir=self.directory)
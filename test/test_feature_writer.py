@@ -0,0 +1,112 @@
+import unittest
+
+from feature_writer import FeatureWriter
+
+
+class FakeFeature(object):
+    def __init__(self, value):
+        self.value = value
+        self.fid = None
+
+    def id(self):
+        return self.fid
+
+
+class FakeProvider(object):
+    def __init__(self, fail_at=None, raise_at=None):
+        self.features = {}
+        self.calls = 0
+        self.fail_at = fail_at
+        self.raise_at = raise_at
+
+    def addFeatures(self, features):
+        self.calls += 1
+        if self.calls == self.fail_at:
+            return False, []
+        if self.calls == self.raise_at:
+            raise IOError('connection lost')
+        for f in features:
+            f.fid = len(self.features) + 100
+            self.features[f.fid] = f
+        return True, features
+
+    def deleteFeatures(self, ids):
+        for i in ids:
+            del self.features[i]
+        return True
+
+
+class FeatureWriterTest(unittest.TestCase):
+    def features(self, n):
+        return (FakeFeature(i) for i in range(n))
+
+    def test_chunks_and_progress(self):
+        provider = FakeProvider()
+        seen = []
+        writer = FeatureWriter(provider, chunk_size=4,
+                               progress=lambda n, total: seen.append(n))
+        status, ids = writer.write(self.features(10), 10)
+        self.assertEquals(status, 'done')
+        self.assertEquals(provider.calls, 3)
+        self.assertEquals(seen, [4, 8, 10])
+        self.assertEquals(sorted(ids), sorted(provider.features))
+        self.assertEquals(len(ids), 10)
+
+    def test_empty(self):
+        provider = FakeProvider()
+        status, ids = FeatureWriter(provider).write([])
+        self.assertEquals((status, ids), ('done', []))
+        self.assertEquals(provider.calls, 0)
+
+    def test_cancel_rolls_back(self):
+        provider = FakeProvider()
+        writer = FeatureWriter(provider, chunk_size=3,
+                               is_cancelled=lambda: provider.calls == 2)
+        status, ids = writer.write(self.features(10))
+        self.assertEquals(status, 'cancelled')
+        self.assertEquals(provider.calls, 2)
+        self.assertEquals(ids, [])
+        self.assertEquals(provider.features, {})
+
+    def test_cancel_commits(self):
+        provider = FakeProvider()
+        writer = FeatureWriter(provider, chunk_size=3, policy='commit',
+                               is_cancelled=lambda: provider.calls == 2)
+        status, ids = writer.write(self.features(10))
+        self.assertEquals(status, 'cancelled')
+        self.assertEquals(len(ids), 6)
+        self.assertEquals(sorted(ids), sorted(provider.features))
+
+    def test_cancel_after_last_chunk(self):
+        provider = FakeProvider()
+        writer = FeatureWriter(provider, chunk_size=5,
+                               is_cancelled=lambda: provider.calls == 2)
+        status, ids = writer.write(self.features(10))
+        self.assertEquals(status, 'done')
+        self.assertEquals(len(ids), 10)
+        self.assertEquals(sorted(ids), sorted(provider.features))
+
+    def test_exception_rolls_back(self):
+        provider = FakeProvider(raise_at=3)
+        writer = FeatureWriter(provider, chunk_size=2)
+        self.assertRaises(IOError, writer.write, self.features(10))
+        self.assertEquals(provider.calls, 3)
+        self.assertEquals(provider.features, {})
+
+    def test_exception_commits(self):
+        provider = FakeProvider(raise_at=3)
+        writer = FeatureWriter(provider, chunk_size=2, policy='commit')
+        self.assertRaises(IOError, writer.write, self.features(10))
+        self.assertEquals(len(provider.features), 4)
+
+    def test_failure_rolls_back(self):
+        provider = FakeProvider(fail_at=3)
+        writer = FeatureWriter(provider, chunk_size=2)
+        status, ids = writer.write(self.features(10))
+        self.assertEquals(status, 'failed')
+        self.assertEquals(ids, [])
+        self.assertEquals(provider.features, {})
+
+    def test_unknown_policy(self):
+        self.assertRaises(ValueError, FeatureWriter, FakeProvider(),
+                          policy='maybe')
@@ -9,8 +9,10 @@
 """
 
 import unittest
+from PyQt4.QtCore import QThread, QEventLoop, QTimer
 from PyQt4.QtGui import QDialogButtonBox, QDialog
 from ghini_tree_position_dialog import DistanceMatrixToCoordsDialog
+from ghini_tree_position_dialog import Worker
 from utilities import get_qgis_app
 
 __author__ = 'mario@anche.no'
@@ -53,6 +55,61 @@ class DistanceMatrixToCoordsDialogTest(unittest.TestCase):
         result = self.dialog.result()
         self.assertEqual(result, QDialog.Rejected)
 
+
+class WorkerTest(unittest.TestCase):
+    """Test jobs report back through the worker signals."""
+
+    def run_worker(self, job, cancel=False):
+        worker = Worker(job)
+        seen = []
+        worker.progress.connect(
+            lambda percent, text: seen.append(('progress', percent, text)))
+        worker.finished.connect(lambda result: seen.append(('finished',
+                                                            result)))
+        worker.failed.connect(lambda text: seen.append(('failed', text)))
+        if cancel:
+            worker.cancel()
+        worker.run()
+        return seen
+
+    def test_finished(self):
+        def job(progress, is_cancelled):
+            progress(50, 'half way')
+            return 42
+        self.assertEqual(self.run_worker(job),
+                         [('progress', 50, 'half way'), ('finished', 42)])
+
+    def test_failed(self):
+        def job(progress, is_cancelled):
+            raise ValueError('no usable 3clique')
+        seen = self.run_worker(job)
+        self.assertEqual([s[0] for s in seen], ['failed'])
+        self.assertTrue('ValueError: no usable 3clique' in seen[0][1])
+
+    def test_cancelled(self):
+        def job(progress, is_cancelled):
+            self.assertTrue(is_cancelled())
+            return 42
+        self.assertEqual(self.run_worker(job, cancel=True),
+                         [('finished', None)])
+
+    def test_on_thread(self):
+        thread = QThread()
+        worker = Worker(lambda progress, is_cancelled: int(
+            QThread.currentThread() is thread))
+        worker.moveToThread(thread)
+        loop = QEventLoop()
+        seen = []
+        worker.finished.connect(seen.append)
+        worker.finished.connect(loop.quit)
+        thread.started.connect(worker.run)
+        QTimer.singleShot(5000, loop.quit)
+        thread.start()
+        loop.exec_()
+        thread.quit()
+        thread.wait()
+        self.assertEqual(seen, [1])
+
 if __name__ == "__main__":
     suite = unittest.makeSuite(DistanceMatrixToCoordsDialogTest)
     runner = unittest.TextTestRunner(verbosity=2)
@@ -0,0 +1,167 @@
+# coding=utf-8
+
+import unittest
+from numpy.testing import assert_almost_equal
+from utils import DistanceGraph
+from utils import enumerate_3cliques
+from utils import most_connected_3clique
+from utils import extrapolate_coordinates
+from utils import get_distances_from_csv
+from utils import connected_components
+
+
+class TestDistanceGraph(unittest.TestCase):
+
+    def setUp(self):
+        self.graph = DistanceGraph.from_edges(
+            [('b', 'a', 3.0), ('a', 'c', 4.0), ('c', 'b', 5.0),
+             ('d', 'c', 1.0), ('a', 'b', 3.5)], ids=['e'])
+
+    def test_interned_sorted(self):
+        self.assertEquals(self.graph.ids, ['a', 'b', 'c', 'd', 'e'])
+        self.assertEquals(self.graph.index['c'], 2)
+        self.assertEquals(list(self.graph.indptr), [0, 2, 4, 7, 8, 8])
+        self.assertEquals(list(self.graph.degrees()), [2, 2, 3, 1, 0])
+
+    def test_neighbours_and_weights(self):
+        self.assertEquals(list(self.graph.neighbours(2)), [0, 1, 3])
+        self.assertEquals(list(self.graph.neighbour_weights(2)),
+                          [4.0, 5.0, 1.0])
+        self.assertEquals(list(self.graph.neighbours(4)), [])
+
+    def test_last_distance_wins(self):
+        self.assertEquals(self.graph['a']['b'], 3.5)
+        self.assertEquals(self.graph['b']['a'], 3.5)
+
+    def test_mapping_facade(self):
+        self.assertEquals(sorted(self.graph), ['a', 'b', 'c', 'd', 'e'])
+        self.assertTrue('a' in self.graph)
+        self.assertFalse('z' in self.graph)
+        self.assertEquals(sorted(self.graph['c']), ['a', 'b', 'd'])
+        self.assertEquals(dict(self.graph['c']),
+                          {'a': 4.0, 'b': 5.0, 'd': 1.0})
+        self.assertTrue('d' in self.graph['c'])
+        self.assertFalse('e' in self.graph['c'])
+        self.assertFalse('z' in self.graph['c'])
+        self.assertEquals(self.graph.get('z', {}), {})
+        self.assertRaises(KeyError, lambda: self.graph['c']['e'])
+
+    def test_edges(self):
+        src, dst, weights = self.graph.edges()
+        self.assertEquals(zip(src, dst, weights),
+                          [(0, 1, 3.5), (0, 2, 4.0), (1, 2, 5.0), (2, 3, 1.0)])
+
+    def test_from_distances(self):
+        graph = DistanceGraph.from_distances(
+            {'a': {'b': 1.0}, 'b': {'a': 1.0}, 'c': {}})
+        self.assertEquals(graph.ids, ['a', 'b', 'c'])
+        self.assertEquals(graph['b']['a'], 1.0)
+
+    def test_subgraph(self):
+        sub = self.graph.subgraph(['c', 'a', 'd'])
+        self.assertEquals(sub.ids, ['a', 'c', 'd'])
+        self.assertEquals(dict(sub['c']), {'a': 4.0, 'd': 1.0})
+        self.assertEquals(dict(sub['a']), {'c': 4.0})
+        self.assertEquals(list(sub.indptr), [0, 1, 3, 4])
+        self.assertEquals(self.graph.subgraph([]).ids, [])
+
+    def test_connected_components(self):
+        graph = DistanceGraph.from_edges(
+            [('x', 'y', 1.0), ('y', 'z', 1.0), ('b', 'a', 3.0),
+             ('a', 'c', 4.0), ('d', 'c', 1.0)], ids=['e', 'w'])
+        self.assertEquals(connected_components(graph),
+                          [['a', 'b', 'c', 'd'], ['x', 'y', 'z'],
+                           ['e'], ['w']])
+        self.assertEquals(
+            connected_components({'a': {'b': 1}, 'b': {'a': 1}, 'c': {}}),
+            [['a', 'b'], ['c']])
+
+
+class TestExistingFunctionsOnGraph(unittest.TestCase):
+
+    def test_cliques(self):
+        graph = DistanceGraph.from_edges(
+            [('1', '2', 0), ('2', '3', 0), ('3', '1', 0),
+             ('4', '2', 0), ('3', '4', 0)])
+        self.assertEquals(list(enumerate_3cliques(graph)),
+                          [('1', '2', '3'), ('2', '3', '4')])
+        self.assertEquals(most_connected_3clique(graph), ('2', '3', '4'))
+
+    def test_extrapolate(self):
+        points = {'0': {'coordinates': (4, 0)},
+                  'A': {'coordinates': (0, 0)},
+                  'B': {'coordinates': (0, 3)},
+                  'C': {'coordinates': (0, 6)}}
+        from StringIO import StringIO
+        s = StringIO('x,0,3\nx,A,5\nx,B,4\n'
+                     'y,x,3\ny,B,5\ny,C,4\n')
+        graph = DistanceGraph.from_distances(get_distances_from_csv(s, points))
+        extrapolate_coordinates(points, graph)
+        assert_almost_equal(points['x']['coordinates'], (4.0, 3.0))
+        assert_almost_equal(points['y']['coordinates'], (4.0, 6.0))
+
+
+class TestGraphCache(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.dir = tempfile.mkdtemp()
+        import os
+        self.csv = os.path.join(self.dir, 'distances.csv')
+        with open(self.csv, 'w') as f:
+            f.write('f,t,d\n14,24,3\n14,25,4\n24,25,5\n')
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.dir)
+
+    def test_sidecar_written_and_mapped(self):
+        import os
+        import numpy as np
+        from utils import load_distance_graph
+        errors = []
+        graph = load_distance_graph(self.csv, {}, errors)
+        self.assertTrue(os.path.exists(self.csv + '.graph'))
+        self.assertFalse(isinstance(graph.indices, np.memmap))
+        cached_errors = []
+        points = {'14': {'coordinates': (0, 0)}}
+        cached = load_distance_graph(self.csv, points, cached_errors)
+        self.assertTrue(isinstance(cached.indices, np.memmap))
+        self.assertEquals(cached.ids, graph.ids)
+        self.assertEquals(list(cached.indptr), list(graph.indptr))
+        self.assertEquals(list(cached.weights), list(graph.weights))
+        self.assertEquals(cached['25']['24'], 5)
+        self.assertEquals(cached_errors, errors)
+        self.assertEquals(cached_errors[0].line_number, 1)
+        self.assertEquals(points['24']['prio'], 1)
+        self.assertEquals(points['14']['prio'], 0)
+
+    def test_sidecar_non_ascii_malformed_row(self):
+        from utils import load_distance_graph
+        with open(self.csv, 'a') as f:
+            f.write('\xe1rbol,B,x\n')
+        errors = []
+        graph = load_distance_graph(self.csv, {}, errors)
+        cached_errors = []
+        cached = load_distance_graph(self.csv, {}, cached_errors)
+        self.assertEquals(cached.ids, graph.ids)
+        self.assertEquals(cached_errors, errors)
+        self.assertEquals(cached_errors[1].text, '\xe1rbol,B,x')
+
+    def test_sidecar_stale(self):
+        import os
+        from utils import load_distance_graph
+        load_distance_graph(self.csv, {})
+        with open(self.csv, 'a') as f:
+            f.write('25,26,1\n')
+        graph = load_distance_graph(self.csv, {})
+        self.assertEquals(graph.ids, ['14', '24', '25', '26'])
+        os.utime(self.csv, (0, 0))
+        self.assertEquals(load_distance_graph(self.csv, {}).ids, graph.ids)
+
+    def test_sidecar_damaged(self):
+        from utils import load_distance_graph
+        with open(self.csv + '.graph', 'w') as f:
+            f.write('rubbish')
+        graph = load_distance_graph(self.csv, {})
+        self.assertEquals(graph.ids, ['14', '24', '25'])
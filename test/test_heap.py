@@ -1,6 +1,6 @@
 import unittest
 
-from utils import Heap
+from utils import Heap, IndexedHeap
 
 
 class HeapTest(unittest.TestCase):
@@ -97,3 +97,45 @@ class HeapTest(unittest.TestCase):
         self.assertEquals(i.priorities(), [3, 1, 2])
         i._swap(0, 1)
         self.assertEquals(i.priorities(), [1, 3, 2])
+
+
+class IndexedHeapTest(unittest.TestCase):
+    def test_init_heapify(self):
+        i = IndexedHeap([1, 2, 3, 4, 5, 7])
+        self.assertEquals(i.priorities(), [7, 5, 3, 4, 2, 1])
+        self.assertEquals(len(i), 6)
+
+    def test_init_subset(self):
+        i = IndexedHeap([1, 2, 3, 4, 5, 7], [0, 2, 4])
+        self.assertEquals(len(i), 3)
+        self.assertTrue(0 in i)
+        self.assertFalse(1 in i)
+        self.assertFalse(17 in i)
+        self.assertEquals([i.pop() for k in range(3)], [4, 2, 0])
+
+    def test_pop_order(self):
+        prios = [4, 1, 7, 3, 9, 0, 2]
+        i = IndexedHeap(prios)
+        result = [i.pop() for k in range(len(prios))]
+        self.assertEquals([prios[k] for k in result], [9, 7, 4, 3, 2, 1, 0])
+        self.assertEquals(len(i), 0)
+        self.assertFalse(4 in i)
+
+    def test_push_grows(self):
+        i = IndexedHeap()
+        i.push(3, 5)
+        i.push(0, 8)
+        i.push(7, 1)
+        self.assertTrue(7 in i)
+        self.assertFalse(5 in i)
+        self.assertEquals(i.pop(), 0)
+        self.assertEquals(i.pop(), 3)
+        self.assertEquals(i.pop(), 7)
+
+    def test_reprioritize(self):
+        i = IndexedHeap([1, 2, 3, 4, 5, 7])
+        i.reprioritize(0, 10)
+        self.assertEquals(i.priority(0), 11)
+        self.assertEquals(i.pop(), 0)
+        i.reprioritize(5, -10)
+        self.assertEquals([i.pop() for k in range(5)], [4, 3, 2, 1, 5])
@@ -47,6 +47,26 @@ class TestEnumerate3Cliques(unittest.TestCase):
         expect = [('1', '2', '3'), ('2', '3', '4')]
         self.assertEquals(list(enumerate_3cliques(ftd)), expect)
 
+    def test_enumerate_3cliques_unsorted(self):
+        from_to = [('1', '2'), ('2', '3'), ('3', '1'),
+                   ('4', '2'), ('3', '4'), ('5', '1')]
+        ftd = compute_from_to_dictionary(from_to)
+        result = list(enumerate_3cliques(ftd, sort=False))
+        self.assertEquals(sorted(result), [('1', '2', '3'), ('2', '3', '4')])
+
+    def test_enumerate_3cliques_brute_force(self):
+        import random
+        from itertools import combinations
+        rnd = random.Random(17)
+        nodes = ['%02d' % i for i in range(25)]
+        from_to = [(a, b) for a, b in combinations(nodes, 2)
+                   if rnd.random() < 0.3]
+        ftd = compute_from_to_dictionary(from_to)
+        expect = [(a, b, c) for a, b, c in combinations(nodes, 3)
+                  if b in ftd.get(a, {}) and c in ftd.get(a, {}) and
+                  c in ftd.get(b, {})]
+        self.assertEquals(list(enumerate_3cliques(ftd)), expect)
+
 
 class TestMostConnectedPoint(unittest.TestCase):
     def setUp(self):
@@ -79,9 +99,66 @@ class TestMostConnectedPoint(unittest.TestCase):
         expect = ('04', '10', '18')
         self.assertEquals(most_connected_3clique(ftd), expect)
 
+    def test_top_k_cliques(self):
+        from utils import most_connected_3cliques
+        ftd = compute_from_to_dictionary(self.from_to)
+        best = most_connected_3cliques(ftd, 3)
+        self.assertEquals(len(best), 3)
+        self.assertEquals(best[0], (1, ('12', '16', '21')))
+        self.assertEquals([r for r, c in best],
+                          sorted([r for r, c in best], reverse=True))
+        self.assertEquals(best[:1], most_connected_3cliques(ftd))
+
+    def test_top_k_cliques_brute_force(self):
+        from utils import most_connected_3cliques
+        ftd = compute_from_to_dictionary(self.from_to)
+        expect = sorted(
+            ((len(set(ftd[a]).intersection(ftd[b]).intersection(ftd[c])),
+              (a, b, c)) for a, b, c in enumerate_3cliques(ftd)),
+            reverse=True)
+        self.assertEquals(most_connected_3cliques(ftd, 100), expect)
+
+    def test_no_clique(self):
+        ftd = compute_from_to_dictionary([('1', '2'), ('2', '3')])
+        self.assertRaises(ValueError, most_connected_3clique, ftd)
+
 
 class TestInitialTriangle(unittest.TestCase):
 
+    def test_degenerate_seed_skipped(self):
+        points = dict((k, {'id': k}) for k in ['p1', 'p2', 'p3', 'p4'])
+        proj_gps = {'p1': {'coordinates': (0.0, 0.0)},
+                    'p2': {'coordinates': (7.0, 0.0)},
+                    'p3': {'coordinates': (0.0, 7.0)},
+                    'p4': {'coordinates': (7.0, 7.0)}, }
+        # p2-p3-p4 breaks the triangle inequality, and ranks highest
+        distances = {'p1': {'p2': 5.0, 'p3': 4.0},
+                     'p2': {'p1': 5.0, 'p3': 3.0, 'p4': 1.0},
+                     'p3': {'p1': 4.0, 'p2': 3.0, 'p4': 1.0},
+                     'p4': {'p2': 1.0, 'p3': 1.0}, }
+        place_initial_three_points(points, distances, proj_gps)
+        self.assertEquals(points['p2']['coordinates'], (5.0, 0.0))
+        assert_almost_equal(points['p3']['coordinates'], (3.2, 2.4))
+        self.assertFalse('coordinates' in points['p4'])
+
+    def test_seed_beyond_the_best_few(self):
+        # many better connected cliques, but gps only in a far corner
+        from math import sqrt
+        truth = dict(('%d%d' % (i, j), (i * 1.0, j * 1.0))
+                     for i in range(6) for j in range(6))
+        distances = {}
+        for a in truth:
+            for b in truth:
+                d = sqrt(sum((u - v) ** 2
+                             for u, v in zip(truth[a], truth[b])))
+                if a != b and d <= 2.5:
+                    distances.setdefault(a, {})[b] = d
+        points = dict((k, {'id': k}) for k in truth)
+        gps = dict((k, {'coordinates': truth[k]}) for k in ['55', '54', '45'])
+        place_initial_three_points(points, distances, gps)
+        self.assertEquals(sorted(k for k, p in points.items()
+                                 if 'coordinates' in p), ['45', '54', '55'])
+
     def test_345_right(self):
         points = {
             'p1': {'id': 'p1'},
@@ -253,6 +330,78 @@ class TestInitialTriangle(unittest.TestCase):
         assert_almost_equal(points['p3']['coordinates'], (1, 5))
 
 
+def complete_survey(truth):
+    """all mutual distances among points in truth"""
+    from math import sqrt
+    distances = {}
+    for a in truth:
+        for b in truth:
+            if a != b:
+                distances.setdefault(a, {})[b] = sqrt(
+                    sum((u - v) ** 2 for u, v in zip(truth[a], truth[b])))
+    return distances
+
+
+class TestLandmarkMDS(unittest.TestCase):
+
+    def setUp(self):
+        import random
+        rnd = random.Random(11)
+        self.truth = dict(('p%02d' % i, (rnd.uniform(0, 30),
+                                         rnd.uniform(0, 30)))
+                          for i in range(12))
+
+    def test_embedding_keeps_distances(self):
+        from utils import landmark_mds
+        from math import sqrt
+        distances = complete_survey(self.truth)
+        ids, X = landmark_mds(distances, landmarks=5)
+        self.assertEquals(sorted(ids), sorted(self.truth))
+        for i, a in enumerate(ids):
+            for j, b in enumerate(ids):
+                if i < j:
+                    assert_almost_equal(
+                        sqrt(((X[i] - X[j]) ** 2).sum()), distances[a][b])
+
+    def test_place_points_by_mds(self):
+        from utils import place_points_by_mds
+        distances = complete_survey(self.truth)
+        # mirror the gps frame, handedness must be recovered
+        gps = dict((k, {'coordinates': (-x, y)})
+                   for k, (x, y) in self.truth.items()[:4])
+        points = dict((k, {'id': k}) for k in self.truth)
+        self.assertEquals(place_points_by_mds(points, distances, gps), 12)
+        for k, (x, y) in self.truth.items():
+            assert_almost_equal(points[k]['coordinates'], (-x, y))
+            self.assertTrue(points[k]['computed'])
+
+    def test_place_points_by_mds_keeps_references(self):
+        from utils import place_points_by_mds
+        distances = complete_survey(self.truth)
+        gps = dict((k, {'coordinates': xy})
+                   for k, xy in self.truth.items()[:4])
+        points = dict((k, {'id': k}) for k in self.truth)
+        reference = self.truth.keys()[5]
+        x, y = self.truth[reference]
+        points[reference]['coordinates'] = (x + 0.5, y)
+        self.assertEquals(place_points_by_mds(points, distances, gps), 11)
+        self.assertEquals(points[reference]['coordinates'], (x + 0.5, y))
+        self.assertFalse('computed' in points[reference])
+
+    def test_only_first_component(self):
+        from utils import landmark_mds
+        distances = complete_survey(self.truth)
+        distances['q1'] = {'q2': 1.0}
+        distances['q2'] = {'q1': 1.0}
+        ids, X = landmark_mds(distances)
+        self.assertEquals(sorted(ids), sorted(self.truth))
+
+    def test_too_small(self):
+        from utils import landmark_mds
+        distances = {'a': {'b': 1.0}, 'b': {'a': 1.0}}
+        self.assertRaises(ValueError, landmark_mds, distances)
+
+
 class TestRigidTransformation(unittest.TestCase):
 
     def test_rigid_transform_points_no_movement(self):
@@ -335,6 +484,38 @@ class TestRigidTransformation(unittest.TestCase):
         assert_almost_equal(p['p2']['coordinates'], (4.0, 5.0))
         assert_almost_equal(p['p3']['coordinates'], (1.0, 5.0))
 
+    def test_rigid_transform_points_without_coordinates(self):
+        p = {'p1': {'coordinates': (1.0, 1.0)},
+             'p2': {'id': 'p2'}}
+        q = rigid_transform_points(p, x=10, y=10, theta=90)
+        assert_almost_equal(q['p1']['coordinates'], (9.0, 11.0))
+        self.assertEquals(q['p2'], {'id': 'p2'})
+        self.assertFalse(q['p2'] is p['p2'])
+
+
+class TestRigidTransformArray(unittest.TestCase):
+
+    def test_rigid_transform_array(self):
+        import numpy as np
+        from utils import rigid_transform_array
+        xy = np.array([[1.0, 1.0], [4.0, 5.0], [1.0, 5.0]])
+        result = rigid_transform_array(xy, 10, 10, 90)
+        assert_almost_equal(result, [[9, 11], [5, 14], [5, 11]])
+        assert_almost_equal(xy, [[1, 1], [4, 5], [1, 5]])
+
+    def test_rigid_transform_array_out(self):
+        import numpy as np
+        from utils import rigid_transform_array
+        xy = np.array([[1.0, 0.0], [0.0, 1.0], [1.0, 1.0]])
+        out = np.empty(xy.shape)
+        result = rigid_transform_array(xy, 0, 0, 45, out=out)
+        self.assertTrue(result is out)
+        assert_almost_equal(out, [[.70710678, .70710678],
+                                  [-.70710678, .70710678],
+                                  [0, 1.41421356]])
+        rigid_transform_array(xy, 1, 2, 0, out=out)
+        assert_almost_equal(out, [[2, 2], [1, 3], [2, 3]])
+
 
 class TestDistanceBetweenHomonyms(unittest.TestCase):
 
@@ -368,9 +549,53 @@ class TestDistanceBetweenHomonyms(unittest.TestCase):
         distance = distance_between_homonyms(p, q)
         assert_almost_equal(distance, 4.0)
 
+    def test_distance_between_homonyms_partial(self):
+        p = {'p1': {'coordinates': (1.0, 1.0)},
+             'p2': {'coordinates': (4.0, 5.0)},
+             'p3': {'coordinates': (1.0, 5.0)}, }
+        q = {'p2': {'coordinates': (4.0, 7.0)},
+             'p3': {'coordinates': (1.0, 4.0)},
+             'p4': {'coordinates': (1.0, 4.0)}, }
+        assert_almost_equal(distance_between_homonyms(p, q), 5.0)
+
+    def test_distance_between_homonyms_weights(self):
+        p = {'p1': {'coordinates': (1.0, 1.0)},
+             'p2': {'coordinates': (4.0, 5.0)},
+             'p3': {'coordinates': (1.0, 5.0)}, }
+        q = {'p1': {'coordinates': (1.0, 1.0)},
+             'p2': {'coordinates': (4.0, 7.0)},
+             'p3': {'coordinates': (1.0, 4.0)}, }
+        distance = distance_between_homonyms(p, q, {'p2': 0.5})
+        assert_almost_equal(distance, 3.0)
+
+    def test_homonym_index(self):
+        import numpy as np
+        from utils import HomonymIndex
+        index = HomonymIndex(['b', 'c', 'a'], ['c', 'd', 'b'])
+        self.assertEquals(index.ids, ['b', 'c'])
+        self.assertEquals(list(index.p_rows), [0, 1])
+        self.assertEquals(list(index.q_rows), [2, 0])
+        P = np.array([[0.0, 0.0], [1.0, 1.0], [9.0, 9.0]])
+        Q = np.array([[1.0, 2.0], [5.0, 5.0], [0.0, 3.0]])
+        self.assertEquals(index.ssd(P, Q), 10.0)
+        self.assertEquals(index.ssd(P, Q, np.array([1.0, 0.0])), 9.0)
+
 
 class TestMinimalDistanceTransformation(unittest.TestCase):
 
+    def test_compute_minimal_distance_transformation_weights(self):
+        p = {'p1': {'coordinates': (0.0, 0.0)},
+             'p2': {'coordinates': (1.0, 0.0)},
+             'p3': {'coordinates': (0.0, 1.0)}, }
+        q = {'p1': {'coordinates': (1.0, 0.0)},
+             'p2': {'coordinates': (2.0, 0.0)},
+             'p3': {'coordinates': (3.0, 3.0)}, }
+        weights = {'p3': 0.0}
+        for method in ['svd', 'powell']:
+            t = compute_minimal_distance_transformation(
+                p, q, method, weights)
+            assert_almost_equal(t, (1.0, 0.0, 0.0), decimal=4)
+
     def test_compute_minimal_distance_transformation_null(self):
         p = {'p1': {'coordinates': (1.0, 1.0)},
              'p2': {'coordinates': (4.0, 5.0)},
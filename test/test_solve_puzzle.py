@@ -3,11 +3,25 @@
 import unittest
 from numpy.testing import assert_almost_equal
 from utils import get_distances_from_csv
+from utils import read_distance_graph
 from utils import utm_zone_proj4
 from utils import extrapolate_coordinates
+from utils import extrapolate_coordinates_by_levels
+from utils import adjust_network
+from utils import Provenance
+from utils import solve_state
+from utils import error_ellipses
+from utils import save_solve_state
+from utils import load_solve_state
+from utils import incremental_extrapolate
+from utils import solve_components
+from utils import as_distance_graph
 from utils import compute_minimal_distance_transformation
 from utils import place_initial_three_points
 from utils import rigid_transform_points
+from utils import find_point_coordinates
+from utils import find_points_coordinates
+from utils import geometry_quality
 
 
 class TestUTMChoice(unittest.TestCase):
@@ -121,6 +135,54 @@ class TestGetDistancesFromCsv(unittest.TestCase):
         self.assertEquals(points['15']['prio'], 0)
 
 
+class TestReadDistances(unittest.TestCase):
+
+    text = ('f,t,d\n14,24,3\n14,25,x\n\n24,25,5\n'
+            '14\n25,26,-1\n14,26,4\n')
+
+    def test_errors_collected(self):
+        points = {}
+        errors = []
+        from StringIO import StringIO
+        d = get_distances_from_csv(StringIO(self.text), points, errors)
+        self.assertEquals([e.line_number for e in errors], [1, 3, 6, 7])
+        self.assertEquals(errors[1].text, '14,25,x')
+        self.assertEquals(errors[2].reason, 'expected 3 fields, got 1')
+        self.assertEquals(sorted(points), ['14', '24', '25', '26'])
+        self.assertEquals(d['26'], {'14': 4})
+
+    def test_chunks_give_same_result(self):
+        from StringIO import StringIO
+        errors = []
+        d1 = get_distances_from_csv(StringIO(self.text), {})
+        d2 = get_distances_from_csv(StringIO(self.text), {}, errors)
+        self.assertEquals(d1, d2)
+        errors_chunked = []
+        graph = read_distance_graph(StringIO(self.text), {}, errors_chunked,
+                                    chunk_size=2)
+        self.assertEquals(errors, errors_chunked)
+        self.assertEquals(dict((k, dict(v)) for k, v in graph.items()), d1)
+
+    def test_read_distance_graph(self):
+        points = {'15': {'coordinates': (0, 0)},
+                  '16': {'coordinates': (0, 0)},
+                  '17': {'coordinates': (0, 0)}}
+        from StringIO import StringIO
+        s = StringIO('14,15,3\n14,16,3\n14,17,3\n15,16,3\n')
+        graph = read_distance_graph(s, points, chunk_size=3)
+        self.assertEquals(graph.ids, ['14', '15', '16', '17'])
+        self.assertEquals(graph['16']['14'], 3)
+        self.assertEquals(points['14']['prio'], 3)
+        self.assertEquals(points['15']['prio'], 1)
+        self.assertEquals(points['17']['prio'], 0)
+        self.assertEquals(points['14']['computed'], False)
+
+    def test_read_distance_graph_empty(self):
+        from StringIO import StringIO
+        graph = read_distance_graph(StringIO(''), {})
+        self.assertEquals(len(graph), 0)
+
+
 class TestExtrapolateCoordinates(unittest.TestCase):
 
     def test_extrapolate_coordinates_one(self):
@@ -156,6 +218,681 @@ class TestExtrapolateCoordinates(unittest.TestCase):
         self.assertEquals(tuple(points['z']['coordinates']), (4.0, 9.0))
         assert_almost_equal(tuple(points['t']['coordinates']), (2.0, 4.5))
 
+    def parking_lot(self):
+        points = {'0': {'coordinates': (4, 0)},
+                  'A': {'coordinates': (0, 0)},
+                  'B': {'coordinates': (0, 3)},
+                  'C': {'coordinates': (0, 6)}}
+        from StringIO import StringIO
+        # x only sees collinear references until y is placed, u and v
+        # have too few references, w sees collinear ones only
+        s = StringIO('x,A,5\nx,B,4\nx,C,5\nx,y,3\n'
+                     'y,0,6\ny,B,5\ny,C,4\n'
+                     'u,A,1\nu,v,1\nv,B,1\n'
+                     'w,A,3\nw,B,0\nw,C,3\n')
+        return points, get_distances_from_csv(s, points)
+
+    def test_parked_point_resumes(self):
+        points, d = self.parking_lot()
+        parked = {}
+        extrapolate_coordinates(points, d, parked=parked)
+        assert_almost_equal(points['x']['coordinates'], (4.0, 3.0))
+        assert_almost_equal(points['y']['coordinates'], (4.0, 6.0))
+        self.assertEquals(sorted(parked), ['u', 'v', 'w'])
+        self.assertEquals(parked['u'].reason, 'too few references')
+        self.assertEquals(parked['u'].references, 1)
+        self.assertEquals(parked['w'].reason, 'references almost collinear')
+        for k in parked:
+            self.assertFalse('coordinates' in points[k])
+
+    def test_parked_attempts_bounded(self):
+        import utils
+        points, d = self.parking_lot()
+        attempts = []
+        solve_point = utils._solve_point
+
+        def counting(points, distances, point_id, *args, **kwargs):
+            attempts.append(point_id)
+            return solve_point(points, distances, point_id, *args, **kwargs)
+        utils._solve_point = counting
+        try:
+            extrapolate_coordinates(points, d)
+        finally:
+            utils._solve_point = solve_point
+        # once each, plus once more for x if tried before y
+        self.assertTrue(len(attempts) <= 6)
+        self.assertEquals(sorted(set(attempts)), ['u', 'v', 'w', 'x', 'y'])
+
+
+class TestFindPointsCoordinates(unittest.TestCase):
+
+    def setUp(self):
+        self.points = {'0': {'coordinates': (4, 0)},
+                       'A': {'coordinates': (0, 0)},
+                       'B': {'coordinates': (0, 3)},
+                       'C': {'coordinates': (0, 6)},
+                       'D': {'coordinates': (0, 9)},
+                       'E': {'coordinates': (4, 9)}}
+        from StringIO import StringIO
+        s = StringIO('x,0,3\nx,A,5\nx,B,4\n'
+                     'y,0,6\ny,B,5\ny,C,4\ny,D,5\n'
+                     'z,C,5\nz,D,4\n'
+                     'w,A,3\nw,B,0\nw,C,3\n')
+        self.distances = get_distances_from_csv(s, self.points)
+
+    def test_batch_matches_single(self):
+        result = find_points_coordinates(self.points, self.distances)
+        self.assertEquals(sorted(result), ['x', 'y'])
+        for k in result:
+            assert_almost_equal(
+                result[k],
+                find_point_coordinates(self.points, self.distances, k))
+        assert_almost_equal(result['x'], (4, 3))
+        assert_almost_equal(result['y'], (4, 6))
+
+    def test_batch_skips_collinear(self):
+        result = find_points_coordinates(self.points, self.distances, ['w'])
+        self.assertEquals(result, {})
+        self.assertRaises(ValueError, find_point_coordinates,
+                          self.points, self.distances, 'w')
+
+    def test_batch_min_references(self):
+        result = find_points_coordinates(self.points, self.distances,
+                                         min_references=2)
+        self.assertEquals(sorted(result), ['x', 'y', 'z'])
+
+    def test_collinear_many_references(self):
+        from StringIO import StringIO
+        s = StringIO('v,A,4\nv,B,5\nv,C,7.2111\nv,D,9.8489\n')
+        distances = get_distances_from_csv(s, self.points)
+        result = find_points_coordinates(self.points, distances, ['v'])
+        self.assertEquals(result, {})
+        self.assertRaises(ValueError, find_point_coordinates,
+                          self.points, distances, 'v')
+        self.assertEquals(geometry_quality(self.points, distances, ['v']),
+                          {'v': 0.0})
+
+    def test_geometry_quality(self):
+        quality = geometry_quality(self.points, self.distances)
+        self.assertEquals(sorted(quality), ['w', 'x', 'y', 'z'])
+        self.assertEquals(quality['z'], 0.0)
+        self.assertAlmostEquals(quality['w'], 0.0)
+        # x sees 0, A, B: from 0, directions (-4, 0) and (-4, 3)
+        self.assertAlmostEquals(quality['x'], 0.6)
+        self.assertTrue(quality['y'] > 0.085)
+
+
+def grid_survey(side=6, radius=2.5):
+    """points on a side x side grid, the first three of them referenced
+
+    return points, distances, and the true coordinates
+
+    """
+    from math import sqrt
+    truth = {}
+    for i in range(side):
+        for j in range(side):
+            truth['%02d%02d' % (i, j)] = (i * 1.0, j * 1.1 + (i % 2) * 0.3)
+    distances = {}
+    for a in truth:
+        for b in truth:
+            if a == b:
+                continue
+            d = sqrt(sum((u - v) ** 2 for u, v in zip(truth[a], truth[b])))
+            if d <= radius:
+                distances.setdefault(a, {})[b] = d
+    points = dict((k, {'id': k}) for k in truth)
+    for k in ['0000', '0001', '0100']:
+        points[k]['coordinates'] = truth[k]
+    for k, p in points.items():
+        p['prio'] = len([q for q in distances[k]
+                         if 'coordinates' in points[q]])
+    return points, distances, truth
+
+
+class TestExtrapolateCancelled(unittest.TestCase):
+
+    def test_stops_between_points(self):
+        points, distances, truth = grid_survey()
+        checks = []
+
+        def is_cancelled():
+            checks.append(True)
+            return len(checks) > 5
+        parked = {}
+        extrapolate_coordinates(points, distances, parked=parked,
+                                is_cancelled=is_cancelled)
+        self.assertEquals(len([p for p in points.values()
+                               if p.get('computed')]), 5)
+        self.assertEquals(parked, {})
+
+    def test_stops_between_levels(self):
+        points, distances, truth = grid_survey()
+        levels = extrapolate_coordinates_by_levels(
+            points, distances, is_cancelled=lambda: True)
+        self.assertEquals(levels, 0)
+
+
+class TestExtrapolateByLevels(unittest.TestCase):
+
+    def test_levels_two(self):
+        points = {'0': {'coordinates': (4, 0)},
+                  'A': {'coordinates': (0, 0)},
+                  'B': {'coordinates': (0, 3)},
+                  'C': {'coordinates': (0, 6)},
+                  'D': {'coordinates': (0, 9)}}
+        from StringIO import StringIO
+        s = StringIO('x,0,3\nx,A,5\nx,B,4\n'
+                     'y,x,3\ny,B,5\ny,C,4\n'
+                     'z,y,3\nz,C,5\nz,D,4\n'
+                     't,x,2.5\nt,B,2.5\nt,y,2.5\n')
+        d = get_distances_from_csv(s, points)
+        levels = extrapolate_coordinates_by_levels(points, d)
+        self.assertEquals(levels, 3)
+        assert_almost_equal(points['x']['coordinates'], (4.0, 3.0))
+        assert_almost_equal(points['y']['coordinates'], (4.0, 6.0))
+        assert_almost_equal(points['z']['coordinates'], (4.0, 9.0))
+        assert_almost_equal(points['t']['coordinates'], (2.0, 4.5))
+        self.assertEquals(points['t']['computed'], True)
+
+    def test_levels_match_sequential(self):
+        points, distances, truth = grid_survey()
+        extrapolate_coordinates(points, distances)
+        wave_points, distances, truth = grid_survey()
+        extrapolate_coordinates(wave_points, distances, wavefront=True)
+        for k in truth:
+            assert_almost_equal(wave_points[k]['coordinates'],
+                                points[k]['coordinates'])
+            assert_almost_equal(wave_points[k]['coordinates'], truth[k])
+
+    def test_levels_process_pool(self):
+        points, distances, truth = grid_survey()
+        extrapolate_coordinates_by_levels(points, distances)
+        pool_points, distances, truth = grid_survey()
+        extrapolate_coordinates_by_levels(pool_points, distances,
+                                          processes=2)
+        for k in truth:
+            self.assertEquals(tuple(pool_points[k]['coordinates']),
+                              tuple(points[k]['coordinates']))
+
+    def test_levels_process_pool_graph(self):
+        points, distances, truth = grid_survey()
+        extrapolate_coordinates_by_levels(points, distances)
+        pool_points, distances, truth = grid_survey()
+        extrapolate_coordinates_by_levels(pool_points,
+                                          as_distance_graph(distances),
+                                          processes=2)
+        for k in truth:
+            self.assertEquals(tuple(pool_points[k]['coordinates']),
+                              tuple(points[k]['coordinates']))
+
+
+class TestProvenance(unittest.TestCase):
+
+    def test_add_and_query(self):
+        provenance = Provenance()
+        provenance.add('x', ['a', 'b', 'c'], [0.1, -0.1, 0.0])
+        provenance.add('y', ['b', 'c', 'x'], [0.0, 0.0, 0.2])
+        provenance.add('z', ['a', 'y', 'c'], [0.0, 0.0, 0.0])
+        provenance.add('t', ['a', 'b', 'c'], [0.0, 0.0, 0.0])
+        self.assertEquals(len(provenance), 4)
+        self.assertEquals(provenance.order(), ['x', 'y', 'z', 't'])
+        self.assertEquals(provenance.references('y'), ['b', 'c', 'x'])
+        assert_almost_equal(provenance.residuals('x'), [0.1, -0.1, 0.0])
+        self.assertTrue('x' in provenance)
+        self.assertFalse('a' in provenance)
+        self.assertFalse('nowhere' in provenance)
+        self.assertEquals(provenance.descendants('x'), set(['y', 'z']))
+        self.assertEquals(provenance.descendants('b'),
+                          set(['x', 'y', 'z', 't']))
+        self.assertEquals(provenance.descendants('z'), set())
+        self.assertEquals(provenance.descendants('nowhere'), set())
+        self.assertEquals(provenance.descendants('x', 'y'), set(['y', 'z']))
+
+    def test_descendants_after_add(self):
+        provenance = Provenance()
+        provenance.add('x', ['a', 'b', 'c'], [0, 0, 0])
+        self.assertEquals(provenance.descendants('x'), set())
+        provenance.add('y', ['a', 'b', 'x'], [0, 0, 0])
+        self.assertEquals(provenance.descendants('x'), set(['y']))
+
+    def test_extrapolate_fills_provenance(self):
+        for wavefront in [False, True]:
+            points, distances, truth = grid_survey()
+            provenance = Provenance()
+            extrapolate_coordinates(points, distances, wavefront=wavefront,
+                                    provenance=provenance)
+            self.assertEquals(
+                sorted(provenance.order()),
+                sorted(k for k, p in points.items() if p.get('computed')))
+            for k, references, residuals in provenance.items():
+                self.assertEquals(len(references), len(residuals))
+                assert_almost_equal(residuals, 0)
+            # every computed point descends from the references
+            self.assertEquals(
+                provenance.descendants('0000', '0001', '0100'),
+                set(provenance.order()))
+
+
+class TestErrorEllipses(unittest.TestCase):
+
+    def test_known_geometry(self):
+        points = {'x': {'coordinates': (0.0, 0.0)},
+                  'a': {'coordinates': (10.0, 0.0)},
+                  'b': {'coordinates': (-10.0, 0.0)},
+                  'c': {'coordinates': (0.0, 1.0)}}
+        provenance = Provenance()
+        provenance.add('x', ['a', 'b', 'c'], [0.1, -0.1, 0.1])
+        error_ellipses(points, provenance)
+        # residual variance 0.03, normal matrix diag(2, 1)
+        self.assertAlmostEquals(points['x']['sigma_x'], (0.03 / 2) ** 0.5)
+        self.assertAlmostEquals(points['x']['sigma_y'], 0.03 ** 0.5)
+        self.assertAlmostEquals(abs(points['x']['orientation']), 90)
+        error_ellipses(points, provenance, sigma=0.2)
+        self.assertAlmostEquals(points['x']['sigma_y'], 0.2)
+
+    def test_degenerate_geometry(self):
+        points = {'x': {'coordinates': (0.0, 0.0)},
+                  'a': {'coordinates': (10.0, 0.0)},
+                  'b': {'coordinates': (-10.0, 0.0)},
+                  'c': {'coordinates': (5.0, 0.0)}}
+        provenance = Provenance()
+        provenance.add('x', ['a', 'b', 'c'], [0.1, -0.1, 0.1])
+        error_ellipses(points, provenance)
+        self.assertEquals(points['x']['sigma_y'], float('inf'))
+
+    def test_batch_matches_single(self):
+        import random
+        random.seed(3)
+        points, distances, truth = grid_survey()
+        for a in distances:
+            for b in distances[a]:
+                if a < b:
+                    d = distances[a][b] + random.gauss(0, 0.02)
+                    distances[a][b] = distances[b][a] = d
+        provenance = Provenance()
+        extrapolate_coordinates(points, distances, provenance=provenance)
+        error_ellipses(points, provenance)
+        for k in provenance.order():
+            single = Provenance()
+            single.add(k, provenance.references(k), provenance.residuals(k))
+            point = dict(points[k])
+            copy = dict(points)
+            copy[k] = point
+            error_ellipses(copy, single)
+            self.assertAlmostEquals(point['sigma_x'], points[k]['sigma_x'])
+            self.assertAlmostEquals(point['sigma_y'], points[k]['sigma_y'])
+            self.assertTrue(points[k]['sigma_x'] < 0.2)
+        self.assertFalse('sigma_x' in points['0000'])
+
+
+class TestRobustTrilateration(unittest.TestCase):
+
+    def corrupted_survey(self):
+        points, distances, truth = grid_survey()
+        distances['0303']['0203'] += 1.5
+        distances['0203']['0303'] += 1.5
+        return points, distances, truth
+
+    def test_batch_rejects_bad_distance(self):
+        points, distances, truth = self.corrupted_survey()
+        for k in truth:
+            if k not in ['0303']:
+                points[k]['coordinates'] = truth[k]
+        result = find_points_coordinates(points, distances, ['0303'])
+        error = [a - b for a, b in zip(result['0303'], truth['0303'])]
+        self.assertTrue(sum(e * e for e in error) > 0.0004)
+        outliers = []
+        result = find_points_coordinates(points, distances, ['0303'],
+                                         robust=0.2, outliers=outliers)
+        assert_almost_equal(result['0303'], truth['0303'])
+        self.assertEquals([(e.point_id, e.reference_id) for e in outliers],
+                          [('0303', '0203')])
+        self.assertAlmostEquals(outliers[0].residual, -1.5)
+
+    def test_consistent_distances_unchanged(self):
+        points, distances, truth = grid_survey()
+        for k in truth:
+            if k not in ['0303', '0404']:
+                points[k]['coordinates'] = truth[k]
+        outliers = []
+        result = find_points_coordinates(points, distances, ['0303', '0404'],
+                                         robust=0.2, outliers=outliers)
+        assert_almost_equal(result['0303'], truth['0303'])
+        assert_almost_equal(result['0404'], truth['0404'])
+        self.assertEquals(outliers, [])
+
+    def test_extrapolate_robust(self):
+        for wavefront in [False, True]:
+            points, distances, truth = self.corrupted_survey()
+            outliers = []
+            provenance = Provenance()
+            extrapolate_coordinates(points, distances, wavefront=wavefront,
+                                    provenance=provenance, robust=0.2,
+                                    outliers=outliers)
+            for k in truth:
+                assert_almost_equal(points[k]['coordinates'], truth[k])
+            self.assertEquals(len(outliers), 1)
+            edge = outliers[0]
+            self.assertEquals(set([edge.point_id, edge.reference_id]),
+                              set(['0303', '0203']))
+            self.assertFalse(edge.reference_id in
+                             provenance.references(edge.point_id))
+
+
+class TestSolveComponents(unittest.TestCase):
+
+    def two_plots(self):
+        """two grid surveys, far apart and sharing no distances
+
+        """
+        points, distances, truth = grid_survey(side=5)
+        more_points, more_distances, more_truth = grid_survey(side=4)
+        for k in more_truth:
+            x, y = more_truth[k]
+            truth['b' + k] = (x + 100.0, y + 40.0)
+            points['b' + k] = {'id': 'b' + k}
+            distances['b' + k] = dict(('b' + j, d) for j, d in
+                                      more_distances[k].items())
+        return points, distances, truth
+
+    def test_fixed_references(self):
+        points, distances, truth = self.two_plots()
+        for k in ['b0000', 'b0001', 'b0100']:
+            points[k]['coordinates'] = truth[k]
+        results = solve_components(points, distances)
+        self.assertEquals([len(r.ids) for r in results], [25, 16])
+        self.assertEquals([r.computed for r in results], [22, 13])
+        self.assertEquals([r.error for r in results], [None, None])
+        for k in truth:
+            assert_almost_equal(points[k]['coordinates'], truth[k])
+
+    def test_seed_per_component(self):
+        points, distances, truth = self.two_plots()
+        for k in points:
+            points[k].pop('coordinates', None)
+        gps = dict((k, {'coordinates': xy}) for k, xy in truth.items())
+        for processes in [None, 2]:
+            solved = dict((k, {'id': k}) for k in points)
+            results = solve_components(solved, distances, gps,
+                                       processes=processes)
+            self.assertEquals([r.computed for r in results], [25, 16])
+            for k in truth:
+                assert_almost_equal(solved[k]['coordinates'], truth[k])
+
+    def test_cancelled(self):
+        points, distances, truth = self.two_plots()
+        for k in ['b0000', 'b0001', 'b0100']:
+            points[k]['coordinates'] = truth[k]
+        checks = []
+
+        def is_cancelled():
+            checks.append(True)
+            return len(checks) > 10
+        results = solve_components(points, distances,
+                                   is_cancelled=is_cancelled)
+        self.assertEquals(len(results), 1)
+        self.assertTrue(results[0].computed < 22)
+        self.assertFalse('coordinates' in points['b0303'])
+        results = solve_components(points, distances, processes=2,
+                                   is_cancelled=lambda: True)
+        self.assertEquals(results, [])
+
+    def test_component_without_references(self):
+        points, distances, truth = self.two_plots()
+        results = solve_components(points, distances)
+        self.assertEquals([r.computed for r in results], [22, 0])
+        self.assertFalse('coordinates' in points['b0303'])
+
+
+class TestIncrementalExtrapolate(unittest.TestCase):
+
+    def solved_grid(self):
+        points, distances, truth = grid_survey()
+        provenance = Provenance()
+        extrapolate_coordinates(points, distances, provenance=provenance)
+        return solve_state(points, distances, provenance), truth
+
+    def test_state_records_solve_order(self):
+        state, truth = self.solved_grid()
+        self.assertEquals(len(state['order']), len(truth) - 3)
+        self.assertEquals(sorted(state['coordinates']), sorted(truth))
+        seen = set(['0000', '0001', '0100'])
+        for k in state['order']:
+            self.assertTrue(len(state['references'][k]) >= 3)
+            self.assertTrue(seen.issuperset(state['references'][k]))
+            seen.add(k)
+
+    def test_nothing_changed(self):
+        state, truth = self.solved_grid()
+        points, distances, truth = grid_survey()
+        new_state, resolved = incremental_extrapolate(
+            points, distances, state)
+        self.assertEquals(resolved, set())
+        self.assertEquals(new_state, state)
+        self.assertEquals(points['0505']['computed'], True)
+
+    def test_changed_row_and_dependents(self):
+        state, truth = self.solved_grid()
+        points, distances, truth = grid_survey()
+        last = state['order'][-1]
+        neighbour = sorted(distances[last])[0]
+        distances[last][neighbour] += 0.01
+        distances[neighbour][last] += 0.01
+        new_state, resolved = incremental_extrapolate(
+            points, distances, state)
+        expect = set([last, neighbour])
+        for k in state['order']:
+            if expect.intersection(state['references'][k]):
+                expect.add(k)
+        self.assertEquals(resolved, expect)
+        self.assertTrue(len(resolved) < len(state['order']))
+        for k in truth:
+            self.assertTrue(points[k].get('coordinates') is not None)
+            if k not in resolved:
+                assert_almost_equal(points[k]['coordinates'], truth[k])
+
+    def test_moved_reference(self):
+        state, truth = self.solved_grid()
+        points, distances, truth = grid_survey()
+        points['0000']['coordinates'] = (0.0, 0.001)
+        new_state, resolved = incremental_extrapolate(
+            points, distances, state)
+        self.assertEquals(resolved, set(state['order']))
+
+    def test_new_point(self):
+        state, truth = self.solved_grid()
+        points, distances, truth = grid_survey()
+        points['new'] = {'id': 'new'}
+        for k in ['0303', '0304', '0403', '0404']:
+            d = ((truth[k][0] - 3.5) ** 2 + (truth[k][1] - 4.0) ** 2) ** 0.5
+            distances.setdefault('new', {})[k] = d
+            distances[k]['new'] = d
+        new_state, resolved = incremental_extrapolate(
+            points, distances, state)
+        self.assertTrue('new' in resolved)
+        self.assertTrue('0000' not in resolved)
+        assert_almost_equal(points['new']['coordinates'], (3.5, 4.0))
+
+    def test_save_load(self):
+        import os
+        import tempfile
+        state, truth = self.solved_grid()
+        handle, filename = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+        try:
+            save_solve_state(filename, state)
+            self.assertEquals(load_solve_state(filename), state)
+            with open(filename, 'w') as f:
+                f.write('garbage')
+            self.assertEquals(load_solve_state(filename), None)
+        finally:
+            os.unlink(filename)
+        self.assertEquals(load_solve_state(filename), None)
+
+    def test_save_load_origin(self):
+        import os
+        import tempfile
+        state, truth = self.solved_grid()
+        handle, filename = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+        try:
+            save_solve_state(filename, state, ('trees.shp', 'code'))
+            self.assertEquals(
+                load_solve_state(filename, (u'trees.shp', u'code')), state)
+            self.assertEquals(
+                load_solve_state(filename, ('trees.shp', 'plant')), None)
+            self.assertEquals(
+                load_solve_state(filename, ('other.shp', 'code')), None)
+            self.assertEquals(load_solve_state(filename), None)
+        finally:
+            os.unlink(filename)
+
+    def test_save_load_any_id(self):
+        import os
+        import tempfile
+        # text, utf-8 bytes, latin-1 bytes and integer ids stay what they are
+        ids = [u'\xe9', 'caf\xc3\xa9', '\xe1rbol', 7]
+        state = {'coordinates': {u'\xe9': [0.0, 0.0], 7: [3.0, 0.0],
+                                 'caf\xc3\xa9': [0.0, 4.0],
+                                 '\xe1rbol': [3.0, 4.0]},
+                 'order': ['\xe1rbol'],
+                 'references': {'\xe1rbol': [u'\xe9', 7, 'caf\xc3\xa9']},
+                 'residuals': {'\xe1rbol': [0.0, 0.0, 0.0]},
+                 'distances': {'\xe1rbol': {u'\xe9': 5.0, 7: 4.0,
+                                             'caf\xc3\xa9': 3.0}}}
+        handle, filename = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+        try:
+            save_solve_state(filename, state)
+            loaded = load_solve_state(filename)
+        finally:
+            os.unlink(filename)
+        self.assertEquals(loaded, state)
+        self.assertEquals(sorted(map(type, loaded['coordinates'])),
+                          sorted(map(type, ids)))
+        self.assertEquals(loaded['references']['\xe1rbol'],
+                          [u'\xe9', 7, 'caf\xc3\xa9'])
+
+
+class TestAdjustNetwork(unittest.TestCase):
+
+    def test_adjust_recovers_exact_network(self):
+        import random
+        rnd = random.Random(5)
+        points, distances, truth = grid_survey()
+        for k, p in points.items():
+            if 'coordinates' not in p:
+                x, y = truth[k]
+                p['coordinates'] = [x + rnd.uniform(-.2, .2),
+                                    y + rnd.uniform(-.2, .2)]
+                p['computed'] = True
+        result = adjust_network(points, distances)
+        self.assertTrue(result['cost'] < 1e-12)
+        self.assertTrue(result['initial_cost'] > result['cost'])
+        for k in truth:
+            assert_almost_equal(points[k]['coordinates'], truth[k])
+        self.assertEquals(points['0000']['coordinates'], truth['0000'])
+
+    def test_adjust_noisy_network(self):
+        import random
+        import numpy as np
+        rnd = random.Random(1)
+        points, distances, truth = grid_survey()
+        for a in distances:
+            for b in distances[a]:
+                if a < b:
+                    distances[a][b] = distances[b][a] = (
+                        distances[a][b] + rnd.gauss(0, 0.01))
+        extrapolate_coordinates(points, distances)
+
+        def rms():
+            return np.sqrt(np.mean([
+                ((np.array(points[k]['coordinates']) - truth[k]) ** 2).sum()
+                for k in truth]))
+        greedy = rms()
+        result = adjust_network(points, distances)
+        self.assertTrue(result['cost'] < result['initial_cost'])
+        self.assertTrue(rms() < greedy)
+        for k in ['0000', '0001', '0100']:
+            self.assertEquals(points[k]['coordinates'], truth[k])
+
+    def test_adjust_large_network(self):
+        # 20000 unknowns: a few seconds, converging well before the limit
+        import time
+        import numpy as np
+        from scipy.spatial import cKDTree
+        from utils import DistanceGraph
+        side = 100
+        rnd = np.random.RandomState(2)
+        i, j = np.divmod(np.arange(side * side), side)
+        truth = np.column_stack([i * 1.0, j * 1.1 + (i % 2) * 0.3])
+        ids = ['%03d%03d' % (a, b) for a, b in zip(i, j)]
+        pairs = cKDTree(truth).query_pairs(2.5, output_type='ndarray')
+        lengths = np.sqrt(((truth[pairs[:, 0]] - truth[pairs[:, 1]]) ** 2)
+                          .sum(axis=1))
+        graph = DistanceGraph.from_edges(
+            (ids[a], ids[b], d + rnd.normal(0, 0.01))
+            for (a, b), d in zip(pairs.tolist(), lengths.tolist()))
+        guess = truth + rnd.uniform(-.2, .2, truth.shape)
+        points = dict((k, {'coordinates': xy, 'computed': True})
+                      for k, xy in zip(ids, guess.tolist()))
+        for n in [0, 1, side]:
+            points[ids[n]] = {'coordinates': truth[n].tolist()}
+        start = time.time()
+        result = adjust_network(points, graph)
+        self.assertTrue(time.time() - start < 30)
+        self.assertTrue(result['iterations'] < 20)
+        # about the noise floor: (distances - unknowns) * sigma ** 2
+        self.assertTrue(result['cost'] <
+                        1.2 * (len(pairs) - 2 * side * side) * 0.01 ** 2)
+
+    def test_adjust_irregular_network(self):
+        # 40000 unknowns scattered at random, 1% of them fixed
+        import time
+        import numpy as np
+        from scipy.spatial import cKDTree
+        from utils import DistanceGraph
+        n = 20000
+        rnd = np.random.RandomState(1)
+        truth = rnd.uniform(0, np.sqrt(n), (n, 2))
+        ids = ['p%05d' % a for a in range(n)]
+        pairs = cKDTree(truth).query_pairs(2.5, output_type='ndarray')
+        lengths = np.sqrt(((truth[pairs[:, 0]] - truth[pairs[:, 1]]) ** 2)
+                          .sum(axis=1))
+        graph = DistanceGraph.from_edges(
+            (ids[a], ids[b], d + rnd.normal(0, 0.02))
+            for (a, b), d in zip(pairs.tolist(), lengths.tolist()))
+        guess = truth + rnd.uniform(-.2, .2, truth.shape)
+        points = dict((k, {'coordinates': xy, 'computed': True})
+                      for k, xy in zip(ids, guess.tolist()))
+        for a in rnd.choice(n, n // 100, replace=False).tolist():
+            points[ids[a]] = {'coordinates': truth[a].tolist()}
+        start = time.time()
+        result = adjust_network(points, graph)
+        self.assertTrue(time.time() - start < 30)
+        self.assertTrue(result['iterations'] < 30)
+        self.assertTrue(result['cost'] <
+                        1.2 * (len(pairs) - 2 * n) * 0.02 ** 2)
+
+    def test_adjust_nothing_free(self):
+        points = {'A': {'coordinates': (0, 0)},
+                  'B': {'coordinates': (3, 0)},
+                  'C': {'id': 'C'}}
+        distances = {'A': {'B': 2.0, 'C': 1.0}, 'B': {'A': 2.0},
+                     'C': {'A': 1.0}}
+        result = adjust_network(points, distances)
+        self.assertEquals(result['iterations'], 0)
+        self.assertEquals(points['B']['coordinates'], (3, 0))
+
+    def test_adjust_explicit_fixed(self):
+        points = {'A': {'coordinates': (0, 0)},
+                  'B': {'coordinates': (3, 0)}}
+        distances = {'A': {'B': 2.0}, 'B': {'A': 2.0}}
+        adjust_network(points, distances, fixed=['A'])
+        assert_almost_equal(points['B']['coordinates'], (2, 0))
+        self.assertEquals(points['A']['coordinates'], (0, 0))
+
 
 class TestComputeMinimalDistanceTransformation(unittest.TestCase):
 
@@ -205,6 +942,37 @@ class TestComputeMinimalDistanceTransformation(unittest.TestCase):
         assert_almost_equal(t[:2], (0, 0), decimal=6)
         assert_almost_equal(t[2] / 90, 1.0, decimal=5)
 
+    def test_compute_minimal_distance_transformation_powell(self):
+        import random
+        rnd = random.Random(3)
+        p = dict((k, {'coordinates': (rnd.uniform(0, 10),
+                                      rnd.uniform(0, 10))})
+                 for k in 'ABCDEFG')
+        q = rigid_transform_points(p, 3, -2, 30)
+        for v in q.values():
+            x, y = v['coordinates']
+            v['coordinates'] = (x + rnd.gauss(0, 0.05),
+                                y + rnd.gauss(0, 0.05))
+        t_svd = compute_minimal_distance_transformation(p, q)
+        t_powell = compute_minimal_distance_transformation(
+            p, q, method='powell')
+        assert_almost_equal(t_svd, t_powell, decimal=3)
+        assert_almost_equal(t_svd, (3, -2, 30), decimal=1)
+
+    def test_compute_minimal_distance_transformation_partial(self):
+        p = {'A': {'coordinates': (0, 0)},
+             'B': {'coordinates': (2, 0)},
+             'C': {'coordinates': (5, 5)}}
+        q = {'A': {'coordinates': (0, 1)},
+             'B': {'coordinates': (0, 3)},
+             'D': {'coordinates': (7, 7)}}
+        t = compute_minimal_distance_transformation(p, q)
+        assert_almost_equal(t, (0, 1, 90))
+
+    def test_compute_minimal_distance_transformation_unknown(self):
+        self.assertRaises(ValueError, compute_minimal_distance_transformation,
+                          {}, {}, 'newton')
+
 
 class TestSolvePuzzle(unittest.TestCase):
 
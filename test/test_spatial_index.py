@@ -0,0 +1,185 @@
+# coding=utf-8
+
+import unittest
+import numpy as np
+from numpy.testing import assert_almost_equal
+from utils import SpatialIndex
+from utils import extrapolate_coordinates
+
+
+class TestSpatialIndex(unittest.TestCase):
+
+    def setUp(self):
+        rnd = np.random.RandomState(7)
+        self.xy = rnd.uniform(0, 20, (300, 2))
+        self.queries = rnd.uniform(0, 20, (25, 2))
+        self.index = SpatialIndex(min_buffer=16)
+        self.index.add_many(range(100), self.xy[:100])
+        for i in range(100, 300):
+            self.index.add(i, self.xy[i])
+
+    def test_tree_and_buffer(self):
+        self.assertEquals(len(self.index), 300)
+        self.assertTrue(len(self.index._buffer) > 0)
+        assert_almost_equal(self.index.coordinates(), self.xy)
+
+    def test_query_radius(self):
+        found = self.index.query_radius(self.queries, 2.5)
+        for q, keys in zip(self.queries, found):
+            d = np.sqrt(((self.xy - q) ** 2).sum(axis=1))
+            self.assertEquals(sorted(keys), list(np.flatnonzero(d <= 2.5)))
+
+    def test_query_knn(self):
+        distances, positions = self.index.query_knn(self.queries, 4)
+        self.assertEquals(distances.shape, (25, 4))
+        for q, d, p in zip(self.queries, distances, positions):
+            expect = np.sort(np.sqrt(((self.xy - q) ** 2).sum(axis=1)))[:4]
+            assert_almost_equal(d, expect)
+            assert_almost_equal(
+                np.sqrt(((self.xy[p] - q) ** 2).sum(axis=1)), expect)
+
+    def test_block_query_many_trees(self):
+        rnd = np.random.RandomState(11)
+        xy = rnd.uniform(0, 100, (5000, 2))
+        queries = rnd.uniform(0, 100, (3000, 2))
+        index = SpatialIndex()
+        index.add_many(range(4000), xy[:4000])
+        for i in range(4000, 5000):
+            index.add(i, xy[i])
+        self.assertTrue(len(index._levels) > 1)
+        found = index.query_radius(queries, 1.5)
+        distances, positions = index.query_knn(queries, 3)
+        from scipy.spatial import cKDTree
+        tree = cKDTree(xy)
+        for keys, expect in zip(found, tree.query_ball_point(queries, 1.5)):
+            self.assertEquals(sorted(keys), sorted(expect))
+        expect, expect_positions = tree.query(queries, 3)
+        assert_almost_equal(distances, expect)
+        self.assertEquals(positions.tolist(), expect_positions.tolist())
+
+    def test_interleaved_adds_and_queries(self):
+        # no rebuilding of everything for a query after each addition
+        import time
+        rnd = np.random.RandomState(12)
+        xy = rnd.uniform(0, 200, (10000, 2))
+        index = SpatialIndex()
+        start = time.time()
+        nearest = []
+        for i, row in enumerate(xy):
+            if i:
+                nearest.append(index.query_knn(row, 1)[1][0, 0])
+            index.add(i, row)
+        self.assertTrue(time.time() - start < 30)
+        self.assertTrue(len(index._levels) <= 14)
+        for i in range(1, len(xy), 997):
+            d = ((xy[:i] - xy[i]) ** 2).sum(axis=1)
+            self.assertEquals(nearest[i - 1], d.argmin())
+        assert_almost_equal(index.coordinates(), xy)
+
+    def test_query_knn_too_few(self):
+        index = SpatialIndex()
+        index.add('a', (0, 0))
+        distances, positions = index.query_knn([(3, 4)], 2)
+        self.assertEquals(list(distances[0]), [5.0, np.inf])
+        self.assertEquals(list(positions[0]), [0, -1])
+
+    def test_empty(self):
+        index = SpatialIndex()
+        self.assertEquals(index.query_radius([(0, 0)], 1), [[]])
+
+    def test_from_points(self):
+        index = SpatialIndex.from_points({'a': {'coordinates': (0, 0)},
+                                          'b': {'id': 'b'},
+                                          'c': {'coordinates': (1, 1)}})
+        self.assertEquals(index.keys, ['a', 'c'])
+        self.assertEquals(index.query_radius([(0.9, 0.9)], 0.5), [['c']])
+
+
+class TestSpatialIndexMaintained(unittest.TestCase):
+
+    def test_extrapolate_adds_points(self):
+        points = {'0': {'coordinates': (4, 0)},
+                  'A': {'coordinates': (0, 0)},
+                  'B': {'coordinates': (0, 3)},
+                  'C': {'coordinates': (0, 6)}}
+        from StringIO import StringIO
+        from utils import get_distances_from_csv
+        s = StringIO('x,0,3\nx,A,5\nx,B,4\n'
+                     'y,x,3\ny,B,5\ny,C,4\n')
+        d = get_distances_from_csv(s, points)
+        for wavefront in [False, True]:
+            for k in ['x', 'y']:
+                points[k].pop('coordinates', None)
+            index = SpatialIndex.from_points(points)
+            extrapolate_coordinates(points, d, wavefront=wavefront,
+                                    spatial_index=index)
+            self.assertEquals(sorted(index.keys),
+                              ['0', 'A', 'B', 'C', 'x', 'y'])
+            self.assertEquals(index.query_radius([(4, 6.1)], 0.5), [['y']])
+
+
+class TestCloseEnough(unittest.TestCase):
+
+    def test_find_close_pairs_brute_force(self):
+        from utils import find_close_pairs
+        rnd = np.random.RandomState(3)
+        xy = rnd.uniform(-10, 10, (400, 2))
+        pairs = find_close_pairs(xy, 0.4)
+        expect = []
+        for i in range(len(xy)):
+            for j in range(i + 1, len(xy)):
+                d = np.sqrt(((xy[i] - xy[j]) ** 2).sum())
+                if d < 0.4:
+                    expect.append((i, j))
+        self.assertEquals([(i, j) for i, j, d in pairs], expect)
+
+    def test_find_close_pairs_other(self):
+        from utils import find_close_pairs
+        pairs = find_close_pairs([(0, 0), (5, 5)], 0.5,
+                                 [(5.1, 5.0), (9, 9), (0, 0.3)])
+        self.assertEquals([(i, j) for i, j, d in pairs], [(0, 2), (1, 0)])
+        assert_almost_equal([d for i, j, d in pairs], [0.3, 0.1])
+
+    def test_find_close_pairs_bad_tolerance(self):
+        from utils import find_close_pairs
+        for tolerance in [0, -1.0]:
+            self.assertRaises(ValueError, find_close_pairs,
+                              [(0, 0), (1, 1)], tolerance)
+
+    def test_plan_write_back(self):
+        from utils import plan_write_back
+        new = [(0, 0), (5, 5), (5.05, 5), (9, 9)]
+        old = [(5.1, 5), (0.2, 0), (20, 20)]
+        insert, moves, report = plan_write_back(new, old, 0.3, 'insert')
+        self.assertEquals(insert, [0, 1, 2, 3])
+        self.assertEquals(moves, [])
+        self.assertEquals(sorted((k, i, j) for k, i, j, d in report),
+                          [('computed', 1, 2), ('existing', 0, 1),
+                           ('existing', 1, 0), ('existing', 2, 0)])
+        insert, moves, report = plan_write_back(new, old, 0.3)
+        self.assertEquals(insert, [3])
+        self.assertEquals(moves, [])
+        insert, moves, report = plan_write_back(new, old, 0.3, 'update')
+        self.assertEquals(insert, [3])
+        self.assertEquals(moves, [(1, (0.0, 0.0)), (0, (5.0, 5.0))])
+        insert, moves, report = plan_write_back(new, old, 0.3, 'merge')
+        assert_almost_equal(moves[0][1], (0.1, 0))
+        self.assertEquals(len(moves), 2)
+
+    def test_plan_write_back_computed_pairs(self):
+        from utils import plan_write_back
+        # 0-1 and 1-2 are close, 0-2 are not; 3 and 4 are close
+        new = [(0, 0), (0.2, 0), (0.4, 0), (7, 7), (7, 7.1)]
+        insert, moves, report = plan_write_back(new, [], 0.3, 'insert')
+        self.assertEquals(insert, [0, 1, 2, 3, 4])
+        for policy in ['skip', 'update', 'merge']:
+            insert, moves, report = plan_write_back(new, [], 0.3, policy)
+            self.assertEquals(insert, [0, 2, 3])
+            self.assertEquals(moves, [])
+        self.assertEquals(sorted((k, i, j) for k, i, j, d in report),
+                          [('computed', 0, 1), ('computed', 1, 2),
+                           ('computed', 3, 4)])
+
+    def test_plan_write_back_unknown(self):
+        from utils import plan_write_back
+        self.assertRaises(ValueError, plan_write_back, [], [], 1, 'ignore')
@@ -1,6 +1,7 @@
 import unittest
 
 from utils import almost_parallel, normalize
+from utils import directions_quality
 
 
 class UtilsTest(unittest.TestCase):
@@ -39,3 +40,35 @@ class UtilsTest(unittest.TestCase):
     def test_almost_parallel_vectors_almost(self):
         u, v = [1, 0, 0], [1999, 1, -1]
         self.assertTrue(almost_parallel(u, v))
+
+    def test_almost_parallel_many_rows(self):
+        import numpy as np
+        A = np.array([[1, 0], [2, 0.01], [-3, 0], [5, 0.02]])
+        self.assertTrue(almost_parallel(A))
+        A = np.array([[1, 0], [2, 0.01], [-3, 0], [0, 1]])
+        self.assertFalse(almost_parallel(A))
+
+
+class DirectionsQualityTest(unittest.TestCase):
+    def test_two_rows_give_sine(self):
+        import numpy as np
+        A = np.array([[1, 0], [np.cos(0.3), np.sin(0.3)]])
+        self.assertAlmostEquals(directions_quality(A), np.sin(0.3))
+        self.assertAlmostEquals(directions_quality(A * 7), np.sin(0.3))
+
+    def test_spread_and_parallel(self):
+        import numpy as np
+        A = np.array([[1, 0], [0, 1], [-1, 0], [0, -1]])
+        self.assertAlmostEquals(directions_quality(A), 1)
+        A = np.array([[1, 0], [2, 0], [-1, 0], [0, 0]])
+        self.assertAlmostEquals(directions_quality(A), 0)
+        self.assertEquals(directions_quality(np.ones((1, 2))), 0)
+
+    def test_stacked(self):
+        import numpy as np
+        A = np.array([[[1, 0], [0, 1], [1, 1]],
+                      [[1, 0], [1, 0.001], [2, 0]]])
+        quality = directions_quality(A)
+        self.assertEquals(quality.shape, (2,))
+        self.assertTrue(quality[0] > 0.9)
+        self.assertTrue(quality[1] < 0.01)
@@ -26,8 +26,165 @@
 # widgets-and-dialogs-with-auto-connect in
 # http://qt-project.org/doc/qt-4.8/designer-using-a-ui-file.html
 
+from collections import Mapping, namedtuple
 
-class Heap:
+
+class IndexedHeap(object):
+    def __init__(self, priorities=(), items=None):
+        """creates an indexed binary max-heap over dense integer indices
+
+        priorities is a sequence holding the priority of each index, it is
+        copied into the heap and kept there.  items are the indices to be
+        placed in the heap, they default to all indices in priorities.
+
+        positions and priorities are held in two parallel lists keyed by
+        index, the heap itself is a list of indices.  construction is a
+        bottom-up heapify, linear in the number of items.
+
+        """
+        self._prio = list(priorities)
+        self._pos = [-1] * len(self._prio)
+        if items is None:
+            items = range(len(self._prio))
+        self._heap = list(items)
+        for k, index in enumerate(self._heap):
+            self._pos[index] = k
+        for k in reversed(range(len(self._heap) // 2)):
+            self._sink(k)
+
+    def push(self, index, prio):
+        """push index into heap, with given priority
+
+        """
+        if index >= len(self._prio):
+            grow = index + 1 - len(self._prio)
+            self._prio.extend([0] * grow)
+            self._pos.extend([-1] * grow)
+        self._prio[index] = prio
+        k = len(self._heap)
+        self._pos[index] = k
+        self._heap.append(index)
+        self._swim(k)
+
+    def pop(self):
+        """pop index with highest priority from heap
+
+        """
+        heap = self._heap
+        result = heap[0]
+        last = heap.pop()
+        self._pos[result] = -1
+        if heap:
+            heap[0] = last
+            self._pos[last] = 0
+            self._sink(0)
+        return result
+
+    def reprioritize(self, index, prio_change=1):
+        """change priority of index, and let it swim up or sink down
+
+        nothing happens if the priority change is zero
+
+        """
+        self._prio[index] += prio_change
+        if prio_change > 0:
+            self._swim(self._pos[index])
+        elif prio_change < 0:
+            self._sink(self._pos[index])
+
+    def priority(self, index):
+        return self._prio[index]
+
+    def __contains__(self, index):
+        return 0 <= index < len(self._pos) and self._pos[index] != -1
+
+    def __len__(self):
+        return len(self._heap)
+
+    def priorities(self):
+        return [self._prio[i] for i in self._heap]
+
+    def _swap(self, i1, i2):
+        """this is an internal private function: direct use will break heap
+        structure.
+
+        """
+        heap, pos = self._heap, self._pos
+        heap[i1], heap[i2] = heap[i2], heap[i1]
+        pos[heap[i1]] = i1
+        pos[heap[i2]] = i2
+
+    def _sink(self, k):
+        """move element down starting at position k
+
+        this is an internal private function: do not use directly
+
+        """
+        heap, pos, prio = self._heap, self._pos, self._prio
+        size = len(heap)
+        index = heap[k]
+        value = prio[index]
+        while True:
+            child = 2 * k + 1
+            if child >= size:
+                break
+            if child + 1 < size and prio[heap[child]] < prio[heap[child + 1]]:
+                child += 1
+            if not value < prio[heap[child]]:
+                break
+            heap[k] = heap[child]
+            pos[heap[k]] = k
+            k = child
+        heap[k] = index
+        pos[index] = k
+
+    def _swim(self, k):
+        """move element up starting at position k
+
+        this is an internal private function: do not use directly
+
+        """
+        heap, pos, prio = self._heap, self._pos, self._prio
+        index = heap[k]
+        value = prio[index]
+        while k > 0:
+            parent = (k - 1) // 2
+            if not value > prio[heap[parent]]:
+                break
+            heap[k] = heap[parent]
+            pos[heap[k]] = k
+            k = parent
+        heap[k] = index
+        pos[index] = k
+
+
+class _ElementKeyView(object):
+    """list-like view on one key of a list of dictionaries
+
+    lets IndexedHeap read and write 'prio' and 'heappos' straight into the
+    elements of a Heap.  a missing key reads as `missing`, and writing
+    `missing` removes the key.
+
+    """
+    def __init__(self, elems, key, missing=None):
+        self.elems = elems
+        self.key = key
+        self.missing = missing
+
+    def __len__(self):
+        return len(self.elems)
+
+    def __getitem__(self, i):
+        return self.elems[i].get(self.key, self.missing)
+
+    def __setitem__(self, i, value):
+        if value == self.missing:
+            self.elems[i].pop(self.key, None)
+        else:
+            self.elems[i][self.key] = value
+
+
+class Heap(IndexedHeap):
     def __init__(self, elems):
         """creates a binary heap from list of dictionaries
 
@@ -37,33 +194,34 @@ class Heap:
 
         highest priority values goes to front of array.
 
+        this is an adapter on IndexedHeap, for callers working with
+        dictionaries.  elements are pushed one by one, as they always were.
+
         """
-        self.heap = list(elems)
-        self.heap[0]['heappos'] = 0
-        for k in range(1, len(elems)):
-            self.heap[k]['heappos'] = k
-            self._swim(k)
+        self._elems = []
+        self._prio = _ElementKeyView(self._elems, 'prio')
+        self._pos = _ElementKeyView(self._elems, 'heappos', -1)
+        self._heap = []
+        for elem in elems:
+            self.push(elem)
+
+    @property
+    def heap(self):
+        return [self._elems[i] for i in self._heap]
 
     def push(self, elem):
         """push new element into heap
 
         """
-        k = len(self.heap)
-        elem['heappos'] = k
-        self.heap.append(elem)
-        self._swim(k)
+        self._elems.append(elem)
+        IndexedHeap.push(self, len(self._elems) - 1, elem['prio'])
 
     def pop(self):
         """pop highest priority from heap
 
         element with highest priority value is removed from heap.
         """
-        k = len(self.heap) - 1
-        self._swap(0, k)
-        result = self.heap.pop()
-        del result['heappos']
-        self._sink(0)
-        return result
+        return self._elems[IndexedHeap.pop(self)]
 
     def reprioritize(self, elem, prio_change=1):
         """change priority of heap element, and let it swim up or sink down
@@ -78,101 +236,311 @@ class Heap:
         a negative priority change will sink the object into the heap
 
         """
-        elem['prio'] += prio_change
-        if prio_change > 0:
-            self._swim(elem['heappos'])
-        elif prio_change < 0:
-            self._sink(elem['heappos'])
+        IndexedHeap.reprioritize(
+            self, self._heap[elem['heappos']], prio_change)
 
-    def __len__(self):
-        return self.heap.__len__()
 
-    def priorities(self):
-        return [e['prio'] for e in self.heap]
+def _trilateration_system(refs, dists):
+    """linear system locating a point from its distances to references
 
-    def _swap(self, i1, i2):
-        """this is an internal private function: direct use will break heap
-        structure.
+    refs holds the coordinates of k references, shape (..., k, 2), dists
+    the distances of the point from them, shape (..., k).  subtracting the
+    circle equation of the first reference from the others gives A and rhs
+    of shapes (..., k-1, 2) and (..., k-1), relative to the first reference.
 
-        >>> i = Heap([{'prio':1},{'prio':2},{'prio':3}])
-        >>> i.priorities()
-        [3, 1, 2]
-        >>> i._swap(0, 1)
-        >>> i.priorities()
-        [1, 3, 2]
+    """
+    # vectors from first reference to the others
+    A = refs[..., 1:, :] - refs[..., :1, :]
+    # squared distances, beacon_i to first beacon
+    D_i1_2 = (A * A).sum(axis=-1)
+    r2 = dists * dists
+    rhs = (r2[..., :1] - r2[..., 1:] + D_i1_2) / 2.0
+    return A, rhs
 
-        """
-        self.heap[i1], self.heap[i2] = self.heap[i2], self.heap[i1]
-        self.heap[i1]['heappos'], self.heap[i2]['heappos'] = (
-            self.heap[i2]['heappos'], self.heap[i1]['heappos'])
 
-    def _sink(self, index):
-        """move element down starting at index
+def _referenced_neighbours(points, distances, point_id):
+    """sorted ids of neighbours having coordinates, and distances to them
 
-        this is an internal private function: do not use directly
+    """
+    if isinstance(distances, DistanceGraph):
+        i = distances.index.get(point_id)
+        if i is None:
+            return [], []
+        ids = distances.ids
+        pairs = [(ids[j], w) for j, w in zip(
+            distances.neighbours(i).tolist(),
+            distances.neighbour_weights(i).tolist())
+            if points[ids[j]].get('coordinates')]
+    else:
+        row = distances.get(point_id, {})
+        pairs = [(id, row[id]) for id in sorted(row)
+                 if points[id].get('coordinates')]
+    return [id for id, w in pairs], [w for id, w in pairs]
 
-        """
-        while True:
-            maxleafindex = (index + 1) * 2 - 1
-            try:
-                if self.heap[maxleafindex]['prio'] < self.heap[
-                        maxleafindex + 1]['prio']:
-                    maxleafindex += 1
-            except IndexError:
-                pass
-            try:
-                if self.heap[index]['prio'] < self.heap[
-                        maxleafindex]['prio']:
-                    self._swap(index, maxleafindex)
-                    index = maxleafindex
-                else:
-                    break
-            except IndexError:
-                break
 
-    def _swim(self, index):
-        """move element up starting at index
+def _solve_point(points, distances, point_id, robust=None, outliers=None,
+                 min_quality=0.085, min_references=0):
+    """coordinates of point_id, references used, residuals against them
 
-        this is an internal private function: do not use directly
+    robust, outliers, min_quality and min_references as in
+    find_points_coordinates.  None if the references do not allow
+    locating the point.
 
-        """
-        if index == 0:
-            return
-        parent = int((index + 1) / 2) - 1
-        while True:
-            if self.heap[index]['prio'] > self.heap[parent]['prio']:
-                self._swap(index, parent)
-            else:
-                break
-            index, parent = parent, int((parent + 1) / 2) - 1
-            if index == 0:
-                break
+    """
+    import numpy as np
 
+    connected_to, dfb_sel = _referenced_neighbours(
+        points, distances, point_id)
+    if len(connected_to) < min_references:
+        return None
+    # make sure we work with floating point values
+    connected_matrix = np.array([points[id]['coordinates']
+                                 for id in connected_to], dtype=float)
+    # distances of targeted point from used reference points
+    dfb_sel = np.array(dfb_sel, dtype=float)
+    if robust is not None and len(connected_to) > 3:
+        xy, inliers, solvable = _robust_trilateration(
+            connected_matrix[None], dfb_sel[None], robust)
+        if not solvable[0]:
+            return None
+        xy, inliers = xy[0], inliers[0]
+        if outliers is not None:
+            residuals = _solution_residuals(connected_matrix, dfb_sel, xy)
+            outliers.extend(
+                OutlierEdge(point_id, connected_to[j], dfb_sel[j],
+                            float(residuals[j]))
+                for j in np.flatnonzero(~inliers))
+        connected_to = [k for k, ok in zip(connected_to, inliers) if ok]
+        connected_matrix = connected_matrix[inliers]
+        dfb_sel = dfb_sel[inliers]
+        return (xy, connected_to,
+                _solution_residuals(connected_matrix, dfb_sel, xy))
+    if (len(connected_to) >= 3 and
+            reference_quality(connected_matrix) < min_quality):
+        return None
+    A, rhs = _trilateration_system(connected_matrix, dfb_sel)
+    r1, r2, r3, r4 = np.linalg.lstsq(A, rhs, rcond=-1)
+    xy = connected_matrix[0, ] + r1
+    return xy, connected_to, _solution_residuals(connected_matrix, dfb_sel, xy)
 
-def find_point_coordinates(points, distances, point_id):
+
+def _solution_residuals(refs, dists, xy):
+    """distances from xy to the (k, 2) refs, minus the measured dists
+
+    """
     import numpy as np
-    from numpy.core.umath_tests import matrix_multiply
+    delta = refs - np.asarray(xy, dtype=float)[:2]
+    return np.sqrt((delta * delta).sum(axis=1)) - dists
 
-    connected_to = [id for id in sorted(distances[point_id])
-                    if points[id].get('coordinates')]
-    connected_matrix = np.array([points[id]['coordinates']
-                                 for id in connected_to])
-    A = connected_matrix[1:, ] - connected_matrix[0, ]
-    if almost_parallel(A):
+
+def find_point_coordinates(points, distances, point_id):
+    solution = _solve_point(points, distances, point_id)
+    if solution is None:
         raise ValueError('Almost singular matrix')
-    A = 1.0 * A  # make sure we work with floating point values
+    return solution[0]
+
+
+def directions_quality(A):
+    """how far the rows of A, shape (..., m, 2), are from being parallel
+
+    rows are taken as unit vectors.  with s and S the smallest and largest
+    singular values of the result, quality is 2sS / (s^2 + S^2): 0 for
+    parallel rows or fewer than two, 1 for evenly spread directions, and
+    the sine of the angle between them for two rows, like almost_parallel.
+
+    """
+    import numpy as np
+    A = np.asarray(A, dtype=float)
+    if A.shape[-2] < 2:
+        return np.zeros(A.shape[:-2])
+    norms = np.sqrt((A * A).sum(axis=-1))
+    U = A / np.where(norms == 0, 1, norms)[..., None]
+    s = np.linalg.svd(U, compute_uv=False)
+    smallest, largest = s[..., -1], s[..., 0]
+    squares = smallest * smallest + largest * largest
+    return 2 * smallest * largest / np.where(squares == 0, 1, squares)
+
+
+def reference_quality(refs):
+    """directions_quality of references (..., k, 2), seen from the first
+
+    this is the conditioning of the system _trilateration_system builds.
+
+    """
+    import numpy as np
+    refs = np.asarray(refs, dtype=float)
+    return directions_quality(refs[..., 1:, :] - refs[..., :1, :])
+
+
+def geometry_quality(points, distances, point_ids=None):
+    """reference_quality of many points at once
+
+    point_ids defaults to all points still without coordinates.  points
+    are grouped by number of referenced neighbours, each group in one
+    batch; fewer than three references give quality 0.
+
+    return a dictionary from point id to quality.
+
+    """
+    import numpy as np
+    if point_ids is None:
+        point_ids = [k for k, p in points.items() if 'coordinates' not in p]
+    groups = {}
+    for point_id in point_ids:
+        connected_to = _referenced_neighbours(points, distances, point_id)[0]
+        groups.setdefault(len(connected_to), []).append(
+            (point_id, connected_to))
+    result = {}
+    for k, group in groups.items():
+        if k < 3:
+            result.update((point_id, 0.0) for point_id, refs in group)
+            continue
+        refs = coordinates_array(
+            points, [r for point_id, refs in group for r in refs])
+        quality = reference_quality(refs.reshape(len(group), k, 2))
+        result.update(zip([point_id for point_id, refs in group],
+                          quality.tolist()))
+    return result
+
+
+OutlierEdge = namedtuple('OutlierEdge',
+                         'point_id reference_id distance residual')
+ParkedPoint = namedtuple('ParkedPoint', 'references reason')
 
-    # squared distances vector, beacon_i to first beacon for which we have
-    # distances
-    D_i1_2 = matrix_multiply(A * A, [[1], [1]])
-    # distances of targeted point from used reference points
-    dfb_sel = np.array([distances[point_id][ref_id]
-                        for ref_id in connected_to])
-    r2 = dfb_sel * dfb_sel
 
-    rhs = ((r2[0] - r2[1:]).reshape(D_i1_2.shape) + D_i1_2) / 2.0
-    r1, r2, r3, r4 = np.linalg.lstsq(A, rhs.reshape(rhs.shape[:1]))
-    return connected_matrix[0, ] + r1
+def _solve_2x2(A, rhs):
+    """solve stacked 2x2 systems, zero where singular
+
+    return the solutions and their determinants.
+
+    """
+    import numpy as np
+    det = A[..., 0, 0] * A[..., 1, 1] - A[..., 0, 1] * A[..., 1, 0]
+    safe = np.where(det == 0, 1, det)
+    x = (A[..., 1, 1] * rhs[..., 0] - A[..., 0, 1] * rhs[..., 1]) / safe
+    y = (A[..., 0, 0] * rhs[..., 1] - A[..., 1, 0] * rhs[..., 0]) / safe
+    return np.where((det == 0)[..., None], 0, np.stack((x, y), -1)), det
+
+
+def _robust_trilateration(refs, dists, tolerance, max_subsets=200):
+    """locate points from references, ignoring distances which disagree
+
+    refs has shape (n, k, 2), dists (n, k), k at least 4.  every triple of
+    references, or max_subsets random ones if there are more, gives a
+    candidate position; the candidate agreeing within tolerance with most
+    distances wins, and is refined by Gauss-Newton on its inliers.
+
+    return positions, (n, k) inlier mask, and which points were solved.
+
+    """
+    import numpy as np
+    from itertools import combinations
+    n, k = dists.shape
+    if k * (k - 1) * (k - 2) / 6 <= max_subsets:
+        subsets = np.array(list(combinations(range(k), 3)))
+    else:
+        random = np.random.RandomState(0)
+        subsets = np.sort(random.rand(max_subsets, k).argsort(axis=1)[:, :3])
+    A, rhs = _trilateration_system(refs[:, subsets], dists[:, subsets])
+    candidates = _solve_2x2(A, rhs)[0] + refs[:, subsets][..., 0, :]
+    delta = candidates[:, :, None, :] - refs[:, None, :, :]
+    residuals = np.sqrt((delta * delta).sum(axis=-1)) - dists[:, None, :]
+    inliers = (np.abs(residuals) <= tolerance) & (
+        directions_quality(A) >= 0.085)[..., None]
+    # most inliers first, then smallest squared inlier residuals
+    squares = np.where(inliers, residuals * residuals, 0).sum(axis=-1)
+    score = inliers.sum(axis=-1) - squares / (2 * k * tolerance ** 2 + 1e-12)
+    best = np.argmax(score, axis=1)
+    rows = np.arange(n)
+    xy = candidates[rows, best]
+    mask = inliers[rows, best]
+
+    solvable = mask.sum(axis=1) >= 3
+    for iteration in range(2):
+        for step in range(5):
+            delta = xy[:, None, :] - refs
+            lengths = np.sqrt((delta * delta).sum(axis=-1))
+            J = delta / np.where(lengths == 0, 1, lengths)[..., None]
+            r = np.where(mask, lengths - dists, 0)
+            N = np.einsum('nki,nkj->nij', J * mask[..., None], J)
+            correction, det = _solve_2x2(N, np.einsum('nki,nk->ni', J, r))
+            solvable &= det > 1e-12
+            xy = xy - correction
+        delta = xy[:, None, :] - refs
+        residuals = np.sqrt((delta * delta).sum(axis=-1)) - dists
+        mask = np.abs(residuals) <= tolerance
+        solvable &= mask.sum(axis=1) >= 3
+    return xy, mask, solvable
+
+
+def find_points_coordinates(points, distances, point_ids=None,
+                            min_references=3, robust=None, outliers=None,
+                            min_quality=0.085):
+    """compute coordinates of many points at once
+
+    consider the points in point_ids (default: all points still without
+    coordinates), and keep those with at least min_references referenced
+    neighbours.  points are grouped by number of references, and each
+    group is solved with one stacked least squares call.
+
+    with robust, a tolerance in metres, points with four or more
+    references are solved from the distances agreeing within tolerance
+    with the best triple of references, see _robust_trilateration.  an
+    OutlierEdge is appended to outliers, if given, for each distance left
+    out this way.
+
+    return a dictionary from point id to coordinates.  points with too few
+    references, or with references of reference_quality below min_quality,
+    are left out.
+
+    """
+    import numpy as np
+    if point_ids is None:
+        point_ids = [k for k, p in points.items() if 'coordinates' not in p]
+    groups = {}
+    for point_id in point_ids:
+        connected_to, dists = _referenced_neighbours(
+            points, distances, point_id)
+        if len(connected_to) >= min_references:
+            groups.setdefault(len(connected_to), []).append(
+                (point_id, connected_to, dists))
+
+    result = {}
+    for k, group in sorted(groups.items()):
+        refs = np.array([[points[id]['coordinates'] for id in connected_to]
+                         for point_id, connected_to, dists in group],
+                        dtype=float)
+        dists = np.array([dists for point_id, connected_to, dists in group],
+                         dtype=float)
+        if robust is not None and k > 3:
+            solution, inliers, solvable = _robust_trilateration(
+                refs, dists, robust)
+            if outliers is not None:
+                delta = solution[:, None, :] - refs
+                residuals = np.sqrt((delta * delta).sum(axis=-1)) - dists
+                for i, j in zip(*np.nonzero(~inliers & solvable[:, None])):
+                    point_id, connected_to, row = group[i]
+                    outliers.append(OutlierEdge(
+                        point_id, connected_to[j], row[j],
+                        float(residuals[i, j])))
+            for item, coordinates, ok in zip(group, solution, solvable):
+                if ok:
+                    result[item[0]] = coordinates
+            continue
+        A, rhs = _trilateration_system(refs, dists)
+        solvable = np.ones(len(group), dtype=bool)
+        if k >= 3:
+            solvable = reference_quality(refs) >= min_quality
+        if not solvable.any():
+            continue
+        # pseudo-inverse works on stacks, lstsq does not
+        solution = np.matmul(np.linalg.pinv(A[solvable]),
+                             rhs[solvable][..., None])[..., 0]
+        solution += refs[solvable, 0]
+        solved = [item[0] for item, ok in zip(group, solvable) if ok]
+        for point_id, coordinates in zip(solved, solution):
+            result[point_id] = coordinates
+    return result
 
 
 def normalize(v):
@@ -191,7 +559,9 @@ def almost_parallel(u, v=None, tolerance=0.085):
     """tell whether two vectors are almost parallel
 
     Works with two vectors in 2 or 3 dimensions, or on a matrix with 2 rows
-    of 2 or 3 columns.  Based on norm of cross product among unit vectors
+    of 2 or 3 columns.  Based on norm of cross product among unit vectors.
+    On a matrix with more rows of 2 columns, tells whether all rows are
+    almost parallel, see directions_quality.
 
     """
     import numpy as np
@@ -201,10 +571,62 @@ def almost_parallel(u, v=None, tolerance=0.085):
     elif u.shape in [(2, 2), (2, 3)]:
         cross_vector = np.cross(normalize(u[0, :]), normalize(u[1, :]))
         return np.linalg.norm(cross_vector) < tolerance
+    elif u.ndim == 2 and u.shape[1] == 2:
+        return directions_quality(u) < tolerance
     else:
         return None
 
 
+def _intersect_sorted(x, y):
+    """intersection of two sorted arrays of unique values
+
+    """
+    if not len(x) or not len(y):
+        return x[:0]
+    at = y.searchsorted(x)
+    at[at == len(y)] = 0
+    return x[y[at] == x]
+
+
+def most_connected_3cliques(distances, k=1, usable=None):
+    """find the k 3cliques from which to reach the largest sets of points
+
+    a 3clique reaches the points connected to all three its vertices.
+    return a list of (reachable, (a, b, c)), best first, where reachable
+    is the number of such points; ties go to the highest (a, b, c).  with
+    usable, a function, only cliques for which usable(a, b, c) holds are
+    considered.
+
+    cliques are streamed from DistanceGraph.triangles and only the best k
+    are kept.  a clique can not reach more than the smallest degree of its
+    vertices, minus two, and is not scored when this bound can not beat
+    the k-th best clique found so far.
+
+    """
+    import heapq
+    graph = as_distance_graph(distances)
+    degrees = graph.degrees().tolist()
+    best = []
+    for triangle in graph.triangles():
+        a, b, c = triangle
+        bound = min(degrees[a], degrees[b], degrees[c]) - 2
+        if len(best) == k and (bound, triangle) <= best[0]:
+            continue
+        if usable is not None and not usable(
+                *[graph.ids[i] for i in triangle]):
+            continue
+        reachable = _intersect_sorted(_intersect_sorted(
+            graph.neighbours(a), graph.neighbours(b)), graph.neighbours(c))
+        candidate = (len(reachable), triangle)
+        if len(best) < k:
+            heapq.heappush(best, candidate)
+        elif candidate > best[0]:
+            heapq.heapreplace(best, candidate)
+    ids = graph.ids
+    return [(reachable, tuple(ids[i] for i in triangle))
+            for reachable, triangle in sorted(best, reverse=True)]
+
+
 def most_connected_3clique(distances):
     """find the 3clique from which to reach the largest set of points
 
@@ -212,32 +634,36 @@ def most_connected_3clique(distances):
     work. given that, we just perform a complete search.
 
     """
-    cliques = enumerate_3cliques(distances)
-    reachable_from_clique = {}
-    for a, b, c in cliques:
-        reachable_from_clique[(a, b, c)] = set(
-            distances[a]).intersection(distances[b]).intersection(distances[c])
-    dummy, result, = max((len(v), k) for k, v in reachable_from_clique.items())
-    return tuple(sorted(result))
+    best = most_connected_3cliques(distances, 1)
+    if not best:
+        raise ValueError('no 3clique in distances')
+    return best[0][1]
 
 
-def enumerate_3cliques(distances):
-    """enumerate cliques with 3 elements
+def as_distance_graph(distances):
+    """return distances as a DistanceGraph, converting if needed
+
     """
+    if isinstance(distances, DistanceGraph):
+        return distances
+    return DistanceGraph.from_distances(distances)
 
-    nodes = set(distances.keys())
-    nodes = reduce(lambda x, y: x.union(y.keys()), distances.values(), nodes)
-    nodes = sorted(nodes)
-    while nodes:
-        a = nodes.pop(0)
-        inner = list(nodes)
-        while inner:
-            b = inner.pop(0)
-            if b not in distances[a]:
-                continue
-            for c in set(inner).intersection(
-                    distances[a]).intersection(distances[b]):
-                yield (a, b, c)
+
+def enumerate_3cliques(distances, sort=True):
+    """enumerate cliques with 3 elements
+
+    each clique is a sorted (a, b, c) tuple.  with sort, cliques come in
+    sorted order, otherwise in the order the graph yields them, which
+    avoids holding them all in memory.  see DistanceGraph.triangles.
+
+    """
+    graph = as_distance_graph(distances)
+    ids = graph.ids
+    cliques = ((ids[i], ids[j], ids[k]) for i, j, k in graph.triangles())
+    if sort:
+        cliques = iter(sorted(cliques))
+    for clique in cliques:
+        yield clique
 
 
 def place_initial_three_points(points, distances, gps):
@@ -248,7 +674,19 @@ def place_initial_three_points(points, distances, gps):
     positions (dict) is the measured gps positions, affected by errors.
 
     """
-    P1, P2, P3 = most_connected_3clique(distances)
+    def usable(P1, P2, P3):
+        # we can place it: all in gps, and the triangle inequality holds
+        if not all(p in gps for p in (P1, P2, P3)):
+            return False
+        d12, d13, d23 = (distances[P1][P2], distances[P1][P3],
+                         distances[P2][P3])
+        return d12 > 0 and abs(d12 - d13) <= d23 <= d12 + d13
+
+    # the best seed among those we can place
+    seeds = most_connected_3cliques(distances, 1, usable)
+    if not seeds:
+        raise ValueError('no usable 3clique in distances')
+    reachable, (P1, P2, P3) = seeds[0]
     points[P1]['coordinates'] = gps[P1]['coordinates']
     # keep direction P1-P2 according to gps, but respect distance
     import numpy as np
@@ -285,51 +723,495 @@ def place_initial_three_points(points, distances, gps):
             points[q]['prio'] += 1
 
 
-def rigid_transform_points(points, x, y, theta):
-    """transform 'coordinates' of points by displacement and rotation
+def landmark_mds(distances, landmarks=20):
+    """embed the distances graph in the plane, by landmark MDS
+
+    landmarks are chosen farthest-first on shortest path distances,
+    starting from the best connected point.  classical MDS (double
+    centering and eigen-decomposition) places the landmarks, every other
+    point is then triangulated from its shortest path distances to them.
+    shortest paths are computed from landmarks only, so the cost is linear
+    in the size of the graph, for a fixed number of landmarks.
+
+    only the points reachable from the first landmark are embedded.
+    return their ids and an (N, 2) array with their coordinates, in an
+    arbitrary frame, possibly mirrored.
+
+    """
+    import numpy as np
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import dijkstra
+    graph = as_distance_graph(distances)
+    n = len(graph.ids)
+    if not n:
+        raise ValueError('empty distances graph')
+    adjacency = csr_matrix((graph.weights, graph.indices, graph.indptr),
+                           shape=(n, n))
+    chosen = [int(np.argmax(graph.degrees()))]
+    rows = [dijkstra(adjacency, indices=chosen[0])]
+    reachable = np.isfinite(rows[0])
+    nearest = np.where(reachable, rows[0], -1)
+    while len(chosen) < landmarks:
+        candidate = int(nearest.argmax())
+        if nearest[candidate] <= 0:
+            break
+        chosen.append(candidate)
+        rows.append(dijkstra(adjacency, indices=candidate))
+        nearest = np.minimum(nearest, rows[-1])
+    if len(chosen) < 3:
+        raise ValueError('need at least 3 landmarks, got %d' % len(chosen))
+
+    squared = np.array(rows)[:, reachable] ** 2
+    columns = np.cumsum(reachable) - 1
+    landmark_squared = squared[:, columns[chosen]]
+    # double centering
+    k = len(chosen)
+    centering = np.eye(k) - 1.0 / k
+    B = -0.5 * centering.dot(landmark_squared).dot(centering)
+    eigenvalues, eigenvectors = np.linalg.eigh(B)
+    eigenvalues, eigenvectors = eigenvalues[-2:], eigenvectors[:, -2:]
+    if not (eigenvalues > 0).all():
+        raise ValueError('landmarks do not span a plane')
+    pseudo_inverse = eigenvectors / np.sqrt(eigenvalues)
+    # distance-based triangulation of all points
+    mean = landmark_squared.mean(axis=1)
+    X = -0.5 * (squared - mean[:, None]).T.dot(pseudo_inverse)
+    ids = [k for k, r in zip(graph.ids, reachable) if r]
+    return ids, np.ascontiguousarray(X[:, ::-1])
+
+
+def place_points_by_mds(points, distances, gps, landmarks=20):
+    """compute coordinates of all points, compatible with the data
+
+    an alternative to place_initial_three_points followed by
+    extrapolate_coordinates, which does not depend on one seed triangle.
+    the landmark_mds embedding, or its mirror image, whichever fits better,
+    is brought to the gps frame by compute_minimal_distance_transformation,
+    fitting it to gps and to the points already having coordinates.  these
+    keep them: only embedded points without coordinates receive theirs,
+    and are marked 'computed'.
+
+    return the number of points placed.
+
+    """
+    ids, X = landmark_mds(distances, landmarks)
+    targets = dict(gps)
+    for k in ids:
+        if k not in targets and points[k].get('coordinates') is not None:
+            targets[k] = points[k]
+    best = None
+    for mirror in [1.0, -1.0]:
+        Y = X * [1.0, mirror]
+        frame = dict((k, {'coordinates': xy})
+                     for k, xy in zip(ids, Y.tolist()))
+        t = compute_minimal_distance_transformation(frame, targets)
+        ssd = distance_between_homonyms(
+            rigid_transform_points(frame, *t), targets)
+        if best is None or ssd < best[0]:
+            best = (ssd, Y, t)
+    ssd, Y, t = best
+    placed = 0
+    for k, xy in zip(ids, rigid_transform_array(Y, *t).tolist()):
+        if points[k].get('coordinates') is None:
+            points[k]['coordinates'] = xy
+            points[k]['computed'] = True
+            placed += 1
+    return placed
+
+
+def rigid_transform_array(xy, x, y, theta, out=None):
+    """transform rows of (N, 2) array xy by rotation theta and displacement
+
+    theta is in degrees.  the result goes to out if given, which must be a
+    C-contiguous float (N, 2) array not sharing memory with xy, so that
+    repeated calls on the same buffer allocate nothing; otherwise to a new
+    array.  the result is returned.
 
     """
     import numpy as np
     from math import cos, sin, pi
     theta = theta / 180.0 * pi
-    R = np.array([[cos(theta), -sin(theta), x],
-                  [sin(theta), cos(theta), y]])
-    result = {}
-    for k, p in points.items():
-        result[k] = dict(p)
-        pt = np.array(tuple(p['coordinates'])[:2] + (1, ))
-        result[k]['coordinates'] = tuple(R.dot(pt))
+    R = np.array([[cos(theta), -sin(theta)],
+                  [sin(theta), cos(theta)]])
+    if out is None:
+        out = np.empty(xy.shape)
+    np.dot(xy, R.T, out=out)
+    out[:, 0] += x
+    out[:, 1] += y
+    return out
+
+
+def rigid_transform_points(points, x, y, theta):
+    """transform 'coordinates' of points by displacement and rotation
+
+    return new dictionaries, input is left alone.  points without
+    coordinates are copied as they are.
+
+    """
+    ids = [k for k, p in points.items() if p.get('coordinates') is not None]
+    xy = rigid_transform_array(coordinates_array(points, ids), x, y, theta)
+    result = dict((k, dict(p)) for k, p in points.items())
+    for k, (u, v) in zip(ids, xy.tolist()):
+        result[k]['coordinates'] = (u, v)
     return result
 
 
-def distance_between_homonyms(p, q):
+class HomonymIndex(object):
+    def __init__(self, p_ids, q_ids):
+        """align the ids two coordinate arrays have in common
+
+        p_ids and q_ids label the rows of two coordinate arrays.  ids is
+        the sorted list of shared ids, and p_rows, q_rows the positions of
+        these ids in the two arrays.  ids present in one frame only are
+        ignored.
+
+        """
+        import numpy as np
+        q_row_of = dict((k, i) for i, k in enumerate(q_ids))
+        pairs = sorted((k, i, q_row_of[k]) for i, k in enumerate(p_ids)
+                       if k in q_row_of)
+        self.ids = [k for k, i, j in pairs]
+        self.p_rows = np.array([i for k, i, j in pairs], dtype=np.intp)
+        self.q_rows = np.array([j for k, i, j in pairs], dtype=np.intp)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def ssd(self, P, Q, weights=None):
+        """sum of (weighted) square distances between aligned rows
+
+        weights, if given, holds one value per shared id.
+
+        """
+        delta = P[self.p_rows] - Q[self.q_rows]
+        square_distances = (delta * delta).sum(axis=1)
+        if weights is not None:
+            return float(square_distances.dot(weights))
+        return float(square_distances.sum())
+
+
+def _points_with_coordinates(points):
+    return sorted(k for k, v in points.items()
+                  if v.get('coordinates') is not None)
+
+
+def distance_between_homonyms(p, q, weights=None):
     """compute sum of square distances
+
+    only ids present in both p and q count.  weights, if given, is a
+    dictionary from id to weight, missing ids weigh 1.
+
     """
     import numpy as np
-    result = 0.0
-    for idp in set(p).union(set(q)):
-        result += ((np.array(p[idp]['coordinates']) -
-                    np.array(q[idp]['coordinates'])) ** 2).sum()
-    return result
+    p_ids, q_ids = _points_with_coordinates(p), _points_with_coordinates(q)
+    index = HomonymIndex(p_ids, q_ids)
+    if weights is not None:
+        weights = np.array([weights.get(k, 1.0) for k in index.ids])
+    return index.ssd(coordinates_array(p, p_ids),
+                     coordinates_array(q, q_ids), weights)
+
+
+def coordinates_array(points, ids):
+    """(N, 2) array of the 'coordinates' of points[id], for id in ids
 
+    """
+    import numpy as np
+    return np.array([tuple(points[k]['coordinates'])[:2] for k in ids],
+                    dtype=float).reshape(-1, 2)
+
+
+def rigid_fit(P, Q, weights=None):
+    """x, y, theta of the rigid transformation best moving rows of P to Q
 
-def compute_minimal_distance_transformation(p, q):
+    closed form least squares (Kabsch): the rotation comes from the SVD of
+    the covariance of the centred coordinates, the displacement from the
+    centroids.  theta is in degrees, as in rigid_transform_points.
+    weights, if given, holds one weight per row.
+
+    """
+    import numpy as np
+    from math import atan2, pi
+    if not len(P):
+        return np.zeros(3)
+    if weights is None:
+        weights = np.ones(len(P))
+    weights = np.asarray(weights, dtype=float)
+    p0 = weights.dot(P) / weights.sum()
+    q0 = weights.dot(Q) / weights.sum()
+    H = ((P - p0) * weights[:, None]).T.dot(Q - q0)
+    U, S, Vt = np.linalg.svd(H)
+    # no reflections
+    d = np.sign(np.linalg.det(Vt.T.dot(U.T))) or 1.0
+    R = Vt.T.dot(np.diag([1.0, d])).dot(U.T)
+    x, y = q0 - R.dot(p0)
+    return np.array([x, y, atan2(R[1, 0], R[0, 0]) / pi * 180.0])
+
+
+def compute_minimal_distance_transformation(p, q, method='svd',
+                                            weights=None):
     """computes the x, y, theta rigid transformation that minimizes the SSD
 
     the rigid transformation applied to the frame 'p' that approximates it
     to the points 'q'
 
-    """
+    only points with coordinates in both frames count.  weights, if given,
+    is a dictionary from id to weight, missing ids weigh 1.
 
-    def target(x):
-        return distance_between_homonyms(rigid_transform_points(p, *x), q)
+    method 'svd' solves in closed form, see rigid_fit.  method 'powell'
+    minimizes the SSD numerically.
 
+    """
     import numpy as np
+    if method not in ('svd', 'powell'):
+        raise ValueError('unknown method %s' % method)
+    p_ids, q_ids = _points_with_coordinates(p), _points_with_coordinates(q)
+    index = HomonymIndex(p_ids, q_ids)
+    if weights is not None:
+        weights = np.array([weights.get(k, 1.0) for k in index.ids])
+    P = coordinates_array(p, p_ids)
+    Q = coordinates_array(q, q_ids)
+    if method == 'svd':
+        return rigid_fit(P[index.p_rows], Q[index.q_rows], weights)
+
     import scipy.optimize
+    # only the shared rows matter, keep just those
+    P, Q = P[index.p_rows], Q[index.q_rows]
+    index = HomonymIndex(index.ids, index.ids)
+    work = np.empty(P.shape)
+
+    def target(x):
+        return index.ssd(rigid_transform_array(P, *x, out=work), Q, weights)
+
     optres = scipy.optimize.minimize(target, (0, 0, 0), method='Powell')
     return optres.x
 
 
+class SpatialIndex(object):
+    def __init__(self, min_buffer=64):
+        """nearest neighbour and radius queries over point coordinates
+
+        coordinates live in a few scipy.spatial.cKDTree, over consecutive
+        runs of keys, each at least twice as large as the next, plus a
+        buffer of fewer than min_buffer recent additions, with a tree of
+        its own built when first queried.  a full buffer becomes a tree,
+        merged with the smaller ones like carries in a binary counter, so
+        every point is rebuilt into O(log n) trees, additions cost
+        amortized O(log^2 n), and queries search O(log n) trees, also when
+        they alternate with additions.
+
+        """
+        self.min_buffer = min_buffer
+        self.keys = []
+        # (position of the first key, tree), largest first
+        self._levels = []
+        self._buffer = []
+        self._buffer_tree = None
+
+    @classmethod
+    def from_points(cls, points, **kwargs):
+        """index all points having coordinates
+
+        """
+        index = cls(**kwargs)
+        keys = _points_with_coordinates(points)
+        index.add_many(keys, coordinates_array(points, keys))
+        return index
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key, xy):
+        self.keys.append(key)
+        self._buffer.append(tuple(xy)[:2])
+        self._buffer_tree = None
+        if len(self._buffer) >= self.min_buffer:
+            self._flush()
+
+    def add_many(self, keys, xy):
+        import numpy as np
+        self._flush()
+        xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+        self.keys.extend(keys)
+        self._push(xy)
+
+    def coordinates(self):
+        """(N, 2) array of indexed coordinates, in order of keys
+
+        """
+        import numpy as np
+        return np.vstack([tree.data for start, tree in self._levels] +
+                         [np.array(self._buffer, dtype=float).reshape(-1, 2)])
+
+    def _flush(self):
+        import numpy as np
+        if self._buffer:
+            xy = np.array(self._buffer, dtype=float)
+            self._buffer = []
+            self._buffer_tree = None
+            self._push(xy)
+
+    def _push(self, xy):
+        import numpy as np
+        from scipy.spatial import cKDTree
+        if not len(xy):
+            return
+        start = len(self.keys) - len(self._buffer) - len(xy)
+        # merge with the smaller or equal trees before this one
+        while self._levels and len(self._levels[-1][1].data) <= len(xy):
+            start, tree = self._levels.pop()
+            xy = np.vstack((tree.data, xy))
+        self._levels.append((start, cKDTree(xy)))
+
+    def _trees(self):
+        """(position of the first key, tree) for all trees, buffer's too
+
+        """
+        from scipy.spatial import cKDTree
+        if self._buffer and self._buffer_tree is None:
+            self._buffer_tree = cKDTree(self._buffer)
+        trees = list(self._levels)
+        if self._buffer:
+            trees.append((len(self.keys) - len(self._buffer),
+                          self._buffer_tree))
+        return trees
+
+    def query_radius(self, xy, r):
+        """keys of indexed points within r of each row of (M, 2) xy
+
+        return one list per row.
+
+        """
+        import numpy as np
+        xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+        result = [[] for row in xy]
+        for start, tree in self._trees():
+            for found, rows in zip(result, tree.query_ball_point(xy, r)):
+                found.extend(self.keys[start + i] for i in rows)
+        return result
+
+    def query_knn(self, xy, k=1):
+        """k nearest indexed points to each row of (M, 2) xy
+
+        return two (M, k) arrays: distances, and positions in keys; missing
+        neighbours have infinite distance and position -1.
+
+        """
+        import numpy as np
+        xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+        distances = [np.empty((len(xy), 0))]
+        positions = [np.empty((len(xy), 0), dtype=np.int64)]
+        for start, tree in self._trees():
+            d, i = tree.query(xy, k)
+            d, i = d.reshape(len(xy), -1), i.reshape(len(xy), -1)
+            distances.append(d)
+            positions.append(np.where(np.isfinite(d), i + start, -1))
+        distances, positions = np.hstack(distances), np.hstack(positions)
+        order = np.argsort(distances, axis=1, kind='mergesort')[:, :k]
+        rows = np.arange(len(xy))[:, None]
+        distances, positions = distances[rows, order], positions[rows, order]
+        if distances.shape[1] < k:
+            missing = k - distances.shape[1]
+            distances = np.hstack((distances,
+                                   np.full((len(xy), missing), np.inf)))
+            positions = np.hstack((positions,
+                                   -np.ones((len(xy), missing), np.int64)))
+        return distances, positions
+
+
+def find_close_pairs(xy, tolerance, other=None):
+    """pairs of points closer than tolerance, by spatial grid hashing
+
+    points are hashed to square cells of side tolerance, and each is
+    compared only to those in its own and the eight surrounding cells,
+    so the expected cost is linear in the number of points.
+
+    without other, return sorted (i, j, distance) for rows i < j of (N, 2)
+    array xy.  with other, an (M, 2) array, return (i, j, distance) for
+    row i of xy close to row j of other.  tolerance must be positive.
+
+    """
+    import numpy as np
+    from math import floor, sqrt
+    if not tolerance > 0:
+        raise ValueError('tolerance must be positive, not %s' % tolerance)
+    xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+    targets = xy if other is None else np.asarray(
+        other, dtype=float).reshape(-1, 2)
+    cells = {}
+    for j, (x, y) in enumerate(targets.tolist()):
+        cells.setdefault((int(floor(x / tolerance)),
+                          int(floor(y / tolerance))), []).append(j)
+    result = []
+    for i, (x, y) in enumerate(xy.tolist()):
+        cx, cy = int(floor(x / tolerance)), int(floor(y / tolerance))
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for j in cells.get((cx + dx, cy + dy), ()):
+                    if other is None and j <= i:
+                        continue
+                    u, v = targets[j]
+                    distance = sqrt((x - u) ** 2 + (y - v) ** 2)
+                    if distance < tolerance:
+                        result.append((i, j, distance))
+    return sorted(result)
+
+
+def plan_write_back(new_xy, old_xy, tolerance, policy='skip'):
+    """decide how to write computed points to a layer holding old points
+
+    new points closer than tolerance to an old point are treated by
+    policy: 'insert' them anyway, 'skip' them, 'update' the old point to
+    the new position, or 'merge' the two, moving the old point to their
+    midpoint.  a new point near more than one old one goes to the closest.
+    new points closer than tolerance to each other are all inserted with
+    'insert'; with the other policies, only the lowest indexed one is,
+    or used to update or merge with an old point; the others are dropped.
+
+    return (insert, moves, report): the indices of new points to insert;
+    (old index, (x, y)) for old points to move; and (kind, i, j, distance)
+    for every close pair found, kind is 'existing' when new point i is
+    close to old point j, 'computed' when it is close to new point j.
+
+    """
+    import numpy as np
+    if policy not in ('insert', 'skip', 'update', 'merge'):
+        raise ValueError('unknown policy %s' % policy)
+    new_xy = np.asarray(new_xy, dtype=float).reshape(-1, 2)
+    old_xy = np.asarray(old_xy, dtype=float).reshape(-1, 2)
+    existing = find_close_pairs(new_xy, tolerance, old_xy)
+    computed = find_close_pairs(new_xy, tolerance)
+    report = [('existing', i, j, d) for i, j, d in existing]
+    report.extend(('computed', i, j, d) for i, j, d in computed)
+    closest = {}
+    for i, j, d in existing:
+        if i not in closest or d < closest[i][1]:
+            closest[i] = (j, d)
+    # new points close to a lower indexed new point which is kept
+    dropped = set()
+    if policy != 'insert':
+        lower = {}
+        for i, j, d in computed:
+            lower.setdefault(j, []).append(i)
+        for j in range(len(new_xy)):
+            if any(i not in dropped for i in lower.get(j, [])):
+                dropped.add(j)
+    moves = []
+    if policy == 'insert':
+        insert = range(len(new_xy))
+    else:
+        insert = [i for i in range(len(new_xy))
+                  if i not in closest and i not in dropped]
+    if policy in ('update', 'merge'):
+        for i, (j, d) in sorted(closest.items()):
+            if i in dropped:
+                continue
+            x, y = new_xy[i]
+            if policy == 'merge':
+                x, y = (new_xy[i] + old_xy[j]) / 2.0
+            moves.append((j, (float(x), float(y))))
+    return insert, moves, report
+
+
 def utm_zone_proj4(pt):
     import math
     lon, lat = pt
@@ -341,63 +1223,1403 @@ def utm_zone_proj4(pt):
     return wkt
 
 
-def extrapolate_coordinates(points, distances):
+class Provenance(object):
+    def __init__(self):
+        """which references each computed point was solved from
+
+        points get a number the first time they are seen, as solved point
+        or as reference.  solved points are kept in solve order, each
+        owning a slice of two flat arrays: the numbers of its references,
+        and the residuals of its solution against them.  a correction to a
+        point invalidates exactly its descendants.
+
+        """
+        from array import array
+        self.ids = []
+        self.index = {}
+        self._solved = array('l')
+        self._offsets = array('l', [0])
+        self._references = array('l')
+        self._residuals = array('d')
+        # position in solve order of each solved point number
+        self._row = {}
+        # reverse graph, built on demand
+        self._children = None
+
+    def _number(self, point_id):
+        n = self.index.get(point_id)
+        if n is None:
+            n = self.index[point_id] = len(self.ids)
+            self.ids.append(point_id)
+        return n
+
+    def add(self, point_id, references, residuals):
+        """point_id was solved from references, leaving residuals
+
+        """
+        n = self._number(point_id)
+        self._row[n] = len(self._solved)
+        self._solved.append(n)
+        self._references.extend(self._number(k) for k in references)
+        self._residuals.extend(float(r) for r in residuals)
+        self._offsets.append(len(self._references))
+        self._children = None
+
+    def __len__(self):
+        return len(self._solved)
+
+    def __contains__(self, point_id):
+        return self.index.get(point_id) in self._row
+
+    def order(self):
+        """ids of solved points, in solve order
+
+        """
+        return [self.ids[n] for n in self._solved]
+
+    def _slice(self, point_id):
+        row = self._row[self.index[point_id]]
+        return self._offsets[row], self._offsets[row + 1]
+
+    def references(self, point_id):
+        start, stop = self._slice(point_id)
+        return [self.ids[n] for n in self._references[start:stop]]
+
+    def residuals(self, point_id):
+        import numpy as np
+        start, stop = self._slice(point_id)
+        return np.array(self._residuals[start:stop], dtype=float)
+
+    def items(self):
+        """(point_id, references, residuals) for solved points, in order
+
+        """
+        for point_id in self.order():
+            yield (point_id, self.references(point_id),
+                   self.residuals(point_id))
+
+    @classmethod
+    def from_state(cls, state):
+        """provenance of the solve described by state, see solve_state
+
+        """
+        provenance = cls()
+        for k in state['order']:
+            provenance.add(k, state['references'][k], state['residuals'][k])
+        return provenance
+
+    def arrays(self):
+        """solved, offsets, references, residuals, as numpy arrays
+
+        point numbers of solved points in solve order; the slice
+        offsets[i]:offsets[i+1] of references and residuals belongs to the
+        i-th of them.
+
+        """
+        import numpy as np
+        return (np.array(self._solved, dtype=np.int64),
+                np.array(self._offsets, dtype=np.int64),
+                np.array(self._references, dtype=np.int64),
+                np.array(self._residuals, dtype=float))
+
+    def _child_graph(self):
+        """reverse of the references, as CSR arrays indptr and children
+
+        """
+        import numpy as np
+        if self._children is None:
+            solved, offsets, references, residuals = self.arrays()
+            owners = np.repeat(solved, np.diff(offsets))
+            indptr = np.zeros(len(self.ids) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(references, minlength=len(self.ids)),
+                      out=indptr[1:])
+            self._children = (
+                indptr, owners[np.argsort(references, kind='mergesort')])
+        return self._children
+
+    def descendants(self, *point_ids):
+        """ids of points solved, directly or not, from any of point_ids
+
+        """
+        import numpy as np
+        indptr, children = self._child_graph()
+        seen = np.zeros(len(self.ids), dtype=bool)
+        frontier = np.array([self.index[k] for k in point_ids
+                             if k in self.index], dtype=np.int64)
+        while len(frontier):
+            starts, lengths = indptr[frontier], np.diff(indptr)[frontier]
+            total = lengths.sum()
+            if not total:
+                break
+            # concatenate the children ranges of the whole frontier
+            within = np.arange(total) - np.repeat(
+                np.cumsum(lengths) - lengths, lengths)
+            found = children[np.repeat(starts, lengths) + within]
+            frontier = np.unique(found[~seen[found]])
+            seen[frontier] = True
+        return set(self.ids[n] for n in np.flatnonzero(seen))
+
+
+def _solve_frontier_chunk(args):
+    """process pool worker: solve one chunk of a frontier
+
+    """
+    points, distances, point_ids, robust = args
+    outliers = []
+    solved = find_points_coordinates(points, distances, point_ids,
+                                     robust=robust, outliers=outliers)
+    return solved, outliers
+
+
+def _solve_frontier(points, distances, frontier, pool=None, processes=1,
+                    robust=None, outliers=None):
+    """solve all points in frontier, optionally spreading work on pool
+
+    """
+    if pool is None or len(frontier) < 2:
+        return find_points_coordinates(points, distances, frontier,
+                                       robust=robust, outliers=outliers)
+    chunks = []
+    size = -(-len(frontier) // processes)
+    for start in range(0, len(frontier), size):
+        chunk = frontier[start:start + size]
+        # ship only what the worker needs: the points and their references
+        # plain dict rows: a DistanceGraph row would drag its graph along
+        sub_distances = dict((k, dict(distances[k])) for k in chunk)
+        sub_points = {}
+        for k in chunk:
+            sub_points[k] = points[k]
+            for ref_id in distances[k]:
+                sub_points[ref_id] = points[ref_id]
+        chunks.append((sub_points, sub_distances, chunk, robust))
+    result = {}
+    for solved, rejected in pool.map(_solve_frontier_chunk, chunks):
+        result.update(solved)
+        if outliers is not None:
+            outliers.extend(rejected)
+    return result
+
+
+def extrapolate_coordinates_by_levels(points, distances, processes=None,
+                                      spatial_index=None, provenance=None,
+                                      robust=None, outliers=None,
+                                      is_cancelled=None):
+    """compute missing coordinates, one ready frontier at a time
+
+    the frontier is the set of all points with at least three referenced
+    neighbours.  these do not depend on each other, so the frontier is
+    solved as a whole, on a pool of processes if processes is given, then
+    the points it makes reachable form the next frontier.  frontiers are
+    handled in sorted order, so the result does not depend on the pool.
+
+    stop when a frontier yields no new coordinates, and return the number
+    of levels computed.  points which could not be reached are left
+    without coordinates, with 'prio' holding their referenced neighbours.
+
+    points receiving coordinates are added to spatial_index and to
+    provenance, if given, and robust, outliers and is_cancelled work, as
+    in extrapolate_coordinates.
+
+    """
+    referenced = {}
+    for k, p in points.items():
+        if 'coordinates' not in p:
+            referenced[k] = len([
+                ref_id for ref_id in distances.get(k, {})
+                if points[ref_id].get('coordinates')])
+    frontier = sorted(k for k, n in referenced.items() if n >= 3)
+
+    pool = None
+    if processes is not None:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes)
+    levels = 0
+    try:
+        while frontier:
+            if is_cancelled is not None and is_cancelled():
+                break
+            rejected = []
+            solved = _solve_frontier(
+                points, distances, frontier, pool, processes,
+                robust, rejected)
+            if outliers is not None:
+                outliers.extend(rejected)
+            if not solved:
+                break
+            levels += 1
+            touched = set()
+            if provenance is not None:
+                rejected = set((edge.point_id, edge.reference_id)
+                               for edge in rejected)
+                for k in sorted(solved):
+                    references, dists = _referenced_neighbours(
+                        points, distances, k)
+                    used = [(r, d) for r, d in zip(references, dists)
+                            if (k, r) not in rejected]
+                    references = [r for r, d in used]
+                    provenance.add(k, references, _solution_residuals(
+                        coordinates_array(points, references),
+                        [d for r, d in used], solved[k]))
+            for k in sorted(solved):
+                points[k]['coordinates'] = list(solved[k])
+                points[k]['computed'] = True
+                if spatial_index is not None:
+                    spatial_index.add(k, solved[k])
+                del referenced[k]
+                for neighbour_id in distances[k]:
+                    if neighbour_id in referenced:
+                        referenced[neighbour_id] += 1
+                        touched.add(neighbour_id)
+            # points left behind as degenerate get a new chance only once
+            # they gain a reference
+            frontier = sorted(k for k in touched
+                              if k in referenced and referenced[k] >= 3)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    for k, n in referenced.items():
+        points[k]['prio'] = n
+    return levels
+
+
+def extrapolate_coordinates(points, distances, wavefront=False,
+                            processes=None, spatial_index=None,
+                            provenance=None, robust=None, outliers=None,
+                            parked=None, is_cancelled=None):
     """compute missing coordinates respecting distances and given points
 
     navigate distances graph, keep selecting most connected point, to
     compute its coordinates given enough distances from enough referenced
     points.
 
+    with wavefront set, first solve whole frontiers at once, see
+    extrapolate_coordinates_by_levels, passing it processes.  whatever
+    remains is then handled one point at a time.
+
+    points receiving coordinates are added to spatial_index, a
+    SpatialIndex, and to provenance, a Provenance, if given: there each
+    gets the references it was solved from and its residuals.
+
+    with robust, a tolerance in metres, distances which disagree with the
+    others are not used, see find_points_coordinates; they are reported
+    as OutlierEdge in outliers, if given.
+
+    a point which can not be solved is parked until one more of its
+    neighbours gets coordinates, so every point is attempted at most once
+    per referenced neighbour.  points still parked at the end are left
+    without coordinates, and described in parked, a dictionary, if given:
+    each gets a ParkedPoint with its number of references and the reason.
+
+    is_cancelled, a function, is called before each point is solved: once
+    it returns true, the computation stops, leaving the remaining points
+    without coordinates and parked untouched.
+
     """
-    # remember last attempted point, to avoid deadlocks
-    last_attempted_point = None
+    if wavefront:
+        extrapolate_coordinates_by_levels(points, distances, processes,
+                                          spatial_index, provenance,
+                                          robust, outliers, is_cancelled)
+    # dense index for each point, the heap works on these
+    ids = list(points)
+    index_of = dict((k, i) for i, k in enumerate(ids))
     # construct priority queue of points for which we still have no
     # coordinates
-    heap = Heap([p for p in points.values() if 'coordinates' not in p])
+    heap = IndexedHeap([points[k].get('prio', 0) for k in ids],
+                       [i for i, k in enumerate(ids)
+                        if 'coordinates' not in points[k]])
+    # points we could not solve wait here, out of the heap, until one
+    # more of their neighbours gets coordinates
+    waiting = {}
 
     while heap:
-        point = heap.pop()
+        if is_cancelled is not None and is_cancelled():
+            return
+        i = heap.pop()
+        point_id = ids[i]
+        point = points[point_id]
         # compute coordinates of point
-        try:
-            point['coordinates'] = list(
-                find_point_coordinates(points, distances, point['id']))
-        except ValueError:
-            point['prio'] = 2
-            if last_attempted_point != point:
-                heap.push(point)
-                last_attempted_point = point
+        solution = _solve_point(points, distances, point_id,
+                                robust, outliers, min_references=3)
+        if solution is None:
+            waiting[i] = point_id
             continue
+        xy, references, residuals = solution
+        point['coordinates'] = list(xy)
         point['computed'] = True
+        if provenance is not None:
+            provenance.add(point_id, references, residuals)
+        if spatial_index is not None:
+            spatial_index.add(point_id, point['coordinates'])
 
         # inform points connected to point that they have one more
         # referenced neighbour
-        for neighbour_id, destinations in distances[point['id']].items():
-            neighbour = points[neighbour_id]
-            if 'heappos' in neighbour:
-                heap.reprioritize(neighbour)
+        for neighbour_id in distances.get(point_id, {}):
+            j = index_of[neighbour_id]
+            if j in heap:
+                heap.reprioritize(j)
+            elif j in waiting:
+                del waiting[j]
+                heap.push(j, heap.priority(j) + 1)
+            else:
+                continue
+            points[neighbour_id]['prio'] = heap.priority(j)
+
+    if parked is not None:
+        for point_id in waiting.values():
+            references = _referenced_neighbours(
+                points, distances, point_id)[0]
+            if len(references) < 3:
+                reason = 'too few references'
+            elif robust is not None and len(references) > 3:
+                reason = 'no consistent references'
+            else:
+                reason = 'references almost collinear'
+            parked[point_id] = ParkedPoint(len(references), reason)
 
 
-def get_distances_from_csv(stream, points):
-    distances = {}
-    for l in stream.readlines():
-        l = l.strip()
-        try:
-            from_id, to_id, distance = l.split(',')[:3]
-            distance = float(distance)
-        except Exception, e:
-            print '»', l, '«', type(e), e
+def error_ellipses(points, provenance, sigma=None):
+    """standard errors of computed coordinates, from their solves
+
+    each point in provenance was located by least squares on its
+    distances to k references.  its covariance is s^2 (J^T J)^-1, J the
+    (k, 2) jacobian of the distances at the solution, made of unit vectors
+    from the references, and s^2 the residual variance, sum(r^2) / (k - 2),
+    or sigma^2 when an a priori measurement standard error is given.
+    points sharing k are computed at once.
+
+    points get 'sigma_x' and 'sigma_y', the standard errors of their
+    coordinates, and 'orientation', the direction of the major axis of
+    their error ellipse in degrees counterclockwise from x.  degenerate
+    geometries give infinite errors.
+
+    """
+    import numpy as np
+    solved, offsets, references, residuals = provenance.arrays()
+    if not len(solved):
+        return
+    xy = np.full((len(provenance.ids), 2), np.nan)
+    placed = [n for n, k in enumerate(provenance.ids)
+              if points.get(k, {}).get('coordinates') is not None]
+    xy[placed] = coordinates_array(points, [provenance.ids[n]
+                                            for n in placed])
+    counts = np.diff(offsets)
+    for k in np.unique(counts):
+        rows = np.flatnonzero(counts == k)
+        slices = offsets[rows][:, None] + np.arange(k)
+        delta = xy[solved[rows]][:, None, :] - xy[references[slices]]
+        lengths = np.sqrt((delta * delta).sum(axis=2))
+        J = delta / np.where(lengths == 0, 1, lengths)[..., None]
+        N = np.einsum('nki,nkj->nij', J, J)
+        det = N[:, 0, 0] * N[:, 1, 1] - N[:, 0, 1] * N[:, 1, 0]
+        if sigma is not None:
+            variance = np.full(len(rows), float(sigma) ** 2)
+        elif k > 2:
+            r = residuals[slices]
+            variance = (r * r).sum(axis=1) / (k - 2)
+        else:
+            variance = np.full(len(rows), np.inf)
+        regular = det > 1e-12
+        scale = variance / np.where(regular, det, 1)
+        cxx = np.where(regular, scale * N[:, 1, 1], np.inf)
+        cyy = np.where(regular, scale * N[:, 0, 0], np.inf)
+        cxy = np.where(regular, -scale * N[:, 0, 1], 0.0)
+        orientation = np.degrees(0.5 * np.arctan2(
+            2 * cxy, np.where(regular, cxx - cyy, 0.0)))
+        for n, sx, sy, angle in zip(solved[rows].tolist(),
+                                    np.sqrt(cxx).tolist(),
+                                    np.sqrt(cyy).tolist(),
+                                    orientation.tolist()):
+            point = points[provenance.ids[n]]
+            point['sigma_x'] = sx
+            point['sigma_y'] = sy
+            point['orientation'] = angle
+
+
+def solve_state(points, distances, provenance):
+    """what incremental_extrapolate needs to know about a finished solve
+
+    a dictionary holding the 'coordinates' of all points having them, the
+    'order' in which points were computed, the 'references' each was
+    computed from and its 'residuals', all from provenance, and the
+    'distances' rows of all points.
+
+    """
+    return {
+        'coordinates': dict((k, list(tuple(p['coordinates'])[:2]))
+                            for k, p in points.items()
+                            if p.get('coordinates') is not None),
+        'order': provenance.order(),
+        'references': dict((k, provenance.references(k))
+                           for k in provenance.order()),
+        'residuals': dict((k, provenance.residuals(k).tolist())
+                          for k in provenance.order()),
+        'distances': dict((k, dict(row)) for k, row in distances.items())}
+
+
+def _map_state_ids(state, f):
+    """state with every point id k replaced by f(k)
+
+    """
+    return {'coordinates': dict((f(k), v)
+                                for k, v in state['coordinates'].items()),
+            'order': [f(k) for k in state['order']],
+            'references': dict((f(k), [f(r) for r in v])
+                               for k, v in state['references'].items()),
+            'residuals': dict((f(k), v)
+                              for k, v in state['residuals'].items()),
+            'distances': dict((f(k), dict((f(r), d) for r, d in v.items()))
+                              for k, v in state['distances'].items())}
+
+
+def _json_id(k):
+    # JSON does not tell bytes from text: tag bytes, read as latin-1
+    if isinstance(k, str):
+        return {'bytes': k.decode('latin-1')}
+    return k
+
+
+def _unjson_id(k):
+    if isinstance(k, dict):
+        return k['bytes'].encode('latin-1')
+    return k
+
+
+def save_solve_state(filename, state, origin=None):
+    """write state to filename as JSON
+
+    point ids, whatever their type, are listed once under 'ids' and
+    everywhere else replaced by their position in that list.  origin, any
+    JSON value, tells where the points came from, see load_solve_state.
+
+    """
+    import json
+    ids = set(state['coordinates']).union(state['distances'], state['order'])
+    for references in state['references'].values():
+        ids.update(references)
+    # bytes and text do not compare: sort on repr
+    ids = sorted(ids, key=repr)
+    number = dict((k, n) for n, k in enumerate(ids))
+    document = _map_state_ids(state, number.get)
+    document['ids'] = [_json_id(k) for k in ids]
+    document['origin'] = origin
+    with open(filename, 'w') as f:
+        json.dump(document, f)
+
+
+def load_solve_state(filename, origin=None):
+    """read the state written by save_solve_state, None if unreadable
+
+    also None if the state was saved with a different origin: the same
+    distances file, used with another layer or key field, says nothing
+    about the points at hand.
+
+    """
+    import json
+    try:
+        with open(filename) as f:
+            document = json.load(f)
+        # compare as JSON has it: tuples become lists, bytes text
+        if document.get('origin') != json.loads(json.dumps(origin)):
+            return None
+        ids = [_unjson_id(k) for k in document['ids']]
+        return _map_state_ids(document, lambda n: ids[int(n)])
+    except (IOError, ValueError, KeyError, IndexError, TypeError,
+            AttributeError, UnicodeError):
+        return None
+
+
+def incremental_extrapolate(points, distances, state, **kwargs):
+    """compute missing coordinates, reusing a previous solve where valid
+
+    state comes from solve_state.  a point needs solving again if its
+    distances changed, if it is new, or if any of the points it was
+    computed from does; reference points, those with coordinates which
+    were not computed last time, count as changed when they moved, appeared
+    or vanished.  the other previously computed points get their old
+    coordinates back, everything else goes through extrapolate_coordinates,
+    with kwargs.
+
+    return the new state and the set of ids of points solved again.
+
+    """
+    old_coordinates = state['coordinates']
+    old_distances = state['distances']
+    computed_before = set(state['order'])
+    changed = set()
+    for k in set(old_distances).union(distances):
+        if dict(distances.get(k, {})) != old_distances.get(k, {}):
+            changed.add(k)
+    for k, p in points.items():
+        # coordinates of points computed last time, maybe written back to
+        # the layer, are no reference: they are restored or solved again
+        if k in computed_before or p.get('coordinates') is None:
             continue
-        distances.setdefault(from_id, {})
-        distances.setdefault(to_id, {})
-        distances[from_id][to_id] = distance
-        distances[to_id][from_id] = distance
-        points.setdefault(to_id, {'id': to_id,
-                                  "type": "Point"})
-        points.setdefault(from_id, {'id': from_id,
-                                    "type": "Point"})
-    # inform each point on how many links lead to referenced point
+        old = old_coordinates.get(k)
+        if old is None or any(
+                abs(a - b) > 1e-9 for a, b in zip(
+                    tuple(p['coordinates'])[:2], old)):
+            changed.add(k)
+    for k in old_coordinates:
+        if k not in computed_before and (
+                k not in points or
+                points[k].get('coordinates') is None):
+            changed.add(k)
+
+    provenance = Provenance.from_state(state)
+    changed.update(k for k in computed_before if k not in points)
+    dirty = computed_before.intersection(changed).union(
+        provenance.descendants(*changed))
+
+    # clean points start the new provenance, in the old order
+    solved = Provenance()
+    for k, refs, residuals in provenance.items():
+        if k not in dirty:
+            points[k]['coordinates'] = old_coordinates[k]
+            points[k]['computed'] = True
+            solved.add(k, refs, residuals)
+    for k in dirty.intersection(points):
+        points[k].pop('coordinates', None)
+        points[k]['computed'] = False
+    for k, p in points.items():
+        if p.get('coordinates') is None:
+            p['prio'] = len(_referenced_neighbours(points, distances, k)[0])
+
+    solved_before = len(solved)
+    extrapolate_coordinates(points, distances, provenance=solved, **kwargs)
+    resolved = set(solved.order()[solved_before:])
+    return solve_state(points, distances, solved), resolved
+
+
+ComponentResult = namedtuple('ComponentResult', 'ids computed error')
+
+
+def connected_components(distances):
+    """ids of the points in each connected component of distances
+
+    components come largest first, ids sorted within each.
+
+    """
+    import numpy as np
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import connected_components as label
+    graph = as_distance_graph(distances)
+    n = len(graph.ids)
+    count, labels = label(csr_matrix(
+        (np.ones(len(graph.indices)), graph.indices, graph.indptr),
+        shape=(n, n)), directed=False)
+    order = np.argsort(labels, kind='mergesort')
+    sizes = np.bincount(labels, minlength=count)
+    components = [[graph.ids[i] for i in members.tolist()]
+                  for members in np.split(order, np.cumsum(sizes)[:-1])]
+    components.sort(key=lambda ids: (-len(ids), ids[0]))
+    return components
+
+
+def _solve_component(args):
+    """solve one component, see solve_components; also a pool worker
+
+    return the new coordinates, of computed points, and the error.
+
+    """
+    points, distances, gps, kwargs = args
+    try:
+        if gps is None:
+            extrapolate_coordinates(points, distances, **kwargs)
+        else:
+            place_initial_three_points(points, distances, gps)
+            extrapolate_coordinates(points, distances, **kwargs)
+            t = compute_minimal_distance_transformation(points, gps)
+            points = rigid_transform_points(points, *t)
+            for p in points.values():
+                if p.get('coordinates') is not None:
+                    p['computed'] = True
+    except ValueError, e:
+        return {}, str(e)
+    return dict((k, list(p['coordinates'])) for k, p in points.items()
+                if p.get('computed')), None
+
+
+def solve_components(points, distances, gps=None, processes=None,
+                     **kwargs):
+    """compute missing coordinates, each connected component on its own
+
+    without gps, components are solved from the points having coordinates
+    in them, see extrapolate_coordinates, which gets kwargs.  with gps, a
+    dictionary of measured positions, every component is solved from its
+    own seed triangle and fit onto gps by a rigid transformation, as a
+    whole; points gets the result.
+
+    components are solved on a pool of processes, if processes is given.
+    objects in kwargs collecting results, like provenance or outliers,
+    then stay empty: they are copied to the workers.  an is_cancelled
+    function in kwargs is checked between components, and within them
+    unless on a pool; once it returns true, no more components are
+    solved, or the pool is terminated.
+
+    return a ComponentResult for each component solved, largest first: its
+    ids, how many points got coordinates, and the error if it failed.
+
+    """
+    graph = as_distance_graph(distances)
+    components = connected_components(graph)
+    jobs = []
+    for ids in components:
+        sub_points = {}
+        for k in ids:
+            sub_points[k] = dict(points.get(k, {'id': k}))
+            if gps is not None:
+                # coordinates come from gps, relative to the component
+                sub_points[k].pop('coordinates', None)
+        sub_graph = graph.subgraph(ids)
+        _init_connectivity(sub_points, sub_graph)
+        sub_gps = None
+        if gps is not None:
+            sub_gps = dict((k, gps[k]) for k in ids if k in gps)
+        jobs.append((sub_points, sub_graph, sub_gps, kwargs))
+
+    is_cancelled = kwargs.get('is_cancelled') or (lambda: False)
+    solved = []
+    if processes is None or len(jobs) < 2:
+        for job in jobs:
+            if is_cancelled():
+                break
+            solved.append(_solve_component(job))
+    else:
+        import multiprocessing
+        # functions do not travel to the workers, we watch instead
+        options = dict((k, v) for k, v in kwargs.items()
+                       if k != 'is_cancelled')
+        jobs = [job[:3] + (options, ) for job in jobs]
+        pool = multiprocessing.Pool(processes)
+        try:
+            pending = pool.map_async(_solve_component, jobs, chunksize=1)
+            while not pending.ready() and not is_cancelled():
+                pending.wait(0.1)
+            if pending.ready():
+                solved = pending.get()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    results = []
+    for ids, (coordinates, error) in zip(components, solved):
+        for k, xy in coordinates.items():
+            point = points.setdefault(k, {'id': k})
+            point['coordinates'] = xy
+            point['computed'] = True
+        results.append(ComponentResult(ids, len(coordinates), error))
+    return results
+
+
+def _distance_residuals(X, src, dst, weights):
+    """residuals |X[src] - X[dst]| - weights, with unit vectors src->dst
+
+    """
+    import numpy as np
+    delta = X[src] - X[dst]
+    lengths = np.sqrt((delta * delta).sum(axis=1))
+    units = delta / np.maximum(lengths, 1e-12)[:, None]
+    return lengths - weights, units
+
+
+def _network_preconditioner(J, extra, xy, cluster_size=64):
+    """two-level preconditioner for J^T J + diag(extra), J a network jacobian
+
+    J has two columns per point, xy holds the points' positions.  the fine
+    level inverts the 2x2 blocks of the matrix.  the coarse level solves it
+    exactly on the rigid motions of clusters of about cluster_size
+    neighbouring points, which are the smooth, slowly converging, error
+    components.  the matrix itself is never formed.
+
+    """
+    import numpy as np
+    import scipy.sparse
+    import scipy.sparse.linalg
+    n = len(xy)
+    even = np.arange(0, 2 * n, 2)
+    squares = np.asarray(J.multiply(J).sum(axis=0)).ravel()
+    a = squares[0::2] + extra[0::2]
+    c = squares[1::2] + extra[1::2]
+    # move each y column onto its x column to pair them up row by row
+    shift = scipy.sparse.csr_matrix(
+        (np.ones(n), (even + 1, even)), shape=(2 * n, 2 * n))
+    b = np.asarray(J.multiply(J * shift).sum(axis=0)).ravel()[0::2]
+    det = a * c - b * b
+
+    extent = np.ptp(xy, axis=0) + 1e-9
+    cell = max(np.sqrt(extent.prod() * cluster_size / n),
+               extent.max() * cluster_size / n)
+    cells = np.floor((xy - xy.min(axis=0)) / cell).astype(np.int64)
+    cluster = np.unique(cells[:, 0] * (cells[:, 1].max() + 1) + cells[:, 1],
+                        return_inverse=True)[1]
+    clusters = cluster.max() + 1
+    counts = np.bincount(cluster, minlength=clusters)
+    centres = np.column_stack([
+        np.bincount(cluster, xy[:, axis], minlength=clusters) / counts
+        for axis in range(2)])
+    dx, dy = (xy - centres[cluster]).T
+    # columns 3c, 3c+1 shift cluster c, column 3c+2 turns it
+    P = scipy.sparse.csr_matrix(
+        (np.concatenate([np.ones(n), -dy, np.ones(n), dx]),
+         (np.concatenate([even, even, even + 1, even + 1]),
+          np.concatenate([3 * cluster, 3 * cluster + 2,
+                          3 * cluster + 1, 3 * cluster + 2]))),
+        shape=(2 * n, 3 * clusters))
+    Pt = P.T.tocsr()
+    JP = J * P
+    coarse = (JP.T.tocsr() * JP + Pt * scipy.sparse.diags(extra) * P).tocsc()
+    coarse = coarse + scipy.sparse.diags(
+        1e-12 * (coarse.diagonal().max() + 1.0) * np.ones(3 * clusters))
+    lu = scipy.sparse.linalg.splu(coarse, permc_spec='COLAMD')
+
+    def solve(v):
+        w = v.reshape(-1, 2)
+        fine = np.column_stack([(c * w[:, 0] - b * w[:, 1]) / det,
+                                (a * w[:, 1] - b * w[:, 0]) / det]).ravel()
+        return fine + P * lu.solve(Pt * v)
+    return scipy.sparse.linalg.LinearOperator((2 * n, 2 * n), matvec=solve)
+
+
+def adjust_network(points, distances, fixed=None, max_iterations=50,
+                   tolerance=1e-8):
+    """refine all free coordinates jointly, on all measured distances
+
+    the current coordinates, e.g. as left by extrapolate_coordinates, are
+    the initial guess.  points in fixed (default: those having coordinates
+    and not 'computed') do not move; points without coordinates, and the
+    distances reaching them, are ignored.
+
+    minimize the sum of squared distance residuals by Levenberg-Marquardt
+    on a sparse Jacobian, two columns per free point, one row per used
+    distance.  steps come from conjugate gradients on the damped normal
+    equations, see _network_preconditioner, started from the previous
+    step, so large networks need no factorization of their own.  stop
+    when an iteration lowers the cost by less than tolerance times the
+    cost.  return a dictionary with the number of 'iterations', the
+    'initial_cost' and the final 'cost'.
+
+    """
+    import numpy as np
+    import scipy.sparse
+    import scipy.sparse.linalg
+    graph = as_distance_graph(distances)
+    ids = graph.ids
+    n = len(ids)
+    placed = np.array([points[k].get('coordinates') is not None
+                       for k in ids], dtype=bool)
+    if fixed is None:
+        fixed = [k for k in ids if not points[k].get('computed')]
+    fixed = set(fixed)
+    free = placed & ~np.array([k in fixed for k in ids], dtype=bool)
+    X = np.zeros((n, 2))
+    X[placed] = coordinates_array(points, [k for k in ids if
+                                           points[k].get('coordinates')
+                                           is not None])
+    variable = -np.ones(n, dtype=np.int64)
+    variable[free] = np.arange(free.sum())
+
+    src, dst, weights = graph.edges()
+    used = placed[src] & placed[dst] & (free[src] | free[dst])
+    src, dst, weights = src[used], dst[used], weights[used]
+    m = len(src)
+    result = {'iterations': 0, 'initial_cost': 0.0, 'cost': 0.0}
+    if not m or not free.any():
+        return result
+
+    # sparse structure of the Jacobian does not change between iterations
+    rows, cols, signs = [], [], []
+    for end, sign in [(src, 1.0), (dst, -1.0)]:
+        on = free[end]
+        for axis in range(2):
+            rows.append(np.arange(m)[on])
+            cols.append(2 * variable[end[on]] + axis)
+            signs.append((sign, axis, on))
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+
+    def jacobian(units):
+        values = np.concatenate([sign * units[on, axis]
+                                 for sign, axis, on in signs])
+        return scipy.sparse.csr_matrix(
+            (values, (rows, cols)), shape=(m, 2 * int(free.sum())))
+
+    residuals, units = _distance_residuals(X, src, dst, weights)
+    cost = float(residuals.dot(residuals))
+    result['initial_cost'] = cost
+    damping = 1e-3
+    growth = 2.0
+    step = None
+    initial_norm = None
+    for iteration in range(max_iterations):
+        J = jacobian(units)
+        Jt = J.T.tocsr()
+        gradient = Jt * residuals
+        diagonal = np.asarray(J.multiply(J).sum(axis=0)).ravel()
+        norm = np.sqrt(gradient.dot(gradient))
+        if initial_norm is None:
+            initial_norm = max(norm, 1e-300)
+        # solve loosely far from the minimum, tighter and tighter near it
+        forcing = min(0.1, np.sqrt(norm / initial_norm))
+        # one preconditioner per Jacobian, good enough for any damping
+        M = None
+        while True:
+            extra = damping * diagonal + 1e-12
+            A = scipy.sparse.linalg.LinearOperator(
+                (len(gradient), len(gradient)),
+                matvec=lambda v, extra=extra: Jt * (J * v) + extra * v)
+            if M is None:
+                M = _network_preconditioner(J, extra, X[free])
+            step, info = scipy.sparse.linalg.cg(
+                A, -gradient, x0=step, tol=forcing, atol=0,
+                maxiter=10 * int(np.sqrt(len(gradient))) + 100, M=M)
+            X_new = X.copy()
+            X_new[free] += step.reshape(-1, 2)
+            new_residuals, new_units = _distance_residuals(
+                X_new, src, dst, weights)
+            new_cost = float(new_residuals.dot(new_residuals))
+            # reduction predicted by the linear model, |r + J step|^2
+            Js = J * step
+            predicted = -(2 * gradient.dot(step) + Js.dot(Js))
+            if new_cost <= cost or damping > 1e10:
+                break
+            damping *= growth
+            growth *= 2
+        result['iterations'] = iteration + 1
+        if new_cost > cost:
+            break
+        improvement = cost - new_cost
+        X, residuals, units, cost = X_new, new_residuals, new_units, new_cost
+        # trust the model more the better it predicted, see Nielsen (1999)
+        gain = improvement / predicted if predicted > 0 else 0.0
+        damping = max(damping * max(1 / 3.0, 1 - (2 * gain - 1) ** 3),
+                      1e-12)
+        growth = 2.0
+        if improvement <= tolerance * cost:
+            break
+    result['cost'] = cost
+
+    for i in np.flatnonzero(free).tolist():
+        points[ids[i]]['coordinates'] = X[i].tolist()
+    return result
+
+
+class _DistanceRow(Mapping):
+    """read-only mapping from neighbour id to distance, for one node
+
+    """
+    def __init__(self, graph, i):
+        self.graph = graph
+        self.i = i
+
+    def __getitem__(self, key):
+        j = self.graph.index.get(key)
+        if j is None:
+            raise KeyError(key)
+        start, end = self.graph.indptr[self.i], self.graph.indptr[self.i + 1]
+        indices = self.graph.indices[start:end]
+        k = indices.searchsorted(j)
+        if k == len(indices) or indices[k] != j:
+            raise KeyError(key)
+        return float(self.graph.weights[start + k])
+
+    def __iter__(self):
+        ids = self.graph.ids
+        return (ids[j] for j in self.graph.neighbours(self.i))
+
+    def __len__(self):
+        return int(self.graph.indptr[self.i + 1] - self.graph.indptr[self.i])
+
+
+class DistanceGraph(Mapping):
+    def __init__(self, ids, indptr, indices, weights):
+        """symmetric distances graph on dense integer indices
+
+        ids is the sorted list of point ids, the position of an id in it is
+        its index.  edges are stored in compressed sparse row arrays: the
+        neighbours of index i are indices[indptr[i]:indptr[i+1]], sorted,
+        and weights holds the corresponding distances.  every edge appears
+        in both directions.
+
+        the graph also behaves as the read-only dictionary of dictionaries
+        get_distances_from_csv returns, so graph[a][b] is the distance
+        between points a and b.
+
+        """
+        import numpy as np
+        self.ids = list(ids)
+        self.index = dict((k, i) for i, k in enumerate(self.ids))
+        self.indptr = np.asanyarray(indptr, dtype=np.int64)
+        self.indices = np.asanyarray(indices, dtype=np.int32)
+        self.weights = np.asanyarray(weights, dtype=float)
+
+    @classmethod
+    def from_edges(cls, edges, ids=()):
+        """construct graph from iterable of (from_id, to_id, distance)
+
+        ids are added as nodes even if no edge reaches them.  when the same
+        pair is given more than once, the last distance wins.
+
+        """
+        from_ids, to_ids, weights = [], [], []
+        for from_id, to_id, distance in edges:
+            from_ids.append(from_id)
+            to_ids.append(to_id)
+            weights.append(distance)
+        return cls.from_arrays(from_ids, to_ids, weights, ids)
+
+    @classmethod
+    def from_arrays(cls, from_ids, to_ids, weights, ids=()):
+        """construct graph from three parallel sequences
+
+        """
+        import numpy as np
+        all_ids = sorted(set(ids).union(from_ids).union(to_ids))
+        index = dict((k, i) for i, k in enumerate(all_ids))
+        src = np.array([index[k] for k in from_ids], dtype=np.int32)
+        dst = np.array([index[k] for k in to_ids], dtype=np.int32)
+        weights = np.asarray(weights, dtype=float)
+        return cls.from_index_arrays(all_ids, src, dst, weights)
+
+    @classmethod
+    def from_index_arrays(cls, ids, src, dst, weights):
+        """construct graph from edges already expressed as indices in ids
+
+        """
+        import numpy as np
+        n = len(ids)
+        order = np.arange(len(src))
+        # both directions; then sort by row, column, input order
+        rows = np.concatenate((src, dst))
+        cols = np.concatenate((dst, src))
+        weights = np.concatenate((weights, weights))
+        order = np.concatenate((order, order))
+        perm = np.lexsort((order, cols, rows))
+        rows, cols, weights = rows[perm], cols[perm], weights[perm]
+        # keep last occurrence of each (row, col)
+        keep = np.ones(len(rows), dtype=bool)
+        keep[:-1] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+        rows, cols, weights = rows[keep], cols[keep], weights[keep]
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+        return cls(ids, indptr, cols, weights)
+
+    @classmethod
+    def from_distances(cls, distances):
+        """construct graph from a dictionary of dictionaries
+
+        """
+        return cls.from_edges(
+            ((a, b, d) for a, row in distances.items()
+             for b, d in row.items()), distances.keys())
+
+    def neighbours(self, i):
+        """array of neighbour indices of index i, sorted
+
+        """
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def neighbour_weights(self, i):
+        """array of distances from index i, parallel to neighbours(i)
+
+        """
+        return self.weights[self.indptr[i]:self.indptr[i + 1]]
+
+    def degrees(self):
+        """array with number of neighbours of each index
+
+        """
+        import numpy as np
+        return np.diff(self.indptr)
+
+    def edges(self):
+        """arrays (src, dst, weights) holding each edge once, src < dst
+
+        """
+        import numpy as np
+        src = np.repeat(np.arange(len(self.ids), dtype=np.int32),
+                        self.degrees())
+        once = src < self.indices
+        return src[once], self.indices[once], self.weights[once]
+
+    def subgraph(self, ids):
+        """the graph between ids only
+
+        """
+        import numpy as np
+        keep = np.array(sorted(self.index[k] for k in ids), dtype=np.int64)
+        remap = np.full(len(self.ids), -1, dtype=np.int64)
+        remap[keep] = np.arange(len(keep))
+        starts, counts = self.indptr[keep], self.degrees()[keep]
+        # concatenate the rows we keep
+        within = np.arange(counts.sum()) - np.repeat(
+            np.cumsum(counts) - counts, counts)
+        rows = np.repeat(starts, counts) + within
+        indices = remap[self.indices[rows]]
+        inside = indices >= 0
+        owners = np.repeat(np.arange(len(keep)), counts)[inside]
+        indptr = np.zeros(len(keep) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(owners, minlength=len(keep)), out=indptr[1:])
+        return DistanceGraph([self.ids[i] for i in keep], indptr,
+                             indices[inside], self.weights[rows][inside])
+
+    def triangles(self):
+        """generate all triangles, as sorted (i, j, k) index triples
+
+        edges are oriented from lower to higher degree, ties broken by
+        index, so that each triangle is found exactly once, from its lowest
+        ranked vertex, and no vertex has more than sqrt(2m) out-neighbours.
+        the third vertex is found intersecting two sorted out-neighbour
+        arrays.  total work is O(m sqrt(m)).
+
+        """
+        import numpy as np
+        n = len(self.ids)
+        degrees = self.degrees()
+        rank = np.empty(n, dtype=np.int64)
+        rank[np.lexsort((np.arange(n), degrees))] = np.arange(n)
+        rows = np.repeat(np.arange(n, dtype=np.int32), degrees)
+        keep = rank[rows] < rank[self.indices]
+        out_indices = self.indices[keep]
+        out_indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows[keep], minlength=n), out=out_indptr[1:])
+        out_indptr = out_indptr.tolist()
+        for u in range(n):
+            out_u = out_indices[out_indptr[u]:out_indptr[u + 1]]
+            if len(out_u) < 2:
+                continue
+            for v in out_u.tolist():
+                out_v = out_indices[out_indptr[v]:out_indptr[v + 1]]
+                if not len(out_v):
+                    continue
+                at = np.minimum(out_v.searchsorted(out_u), len(out_v) - 1)
+                for w in out_u[out_v[at] == out_u].tolist():
+                    yield tuple(sorted((u, v, w)))
+
+    def __getitem__(self, key):
+        return _DistanceRow(self, self.index[key])
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, key):
+        return key in self.index
+
+
+MalformedRow = namedtuple('MalformedRow', 'line_number text reason')
+
+
+def _parse_distance_row(fields):
+    """check and convert one split row, return (from_id, to_id, distance)
+
+    """
+    from math import isinf, isnan
+    if len(fields) < 3:
+        raise ValueError('expected 3 fields, got %d' % len(fields))
+    distance = float(fields[2])
+    if isnan(distance) or isinf(distance) or distance < 0:
+        raise ValueError('invalid distance %s' % fields[2].strip())
+    return fields[0].strip(), fields[1].strip(), distance
+
+
+def iter_distance_chunks(stream, errors=None, chunk_size=65536):
+    """read stream of from,to,distance rows, chunk_size lines at a time
+
+    yield one (from_ids, to_ids, distances) triple per chunk, the first two
+    lists of strings, the third a NumPy array.  only one chunk is ever held
+    in memory.
+
+    rows which can not be parsed are skipped, and if errors is a list, a
+    MalformedRow is appended to it for each of them.  blank lines are
+    silently skipped.
+
+    """
+    from itertools import islice
+    import numpy as np
+    line_number = 0
+    while True:
+        lines = list(islice(stream, chunk_size))
+        if not lines:
+            break
+        rows = [(line_number + offset + 1, l.strip())
+                for offset, l in enumerate(lines) if l.strip()]
+        line_number += len(lines)
+        fields = [l.split(',', 3) for n, l in rows]
+        try:
+            # fast path: the whole chunk converted at once
+            if any(len(f) < 3 for f in fields):
+                raise ValueError
+            distances = np.array([f[2] for f in fields]).astype(float)
+            if not (np.isfinite(distances) & (distances >= 0)).all():
+                raise ValueError
+            from_ids = [f[0].strip() for f in fields]
+            to_ids = [f[1].strip() for f in fields]
+        except ValueError:
+            # slow path: one row at a time, collecting what goes wrong
+            from_ids, to_ids, distances = [], [], []
+            for (n, l), f in zip(rows, fields):
+                try:
+                    from_id, to_id, distance = _parse_distance_row(f)
+                except ValueError, e:
+                    if errors is not None:
+                        errors.append(MalformedRow(n, l, str(e)))
+                    continue
+                from_ids.append(from_id)
+                to_ids.append(to_id)
+                distances.append(distance)
+            distances = np.array(distances, dtype=float)
+        yield from_ids, to_ids, distances
+
+
+def _init_connectivity(points, distances):
+    """inform each point on how many links lead to referenced point
+
+    """
+    if isinstance(distances, DistanceGraph):
+        import numpy as np
+        referenced = np.array([
+            'coordinates' in points.get(k, {}) for k in distances.ids],
+            dtype=bool)
+        rows = np.repeat(np.arange(len(distances.ids)), distances.degrees())
+        counts = np.bincount(rows, weights=referenced[distances.indices],
+                             minlength=len(distances.ids))
+        for n, point in points.items():
+            i = distances.index.get(n)
+            point['prio'] = 0 if i is None else int(counts[i])
+            point['computed'] = False
+        return
     for n, point in points.items():
-        point['prio'] = len(filter(lambda x: 'coordinates' in points[x],
-                                   distances.get(n, {}).keys()))
+        point['prio'] = len([x for x in distances.get(n, {})
+                             if 'coordinates' in points[x]])
         point['computed'] = False
+
+
+def read_distance_graph(stream, points, errors=None, chunk_size=65536):
+    """like get_distances_from_csv, but construct a DistanceGraph
+
+    edges are interned chunk by chunk as integer arrays, so the text is
+    never held in memory as a whole.
+
+    """
+    import numpy as np
+    index = {}
+    srcs, dsts, weights = [], [], []
+    for from_ids, to_ids, distances in iter_distance_chunks(
+            stream, errors, chunk_size):
+        srcs.append(np.array([index.setdefault(k, len(index))
+                              for k in from_ids], dtype=np.int32))
+        dsts.append(np.array([index.setdefault(k, len(index))
+                              for k in to_ids], dtype=np.int32))
+        weights.append(distances)
+    # renumber in sorted id order
+    ids = sorted(index)
+    renumber = np.empty(len(ids), dtype=np.int32)
+    for i, k in enumerate(ids):
+        renumber[index[k]] = i
+        points.setdefault(k, {'id': k,
+                              "type": "Point"})
+    empty = np.zeros(0, dtype=np.int32)
+    graph = DistanceGraph.from_index_arrays(
+        ids,
+        renumber[np.concatenate(srcs or [empty])],
+        renumber[np.concatenate(dsts or [empty])],
+        np.concatenate(weights or [np.zeros(0)]))
+    _init_connectivity(points, graph)
+    return graph
+
+
+def get_distances_from_csv(stream, points, errors=None):
+    """read from,to,distance rows from stream into a dict of dicts
+
+    points found in the stream are added to points, and all points receive
+    their 'prio' and 'computed' values.  malformed rows are skipped, see
+    iter_distance_chunks about errors.
+
+    """
+    distances = {}
+    for from_ids, to_ids, chunk_distances in iter_distance_chunks(
+            stream, errors):
+        for from_id, to_id, distance in zip(
+                from_ids, to_ids, chunk_distances.tolist()):
+            distances.setdefault(from_id, {})
+            distances.setdefault(to_id, {})
+            distances[from_id][to_id] = distance
+            distances[to_id][from_id] = distance
+            points.setdefault(to_id, {'id': to_id,
+                                      "type": "Point"})
+            points.setdefault(from_id, {'id': from_id,
+                                        "type": "Point"})
+    _init_connectivity(points, distances)
     return distances
+
+
+GRAPH_CACHE_MAGIC = 'DMTCGRF1'
+
+
+def _csv_cache_key(filename):
+    """identify the current content of filename, cheaply
+
+    size and modification time, plus a SHA1 of the first and last 64KiB,
+    so that checking the key does not cost a full read of the file.
+
+    """
+    import os
+    import hashlib
+    st = os.stat(filename)
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        sha1.update(f.read(65536))
+        if st.st_size > 65536:
+            f.seek(max(65536, st.st_size - 65536))
+            sha1.update(f.read())
+    return {'size': st.st_size, 'mtime': st.st_mtime,
+            'sha1': sha1.hexdigest()}
+
+
+def _graph_cache_layout(header):
+    """offsets of ids blob and arrays, all arrays aligned at 8 bytes
+
+    """
+    start = len(GRAPH_CACHE_MAGIC) + 8 + header['header_bytes']
+    layout = {'ids': start}
+    offset = start + header['ids_bytes']
+    for name, dtype, count in [('indptr', '<i8', header['nodes'] + 1),
+                               ('indices', '<i4', header['entries']),
+                               ('weights', '<f8', header['entries'])]:
+        offset += -offset % 8
+        layout[name] = (offset, dtype, count)
+        offset += count * int(dtype[-1])
+    return layout
+
+
+def _json_row(row):
+    """MalformedRow as a JSON-able list, byte strings read as latin-1
+
+    latin-1 maps every byte to a character, so any csv row survives the
+    trip, whatever its encoding; see _unjson_row.
+
+    """
+    return [i.decode('latin-1') if isinstance(i, str) else i for i in row]
+
+
+def _unjson_row(row):
+    return MalformedRow(*[i.encode('latin-1') if isinstance(i, unicode)
+                          else i for i in row])
+
+
+def write_graph_cache(filename, graph, key, errors=()):
+    """write graph to binary file filename, marked with key
+
+    the file starts with a magic string, the length of a JSON header and
+    the header itself, holding key, sizes and malformed rows.  then come
+    the newline separated ids, and the indptr, indices, weights arrays.
+
+    the file is written aside and renamed into place.
+
+    """
+    import os
+    import json
+    import struct
+    import numpy as np
+    ids_blob = '\n'.join(graph.ids)
+    header = dict(key)
+    header.update({'nodes': len(graph.ids),
+                   'entries': len(graph.indices),
+                   'ids_bytes': len(ids_blob),
+                   'errors': [_json_row(e) for e in errors]})
+    header_json = json.dumps(header)
+    header['header_bytes'] = len(header_json)
+    layout = _graph_cache_layout(header)
+    tmp_name = filename + '.tmp'
+    with open(tmp_name, 'wb') as f:
+        f.write(GRAPH_CACHE_MAGIC)
+        f.write(struct.pack('<Q', len(header_json)))
+        f.write(header_json)
+        f.write(ids_blob)
+        for name in ['indptr', 'indices', 'weights']:
+            offset, dtype, count = layout[name]
+            f.write('\0' * (offset - f.tell()))
+            f.write(np.asarray(getattr(graph, name), dtype=dtype).tostring())
+    if os.path.exists(filename):
+        os.remove(filename)
+    os.rename(tmp_name, filename)
+
+
+def read_graph_cache(filename, key=None, errors=None):
+    """memory-map the graph written by write_graph_cache to filename
+
+    return None if the file is missing, damaged, or not marked with key.
+    malformed rows recorded in the file are appended to errors.
+
+    """
+    import json
+    import struct
+    import numpy as np
+    try:
+        with open(filename, 'rb') as f:
+            if f.read(len(GRAPH_CACHE_MAGIC)) != GRAPH_CACHE_MAGIC:
+                return None
+            header_bytes, = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(header_bytes))
+            if key is not None and any(
+                    header.get(k) != v for k, v in key.items()):
+                return None
+            header['header_bytes'] = header_bytes
+            ids_blob = f.read(header['ids_bytes'])
+    except (IOError, ValueError, struct.error):
+        return None
+    ids = [str(k) for k in ids_blob.split('\n')] if ids_blob else []
+    layout = _graph_cache_layout(header)
+    arrays = {}
+    for name in ['indptr', 'indices', 'weights']:
+        offset, dtype, count = layout[name]
+        if count == 0:
+            arrays[name] = np.zeros(0, dtype=dtype)
+            continue
+        try:
+            arrays[name] = np.memmap(filename, dtype=dtype, mode='r',
+                                     offset=offset, shape=(count, ))
+        except (IOError, ValueError):
+            return None
+    if errors is not None:
+        errors.extend(_unjson_row(e) for e in header['errors'])
+    return DistanceGraph(ids, arrays['indptr'], arrays['indices'],
+                         arrays['weights'])
+
+
+def load_distance_graph(filename, points, errors=None, cache=True):
+    """read distances graph from csv filename, through a binary sidecar
+
+    the sidecar is filename + '.graph'.  it is used when it matches the
+    size, modification time and sampled hash of filename, and is otherwise
+    (re)written after parsing.  an unwritable sidecar is not an error.
+
+    points and errors are treated as in read_distance_graph.
+
+    """
+    sidecar = filename + '.graph'
+    key = _csv_cache_key(filename)
+    graph = None
+    if cache:
+        graph = read_graph_cache(sidecar, key, errors)
+    if graph is not None:
+        for k in graph.ids:
+            points.setdefault(k, {'id': k,
+                                  "type": "Point"})
+        _init_connectivity(points, graph)
+        return graph
+    collected = []
+    with open(filename) as f:
+        graph = read_distance_graph(f, points, collected)
+    if errors is not None:
+        errors.extend(collected)
+    if cache:
+        try:
+            write_graph_cache(sidecar, graph, key, collected)
+        except Exception:
+            # the sidecar is only a speedup, never fail the load for it
+            pass
+    return graph